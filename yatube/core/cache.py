@@ -0,0 +1,232 @@
+"""Cache backend shared by all worker processes on one machine.
+
+Entries live in a SQLite file (WAL mode, so readers do not block the
+writer). The cache is limited by MAX_ENTRIES and by MAX_SIZE in bytes;
+when either is exceeded the least recently used entries are evicted.
+
+The number of entries and their total size are kept in the single row
+of cache_stats by triggers, in the same transaction as every change to
+the cache table, so a write checks the limits without scanning it.
+Expired entries are swept only when a limit is reached, as with
+Django's database cache."""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+# one transaction, so no write slips in between counting the entries
+# of an existing file and creating the triggers
+SCHEMA = '''
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT INTO cache_stats (id, entries, size)
+    SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM cache
+    WHERE NOT EXISTS (SELECT 1 FROM cache_stats)
+    HAVING NOT EXISTS (SELECT 1 FROM cache_stats);
+CREATE TRIGGER IF NOT EXISTS cache_inserted AFTER INSERT ON cache BEGIN
+    UPDATE cache_stats SET entries = entries + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_deleted AFTER DELETE ON cache BEGIN
+    UPDATE cache_stats SET entries = entries - 1, size = size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_resized AFTER UPDATE OF size ON cache
+BEGIN
+    UPDATE cache_stats SET size = size - OLD.size + NEW.size;
+END;
+COMMIT;
+'''
+
+
+class SQLiteCache(BaseCache):
+    """
+    Settings:
+    - LOCATION: path to the SQLite file
+    - OPTIONS['MAX_ENTRIES']: the number of entries kept (default 300)
+    - OPTIONS['MAX_SIZE']: the total size of values in bytes
+    (default 64 MB)
+    - OPTIONS['CULL_FREQUENCY']: 1/CULL_FREQUENCY of the entries is
+    evicted when a limit is reached (default 3)
+    - OPTIONS['TOUCH_INTERVAL']: reads refresh the access time at most
+    once per this many seconds, so hot keys do not turn every get
+    into a write (default 10).
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._touch_interval = float(options.get('TOUCH_INTERVAL', 10))
+        self._local = threading.local()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after fork."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self._path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            # rows replaced by INSERT OR REPLACE fire cache_deleted too
+            db.execute('PRAGMA recursive_triggers=ON')
+            db.executescript(SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _write(self, statements) -> None:
+        """Runs (sql, params) pairs in one write transaction."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                db.execute(sql, params)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _fetch(self, keys) -> dict:
+        """Returns {key: value} for live entries and refreshes
+        the access time of entries not touched for a while."""
+        started = time.perf_counter()
+        now = time.time()
+        placeholders = ','.join('?' * len(keys))
+        rows = self._db.execute(
+            f'SELECT key, value, expires, accessed FROM cache '
+            f'WHERE key IN ({placeholders})', keys).fetchall()
+        found, stale = {}, []
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            found[key] = pickle.loads(value)
+            if now - accessed > self._touch_interval:
+                stale.append(key)
+        if stale:
+            placeholders = ','.join('?' * len(stale))
+            self._write([(f'UPDATE cache SET accessed = ? '
+                          f'WHERE key IN ({placeholders})', [now, *stale])])
+        metrics.record_cache(len(found), len(keys) - len(found),
+                             time.perf_counter() - started)
+        return found
+
+    def _cull_statements(self) -> list:
+        """Once a limit is reached, evicts expired entries, then the
+        least recently used ones."""
+        entries, size = self._db.execute(
+            'SELECT entries, size FROM cache_stats').fetchone()
+        if entries < self._max_entries and size <= self._max_size:
+            return []
+        if self._cull_frequency == 0:
+            return [('DELETE FROM cache', [])]
+        return [
+            ('DELETE FROM cache WHERE expires <= ?', [time.time()]),
+            ('DELETE FROM cache WHERE key IN ('
+             'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+             [max(entries // self._cull_frequency, 1)]),
+        ]
+
+    def _store(self, items: dict, timeout, replace: bool = True) -> list:
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        statements = []
+        for key, value in items.items():
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            statements.append((
+                f'{verb} INTO cache (key, value, size, expires, accessed) '
+                f'VALUES (?, ?, ?, ?, ?)',
+                [key, pickled, len(pickled), expires, now]))
+        return statements
+
+    def _key(self, key, version=None) -> str:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._fetch([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        made = {self._key(key, version): key for key in keys}
+        return {made[key]: value
+                for key, value in self._fetch(list(made)).items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._write(self._cull_statements()
+                    + self._store({key: value}, timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = {self._key(key, version): value
+                 for key, value in data.items()}
+        self._write(self._cull_statements() + self._store(items, timeout))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        db = self._db
+        # an expired entry is dropped first, so it does not block the insert
+        self._write(self._cull_statements() + [
+            ('DELETE FROM cache WHERE key = ? AND expires <= ?',
+             [key, time.time()])])
+        before = db.total_changes
+        self._write(self._store({key: value}, timeout, replace=False))
+        return db.total_changes > before
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        db = self._db
+        before = db.total_changes
+        self._write([('UPDATE cache SET expires = ? WHERE key = ? '
+                      'AND (expires IS NULL OR expires > ?)',
+                      [self.get_backend_timeout(timeout), key,
+                       time.time()])])
+        return db.total_changes > before
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._write([('DELETE FROM cache WHERE key = ?', [key])])
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            placeholders = ','.join('?' * len(keys))
+            self._write([(f'DELETE FROM cache WHERE key IN ({placeholders})',
+                          keys)])
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [key, time.time()]).fetchone() is not None
+
+    def clear(self):
+        self._write([('DELETE FROM cache', [])])
+
+    def close(self, **kwargs):
+        """Connections are kept open between requests."""
@@ -0,0 +1,11 @@
+"""Pragmas for every new SQLite connection of the project databases
+(settings.SQLITE_PRAGMAS), run from the connection_created signal."""
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', ''),
+    'sqlite': ('core.cache.SQLiteCache', 'cache.sqlite3'),
+}
+
+
+def zipf_keys(count: int, keys: int, seed: int) -> list:
+    """Returns count keys where the key of rank r is requested
+    about 1/r times as often as the most popular one."""
+    weights = [1 / rank for rank in range(1, keys + 1)]
+    return random.Random(seed).choices(range(keys), weights, k=count)
+
+
+def worker(backend, location, options, requests, queue):
+    """Serves its share of requests: a miss renders (sets) the key."""
+    cache = import_string(backend)(location, {'OPTIONS': options})
+    hits = 0
+    for key in requests:
+        if cache.get(f'page-{key}') is None:
+            cache.set(f'page-{key}', 'x' * 2048)
+        else:
+            hits += 1
+    queue.put(hits)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает долю попаданий в кэш для разных бэкендов '
+            'в зависимости от числа рабочих процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8')
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--max-entries', type=int, default=1000)
+        parser.add_argument('--backends', default=','.join(BACKENDS))
+
+    def handle(self, *args, **options):
+        requests = zipf_keys(options['requests'], options['keys'], seed=1)
+        cache_options = {'MAX_ENTRIES': options['max_entries']}
+        self.stdout.write(f'{"backend":<10}{"workers":>8}'
+                          f'{"hit ratio":>12}{"seconds":>10}')
+        for name in options['backends'].split(','):
+            backend, filename = BACKENDS[name]
+            for workers in map(int, options['workers'].split(',')):
+                directory = tempfile.mkdtemp()
+                location = (os.path.join(directory, filename)
+                            if filename else f'bench-{workers}')
+                queue = multiprocessing.Queue()
+                started = time.perf_counter()
+                processes = [
+                    multiprocessing.Process(
+                        target=worker,
+                        args=(backend, location, cache_options,
+                              requests[num::workers], queue))
+                    for num in range(workers)]
+                for process in processes:
+                    process.start()
+                hits = sum(queue.get() for _ in processes)
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - started
+                shutil.rmtree(directory, ignore_errors=True)
+                self.stdout.write(
+                    f'{name:<10}{workers:>8}'
+                    f'{hits / len(requests):>12.1%}{elapsed:>10.2f}')
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик '
+            '(YATUBE_REPLICAS). С --interval повторяет копирование, '
+            'как реплика с отставанием на этот срок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Секунд между копиями.')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не настроены, укажите файлы '
+                               'в YATUBE_REPLICAS.')
+        while True:
+            started = time.perf_counter()
+            self.sync()
+            self.stdout.write(
+                f'Реплик обновлено: {len(settings.DATABASE_REPLICAS)} '
+                f'за {time.perf_counter() - started:.2f} с.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self) -> None:
+        """The backup API copies a consistent snapshot of the primary,
+        even while it is being written to."""
+        source = sqlite3.connect(settings.DATABASES['default']['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'],
+                                         timeout=30)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+        finally:
+            source.close()
@@ -0,0 +1,250 @@
+"""Lightweight per-request metrics, cheap enough for production.
+
+core.middleware.MetricsMiddleware measures a sampled share of requests
+(settings.METRICS_SAMPLE_RATE): the number of SQL queries and their
+time (through connection.execute_wrapper), the time spent rendering
+templates, hits and misses of core.cache.SQLiteCache and the total
+latency. A measured response gets a Server-Timing header.
+
+The numbers are summed up per view in the memory of the process and
+appended as one JSON line to settings.METRICS_FILE at most every
+settings.METRICS_FLUSH_INTERVAL seconds; the staff-only /metrics/ page
+shows the totals collected since the last flush. Other apps add their
+own numbers (queue depths and the like) with register_gauge()."""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histogram, in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_local = threading.local()
+_gauges = {}
+
+
+class RequestMetrics:
+    """What one request spent its time on."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+        self.template_depth = 0
+        self.cache = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - started
+            self.queries += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        return ', '.join([
+            f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.templates * 1000:.1f}',
+            f'cache;dur={self.cache * 1000:.1f};'
+            f'desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def current():
+    """Metrics of the request being measured in this thread, or None."""
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def measure():
+    """Collects RequestMetrics for everything run inside the block."""
+    measured = RequestMetrics()
+    _local.metrics = measured
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(measured.record_query))
+            yield measured
+    finally:
+        _local.metrics = None
+
+
+def record_cache(hits: int, misses: int, seconds: float) -> None:
+    """Called by the cache backend after every read."""
+    measured = current()
+    if measured is not None:
+        measured.cache_hits += hits
+        measured.cache_misses += misses
+        measured.cache += seconds
+
+
+def register_gauge(name: str, read) -> None:
+    """read() returns a JSON-serializable value that is added
+    to every snapshot under gauges[name]."""
+    _gauges[name] = read
+
+
+def read_gauges() -> dict:
+    values = {}
+    for name, read in _gauges.items():
+        try:
+            values[name] = read()
+        except Exception:
+            logger.exception('Gauge %s failed', name)
+            values[name] = None
+    return values
+
+
+def time_templates() -> None:
+    """Wraps the render() of Django template backend templates, which
+    views call through render() and render_to_string(), so measured
+    requests add up the time of their outermost template renders."""
+    from django.template.backends.django import Template
+    render = Template.render
+    if getattr(render, 'timed', False):
+        return
+
+    @wraps(render)
+    def timed_render(self, context=None, request=None):
+        measured = current()
+        if measured is None:
+            return render(self, context, request)
+        started = time.perf_counter()
+        measured.template_depth += 1
+        try:
+            return render(self, context, request)
+        finally:
+            measured.template_depth -= 1
+            if not measured.template_depth:
+                measured.templates += time.perf_counter() - started
+
+    timed_render.timed = True
+    Template.render = timed_render
+
+
+class ViewTotals:
+    """Sums over the measured requests of one view."""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, status: int, measured: RequestMetrics, total: float):
+        self.requests += 1
+        self.errors += status >= 500
+        self.latency += total
+        self.max_latency = max(self.max_latency, total)
+        self.histogram[bisect_left(LATENCY_BUCKETS, total * 1000)] += 1
+        self.queries += measured.queries
+        self.sql += measured.sql
+        self.templates += measured.templates
+        self.cache_hits += measured.cache_hits
+        self.cache_misses += measured.cache_misses
+
+    def percentile(self, share: float):
+        """Upper bound of the histogram bucket holding the percentile,
+        None if it is above the last bucket."""
+        wanted = share * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return None
+
+    def summary(self) -> dict:
+        requests = self.requests
+        return {
+            'requests': requests,
+            'errors': self.errors,
+            'latency_ms': {
+                'avg': round(self.latency / requests * 1000, 2),
+                'max': round(self.max_latency * 1000, 2),
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+            },
+            'queries_avg': round(self.queries / requests, 2),
+            'sql_ms_avg': round(self.sql / requests * 1000, 2),
+            'template_ms_avg': round(self.templates / requests * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+class Aggregates:
+    """Per-view totals of this process since the last flush."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.views = {}
+        self.since = timezone.now()
+        self.flushed_at = time.monotonic()
+
+    def add(self, view: str, status: int, measured: RequestMetrics,
+            total: float) -> None:
+        with self._lock:
+            if view not in self.views:
+                self.views[view] = ViewTotals()
+            self.views[view].add(status, measured, total)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snapshot = {
+                'since': self.since.isoformat(),
+                'until': timezone.now().isoformat(),
+                'pid': os.getpid(),
+                'sample_rate': settings.METRICS_SAMPLE_RATE,
+                'views': {view: totals.summary()
+                          for view, totals in sorted(self.views.items())},
+            }
+        snapshot['gauges'] = read_gauges()
+        return snapshot
+
+    def flush_if_due(self) -> None:
+        """Appends the totals to METRICS_FILE once the interval has
+        passed and starts over; a failed write only loses the totals."""
+        if (time.monotonic() - self.flushed_at
+                < settings.METRICS_FLUSH_INTERVAL):
+            return
+        snapshot = self.snapshot()
+        with self._lock:
+            self.reset()
+        if not snapshot['views']:
+            return
+        path = settings.METRICS_FILE
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as dump:
+                dump.write(json.dumps(snapshot) + '\n')
+        except OSError:
+            logger.exception('Could not write metrics to %s', path)
+
+
+aggregates = Aggregates()
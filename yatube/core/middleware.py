@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.conf import settings
+
+from . import metrics, routers
+
+
+class MetricsMiddleware:
+    """
+    Measures a sampled share of requests with core.metrics.
+
+    Stands first in MIDDLEWARE, so the latency includes all the other
+    middleware. Requests that are not sampled only cost a random().
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        with metrics.measure() as measured:
+            response = self.get_response(request)
+        total = measured.elapsed()
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = measured.server_timing(total)
+        match = request.resolver_match
+        metrics.aggregates.add(match.view_name if match else 'unresolved',
+                               response.status_code, measured, total)
+        metrics.aggregates.flush_if_due()
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Chooses between the primary and the replicas for each request,
+    see core.routers.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.finish_request()
+        if wrote:
+            seconds = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(routers.STICKY_COOKIE,
+                                str(time.time() + seconds),
+                                max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in ('GET', 'HEAD')
+                and request.resolver_match.view_name
+                in settings.REPLICA_VIEWS
+                and not routers.is_sticky(request)):
+            routers.read_from_replica()
@@ -0,0 +1,69 @@
+"""Sends the reads of feed pages to read replicas.
+
+ReplicaMiddleware lets a request read from a replica when it is a GET
+or HEAD of a view in settings.REPLICA_VIEWS and the visitor has not
+written anything for settings.REPLICA_STICKY_SECONDS. A request that
+writes to the primary sets a cookie that keeps the visitor on the
+primary for that long, so authors see their own changes while the
+replicas catch up. ReplicaRouter sends the reads of replica requests
+to a random database of settings.DATABASE_REPLICAS; everything else
+uses default.
+
+Locally the replicas are copies of db.sqlite3 kept up to date by the
+sync_replicas command."""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+STICKY_COOKIE = 'primary_until'
+
+_local = threading.local()
+
+
+def start_request() -> None:
+    _local.replica = None
+    _local.wrote = False
+
+
+def finish_request() -> bool:
+    """Returns True if the request wrote to the primary."""
+    wrote = getattr(_local, 'wrote', False)
+    start_request()
+    return wrote
+
+
+def read_from_replica() -> None:
+    """Sends the rest of the request's reads to one of the replicas."""
+    if settings.DATABASE_REPLICAS:
+        _local.replica = random.choice(settings.DATABASE_REPLICAS)
+
+
+def on_replica() -> bool:
+    return getattr(_local, 'replica', None) is not None
+
+
+def is_sticky(request) -> bool:
+    """The visitor wrote something a moment ago."""
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return getattr(_local, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        _local.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same rows as the primary."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Replicas are copies and get the schema with the data."""
+        return db not in settings.DATABASE_REPLICAS
@@ -1,6 +1,21 @@
-from django.test import TestCase, Client
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase, Client, override_settings
 from http import HTTPStatus
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from . import metrics, routers
+from .cache import SQLiteCache
+from .middleware import ReplicaMiddleware
 
 
 User = get_user_model()
@@ -17,3 +32,196 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class SQLiteCacheTests(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_cache_shared_between_instances(self):
+        """Записи видны всем экземплярам кэша с одним файлом."""
+        writer = self.make_cache()
+        reader = self.make_cache()
+        writer.set('key', {'value': 1})
+        self.assertEqual(reader.get('key'), {'value': 1})
+        self.assertFalse(reader.add('key', 'other'))
+        reader.delete('key')
+        self.assertIsNone(writer.get('key'))
+        self.assertTrue(writer.add('key', 'other'))
+
+    def test_cache_expiry(self):
+        """Просроченные записи не возвращаются."""
+        cache = self.make_cache()
+        cache.set('key', 'value', timeout=0)
+        self.assertIsNone(cache.get('key'))
+        self.assertTrue(cache.add('key', 'value', timeout=None))
+        self.assertEqual(cache.get_many(['key', 'missing']),
+                         {'key': 'value'})
+
+    def test_cache_evicts_least_recently_used(self):
+        """При переполнении вытесняются давно не читанные записи."""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3,
+                                TOUCH_INTERVAL=0)
+        for key in ('first', 'second', 'third'):
+            cache.set(key, key)
+            time.sleep(0.01)
+        cache.get('first')
+        cache.set('fourth', 'fourth')
+        self.assertFalse(cache.has_key('second'))
+        for key in ('first', 'third', 'fourth'):
+            with self.subTest(key=key):
+                self.assertTrue(cache.has_key(key))
+
+    def test_cache_max_size(self):
+        """Общий размер значений ограничен MAX_SIZE."""
+        cache = self.make_cache(MAX_SIZE=2048, CULL_FREQUENCY=2)
+        for num in range(10):
+            cache.set(f'key-{num}', b'x' * 1000)
+        size = cache._db.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+        self.assertLessEqual(size, 2048 + 1100)
+
+    def test_cache_stats_follow_entries(self):
+        """Счётчики записей и их размера в cache_stats совпадают
+        с таблицей после любых изменений."""
+        cache = self.make_cache(MAX_ENTRIES=4, CULL_FREQUENCY=2)
+        for num in range(6):
+            cache.set(f'key-{num}', 'x' * num)
+        cache.set('key-5', 'longer value')
+        cache.add('key-5', 'ignored')
+        cache.set_many({'key-6': 'a', 'key-7': 'bb'})
+        cache.delete('key-6')
+        db = cache._db
+        expected = db.execute(
+            'SELECT COUNT(*), SUM(size) FROM cache').fetchone()
+        self.assertEqual(
+            db.execute('SELECT entries, size FROM cache_stats').fetchone(),
+            expected)
+        self.assertLessEqual(expected[0], 4)
+        self.assertEqual(self.make_cache()._db.execute(
+            'SELECT entries, size FROM cache_stats').fetchone(), expected)
+        cache.clear()
+        self.assertEqual(
+            db.execute('SELECT entries, size FROM cache_stats').fetchone(),
+            (0, 0))
+
+
+class MetricsTests(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, 'metrics', 'metrics.jsonl')
+        metrics.aggregates.reset()
+        self.addCleanup(metrics.aggregates.reset)
+        cache.clear()
+
+    def test_server_timing(self):
+        """Замеренный ответ несёт Server-Timing, незамеренный — нет."""
+        with override_settings(METRICS_SAMPLE_RATE=1):
+            response = self.client.get('/')
+        timing = response['Server-Timing']
+        for name in ('db;dur=', 'tpl;dur=', 'cache;dur=', 'total;dur='):
+            with self.subTest(name=name):
+                self.assertIn(name, timing)
+        self.assertNotIn('db;dur=0.0;desc="0 queries"', timing)
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_FLUSH_INTERVAL=3600)
+    def test_aggregates_per_view(self):
+        """Суммы копятся по страницам и выгружаются в файл по интервалу."""
+        for _ in range(3):
+            self.client.get('/')
+        self.client.get('/nonexist-page/')
+        views = metrics.aggregates.snapshot()['views']
+        index = views['posts:index']
+        self.assertEqual(index['requests'], 3)
+        self.assertGreater(index['queries_avg'], 0)
+        self.assertGreater(index['template_ms_avg'], 0)
+        self.assertGreater(index['cache_hits'], 0)
+        self.assertLessEqual(index['latency_ms']['avg'],
+                             index['latency_ms']['max'])
+        self.assertEqual(views['unresolved']['requests'], 1)
+        with override_settings(METRICS_FLUSH_INTERVAL=0,
+                               METRICS_FILE=self.path):
+            self.client.get('/')
+        with open(self.path, encoding='utf-8') as dump:
+            flushed = [json.loads(line) for line in dump]
+        self.assertEqual(len(flushed), 1)
+        self.assertEqual(flushed[0]['views']['posts:index']['requests'], 4)
+        self.assertEqual(metrics.aggregates.snapshot()['views'], {})
+
+    def test_metrics_page_for_staff_only(self):
+        """Страница /metrics/ открыта только сотрудникам."""
+        user = User.objects.create_user(username='staff', is_staff=True)
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.client.force_login(user)
+        metrics.register_gauge('queue', lambda: {'depth': 3})
+        self.addCleanup(metrics._gauges.pop, 'queue')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('views', response.json())
+        self.assertEqual(response.json()['gauges']['queue'], {'depth': 3})
+
+
+class SQLitePragmasTests(TestCase):
+    def test_pragmas_applied(self):
+        """Новые соединения получают прагмы из SQLITE_PRAGMAS."""
+        expected = {'synchronous': 1, 'busy_timeout': 5000,
+                    'cache_size': -64 * 1024, 'temp_store': 2}
+        with connection.cursor() as cursor:
+            for name, value in expected.items():
+                with self.subTest(pragma=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    self.assertEqual(cursor.fetchone()[0], value)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(TestCase):
+    def run_request(self, path, method='get', write=False, **extra):
+        """Runs ReplicaMiddleware around a view that reports where
+        its reads would go; returns (database, response)."""
+        request = getattr(RequestFactory(), method)(path, **extra)
+        request.resolver_match = resolve(path)
+        used = []
+
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            used.append(router.db_for_read(User))
+            if write:
+                User.objects.create_user(username='writer')
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        response = middleware(request)
+        return used[0], response
+
+    def test_feed_reads_go_to_replica(self):
+        """Страницы лент читаются с реплики, остальное — с основной."""
+        self.assertEqual(self.run_request('/')[0], 'replica1')
+        self.assertEqual(self.run_request('/about/tech/')[0], 'replica1')
+        self.assertEqual(self.run_request('/create/')[0], 'default')
+        self.assertEqual(self.run_request('/', method='head')[0],
+                         'replica1')
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_sticky_primary_after_write(self):
+        """После записи посетитель какое-то время читает с основной."""
+        database, response = self.run_request('/', write=True)
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        cookie = response.cookies[routers.STICKY_COOKIE].value
+        database, response = self.run_request(
+            '/', HTTP_COOKIE=f'{routers.STICKY_COOKIE}={cookie}')
+        self.assertEqual(database, 'default')
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        database, _ = self.run_request(
+            '/', HTTP_COOKIE=f'{routers.STICKY_COOKIE}={time.time() - 1}')
+        self.assertEqual(database, 'replica1')
@@ -1,6 +1,10 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 from http import HTTPStatus
 
+from . import metrics as request_metrics
+
 
 def page_not_found(request, exception):
     """Настройка шаблона для страницы 404."""
@@ -21,3 +25,10 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def metrics(request):
+    """Суммы core.metrics этого процесса с последней выгрузки в файл."""
+    return JsonResponse(request_metrics.aggregates.snapshot(),
+                        json_dumps_params={'ensure_ascii': False})
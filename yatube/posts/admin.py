@@ -1,29 +1,93 @@
 """This code registers the Post and Group models with their respective custom admin classes using the admin.site.register() function.
 This makes the models editable through the admin interface, with the customizations specified in their respective admin classes."""
 from django.contrib import admin
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.urls import reverse
+from django.utils.text import Truncator
 
+from . import search
 from .models import Group, Post
+from .pagination import EstimatedCountPaginator
+
+
+class GroupIdWidget(ForeignKeyRawIdWidget):
+    """Group id input that takes the group title from the posts already
+    shown on the changelist page instead of one query per row."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.groups = {}
+
+    def label_and_url_for_value(self, value):
+        group = self.groups.get(str(value))
+        if group is None:
+            return super().label_and_url_for_value(value)
+        url = reverse(f'{self.admin_site.name}:posts_group_change',
+                      args=(group.pk,))
+        return Truncator(group).words(14), url
 
 
 class PostAdmin(admin.ModelAdmin):
     ''' Класс PostAdmin приводит админку к нужному виду.
     The PostAdmin class specifies the following customizations:
     list_display: A tuple of field names to display in the admin list view for Post objects.
-    In this case, it includes the primary key (pk), the text of the post, the publication date, the author, and the group that the post belongs to.
+    In this case, it includes the primary key (pk), the text of the post,
+    the publication date, the author, the group that the post belongs to
+    and the number of views.
     search_fields: A tuple of field names to search when the user enters a query in the admin search box.
     In this case, it includes the text field of the Post model.
     list_filter: A tuple of field names to filter the admin list view by.
     In this case, it includes the pub_date field of the Post model.
     list_editable: A tuple of field names that can be edited directly in the list view for the Post model.
     In this case, it includes the group field.
-    empty_value_display: A string to display when the value of a field is empty.'''
+    empty_value_display: A string to display when the value of a field is empty.
+    list_select_related: Authors and groups are joined to the posts
+    of the page instead of fetched row by row.
+    raw_id_fields: Authors and groups are entered by id, so no <select>
+    with every user or group is rendered.
+    date_hierarchy: Drill-down by pub_date, which uses the pub_date index
+    instead of a filter over every post.
+    readonly_fields: The number of views is shown on the post page
+    but only posts.view_counts changes it.
+    paginator, show_full_result_count: The changelist does not run
+    COUNT(*) over the whole table (see EstimatedCountPaginator).'''
 
-    list_display = ('pk', 'text', 'pub_date', 'author', 'group',)
+    list_display = ('pk', 'text', 'pub_date', 'author', 'group', 'views',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     list_editable = ('group',)
+    raw_id_fields = ('author', 'group')
+    readonly_fields = ('views',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group':
+            kwargs['widget'] = GroupIdWidget(db_field.remote_field,
+                                             self.admin_site,
+                                             using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_formset(self, request, **kwargs):
+        """Hands the groups of the posts on the page to GroupIdWidget."""
+        formset = super().get_changelist_formset(request, **kwargs)
+
+        class PageFormSet(formset):
+            def __init__(self, *args, queryset=None, **kwargs):
+                super().__init__(*args, queryset=queryset, **kwargs)
+                widget = self.form.base_fields['group'].widget
+                widget.groups = {str(post.group_id): post.group
+                                 for post in queryset or ()
+                                 if post.group_id is not None}
+
+        return PageFormSet
+
+    def get_search_results(self, request, queryset, search_term):
+        """Searches the full-text index instead of LIKE '%...%'."""
+        return search.filter_posts(queryset, search_term), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     ''' Класс GroupAdmin приводит админку по группам к нужному виду.
@@ -33,10 +97,14 @@ class GroupAdmin(admin.ModelAdmin):
     In this case, it includes the title, slug, and description fields of the Group model.
     search_fields: A tuple of field names to search when the user enters a query in the admin search box.
     In this case, it includes the title field of the Group model.
-    empty_value_display: A string to display when the value of a field is empty.'''
+    empty_value_display: A string to display when the value of a field is empty.
+    paginator, show_full_result_count: The changelist does not run
+    COUNT(*) over the whole table (see EstimatedCountPaginator).'''
 
     list_display = ('title', 'slug', 'description')
     search_fields = ('title',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from core import metrics
+        from . import signals  # noqa: F401
+        from . import view_counts
+        metrics.register_gauge('view_counts', view_counts.stats)
+        if settings.WRITE_BEHIND:
+            from . import write_queue
+            metrics.register_gauge('write_queue', write_queue.stats)
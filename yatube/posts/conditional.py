@@ -0,0 +1,105 @@
+"""ETag and Last-Modified for feed and post pages.
+
+Validators come from the version stamps of posts.feed_cache, which
+change whenever a post, comment, group or follow the page shows
+changes, so they cost a cache read (and at most one small query)
+instead of a render. Unchanged pages are answered with 304 by
+django.views.decorators.http.condition."""
+from hashlib import md5
+
+from django.http import Http404
+from django.views.decorators.http import condition
+
+from . import feed_cache
+from .follows import followed_ids
+from .models import Group, User
+
+
+def conditional_page(stamps_func):
+    """Decorator for a view whose page depends on the stamps returned
+    by stamps_func(request, *args, **kwargs), or None when the view is
+    going to answer 404. The ETag also varies on the user and the query
+    string; Last-Modified is sent to anonymous visitors only, as it
+    does not change when someone logs in or out."""
+    def stamps(request, *args, **kwargs):
+        if not hasattr(request, '_page_stamps'):
+            request._page_stamps = stamps_func(request, *args, **kwargs)
+        return request._page_stamps
+
+    def etag(request, *args, **kwargs):
+        page_stamps = stamps(request, *args, **kwargs)
+        if page_stamps is None:
+            return None
+        vary_on = (request.user.pk, request.get_full_path(), page_stamps)
+        return md5(repr(vary_on).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        page_stamps = stamps(request, *args, **kwargs)
+        if page_stamps is None or request.user.is_authenticated:
+            return None
+        return feed_cache.changed_at(page_stamps)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def page_object(request, queryset, **lookup):
+    """Fetches the object a page is about once per request,
+    so the stamps and the view share one query. None if missing."""
+    fetched = request.__dict__.setdefault('_page_objects', {})
+    key = (queryset.model, tuple(sorted(lookup.items())))
+    if key not in fetched:
+        fetched[key] = queryset.filter(**lookup).first()
+    return fetched[key]
+
+
+def page_object_or_404(request, queryset, **lookup):
+    found = page_object(request, queryset, **lookup)
+    if found is None:
+        raise Http404(f'No {queryset.model._meta.object_name} matches '
+                      f'the given query.')
+    return found
+
+
+def visitor_scopes(user) -> tuple:
+    """Profile and post pages show whether the visitor follows
+    the author and the visitor's posts and comments still waiting
+    in posts.write_queue."""
+    if not user.is_authenticated:
+        return ()
+    return f'follows:{user.pk}', f'queued:{user.pk}'
+
+
+def index_stamps(request):
+    return feed_cache.versions('index')
+
+
+def group_stamps(request, slug: str):
+    group = page_object(request, Group.objects.all(), slug=slug)
+    if group is None:
+        return None
+    return feed_cache.versions(f'group:{group.pk}')
+
+
+def profile_stamps(request, username: str):
+    author = page_object(request, User.objects.all(), username=username)
+    if author is None:
+        return None
+    return feed_cache.versions(f'profile:{author.pk}',
+                               *visitor_scopes(request.user))
+
+
+def post_stamps(request, post_id: int):
+    """The post page has a follow button for the author
+    and shows the visitor's queued comments."""
+    author_id = feed_cache.post_author(post_id)
+    if author_id is None:
+        return None
+    return feed_cache.versions(f'post:{post_id}', f'profile:{author_id}',
+                               *visitor_scopes(request.user))
+
+
+def follow_stamps(request):
+    """The feed of followed authors changes with their profiles."""
+    authors = sorted(followed_ids(request))
+    return feed_cache.versions(*visitor_scopes(request.user),
+                               *(f'profile:{pk}' for pk in authors))
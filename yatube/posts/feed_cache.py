@@ -0,0 +1,146 @@
+"""Cache for feed pages of index, group_posts and profile, and for
+post_detail pages.
+
+Every feed has a version stamp in the cache: 'index', 'group:<id>' and
+'profile:<author id>', plus 'all' shared by every feed. A post page
+depends on 'post:<id>' (the post and its comments) and on the profile
+stamp of its author (the author's post count). 'follows:<user id>'
+changes when the user follows or unfollows someone. Keys of cached
+pages and template fragments include these stamps, so saving or
+deleting a post, a comment or a group only has to replace the affected
+stamps (see posts.signals) and stale entries are never read again.
+
+A stamp is '<unix time>-<random hex>', so the newest stamp of a page
+also tells when the page last changed (see posts.conditional).
+
+A page rendered from a read replica (core.routers) may miss writes the
+replica has not received yet while carrying the new stamps, so it is
+kept only for REPLICA_CACHE_TIMEOUT instead of FEED_CACHE_TIMEOUT."""
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import routers
+
+from .models import Post
+
+ALL_FEEDS = 'all'
+
+
+def timeout() -> int:
+    """How long a page rendered by the current request is cached."""
+    if routers.on_replica():
+        return settings.REPLICA_CACHE_TIMEOUT
+    return settings.FEED_CACHE_TIMEOUT
+
+
+def version_key(scope: str) -> str:
+    return f'feed-version:{scope}'
+
+
+def new_stamp() -> str:
+    return f'{time.time():.6f}-{uuid4().hex[:12]}'
+
+
+def changed_at(stamps: str):
+    """Returns the time of the newest stamp in a string made by
+    versions(), or None if the stamps carry no time."""
+    try:
+        newest = max(float(stamp.split('-')[0])
+                     for stamp in stamps.split(':'))
+    except ValueError:
+        return None
+    return datetime.fromtimestamp(newest, timezone.utc)
+
+
+def versions(*scopes: str) -> str:
+    """Returns the current stamps of the given feeds
+    in one cache round-trip."""
+    keys = [version_key(scope) for scope in (ALL_FEEDS, *scopes)]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            stamp = new_stamp()
+            if not cache.add(key, stamp, None):
+                stamp = cache.get(key, stamp)
+            found[key] = stamp
+    return ':'.join(found[key] for key in keys)
+
+
+def invalidate(*scopes: str) -> None:
+    """Replaces the stamps of the given feeds, so their pages
+    are rendered again on the next request."""
+    cache.set_many({version_key(scope): new_stamp() for scope in scopes},
+                   None)
+
+
+def invalidate_post(post, *group_ids) -> None:
+    """Replaces the stamps of every feed the post is shown in,
+    plus the feeds of the given groups."""
+    groups = {post.group_id, *group_ids}
+    invalidate('index',
+               f'post:{post.pk}',
+               f'profile:{post.author_id}',
+               *(f'group:{group_id}' for group_id in groups if group_id))
+
+
+def page_key(scope: str, *vary_on) -> str:
+    """Returns the key of one page of a feed."""
+    digest = md5(':'.join(map(str, vary_on)).encode()).hexdigest()
+    return f'feed-page:{scope}:{versions(scope)}:{digest}'
+
+
+def get_page(key: str):
+    return cache.get(key)
+
+
+def set_page(key: str, page_obj) -> None:
+    """Stores a page with its posts already fetched. The paginator
+    keeps only its count, not the queryset of the whole feed."""
+    page_obj.object_list = list(page_obj.object_list)
+    paginator = getattr(page_obj, 'paginator', None)
+    if paginator is not None:
+        paginator.count  # counted now, before the queryset is dropped
+        paginator.object_list = ()
+    cache.set(key, page_obj, timeout())
+
+
+def post_author(post_id: int):
+    """Returns the author id of a post, or None if there is no such
+    post. Posts never change authors, so the answer is kept for good."""
+    key = f'post-author:{post_id}'
+    author_id = cache.get(key)
+    if author_id is None:
+        author_id = (Post.objects.filter(pk=post_id)
+                     .values_list('author_id', flat=True).first())
+        if author_id is not None:
+            cache.set(key, author_id, None)
+    return author_id
+
+
+def post_versions(post_id: int, author_id: int) -> str:
+    """Returns the stamps a post page depends on."""
+    return versions(f'post:{post_id}', f'profile:{author_id}')
+
+
+def get_post_page(post_id: int):
+    """Returns the cached HTML of a post page,
+    or None if it is missing or stale."""
+    entry = cache.get(f'post-page:{post_id}')
+    if entry is None:
+        return None
+    stamps, author_id, content = entry
+    if stamps != post_versions(post_id, author_id):
+        return None
+    return content
+
+
+def set_post_page(post, stamps: str, content: bytes) -> None:
+    """Stores the HTML of a post page rendered while the stamps
+    (taken before rendering) were current."""
+    cache.set(f'post-page:{post.pk}', (stamps, post.author_id, content),
+              timeout())
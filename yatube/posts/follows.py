@@ -0,0 +1,81 @@
+"""Follow and unfollow as single statements.
+
+Each operation is one INSERT OR IGNORE or one DELETE, and its row count
+tells whether anything changed. So double clicks and concurrent
+requests neither create duplicate follows nor fail, and the counters,
+the timeline and the cached feed are updated in the same transaction,
+only when a row was really inserted or deleted. Follows created or
+deleted through the ORM (admin, shell) get the same updates from
+posts.signals.
+
+followed_ids() loads the authors the visitor follows once per request
+for every follow button on the page."""
+from django.db import connection, transaction
+
+from . import feed_cache, timeline
+from .models import AuthorStats, Follow
+
+
+def _execute(sql: str, params) -> int:
+    """Runs one statement, returns the number of rows it changed."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def followed_ids(request) -> frozenset:
+    """Ids of the authors the visitor follows, one query per request,
+    none for anonymous visitors."""
+    if '_followed_ids' not in request.__dict__:
+        user = request.user
+        request._followed_ids = frozenset(
+            Follow.objects.filter(user=user)
+            .values_list('author_id', flat=True)
+            if user.is_authenticated else ())
+    return request._followed_ids
+
+
+def follow(user, author) -> bool:
+    """Returns True if the user did not follow the author before."""
+    if user.pk == author.pk:
+        return False
+    ops = connection.ops
+    with transaction.atomic():
+        created = _execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{ops.quote_name(Follow._meta.db_table)} (user_id, author_id) '
+            f'VALUES (%s, %s) '
+            f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            [user.pk, author.pk])
+        if created:
+            followed(user.pk, author.pk)
+    return bool(created)
+
+
+def unfollow(user, author) -> bool:
+    """Returns True if the user followed the author."""
+    with transaction.atomic():
+        deleted = _execute(
+            f'DELETE FROM {connection.ops.quote_name(Follow._meta.db_table)} '
+            f'WHERE user_id = %s AND author_id = %s',
+            [user.pk, author.pk])
+        if deleted:
+            unfollowed(user.pk, author.pk)
+    return bool(deleted)
+
+
+def followed(user_id: int, author_id: int) -> None:
+    """Updates everything that depends on a new follow."""
+    AuthorStats.change(author_id, 'followers', 1)
+    AuthorStats.change(user_id, 'following', 1)
+    timeline.backfill(user_id, author_id)
+    feed_cache.invalidate(f'follows:{user_id}')
+
+
+def unfollowed(user_id: int, author_id: int) -> None:
+    """Updates everything that depended on a removed follow."""
+    AuthorStats.change(author_id, 'followers', -1)
+    AuthorStats.change(user_id, 'following', -1)
+    timeline.prune(user_id, author_id)
+    timeline.unfollowed(author_id)
+    feed_cache.invalidate(f'follows:{user_id}')
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import thumbnails, uploads
 from .models import Follow, Post, Comment
 
 
@@ -16,6 +18,32 @@ class PostForm(forms.ModelForm):
                   'group': 'Группа',
                   'image': 'Картинка'}
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        """upload_errors are the files rejected while the request was
+        read, see posts.uploads.ImageLimitUploadHandler."""
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean_image(self):
+        """Checks the file size and the image dimensions read
+        from its header; the pixels are not decoded here."""
+        image = self.cleaned_data.get('image')
+        if 'image' in self.upload_errors:
+            raise forms.ValidationError(self.upload_errors['image'])
+        if isinstance(image, UploadedFile):
+            error = (uploads.check_size(image.size)
+                     or uploads.check_dimensions(*image.image.size))
+            if error:
+                raise forms.ValidationError(error)
+        return image
+
+    def save(self, commit=True):
+        """Saves the post and queues the thumbnail of a new image."""
+        post = super().save(commit)
+        if commit and 'image' in self.changed_data and post.image:
+            thumbnails.schedule(post.pk)
+        return post
+
 
 class CommentForm(forms.ModelForm):
     """
@@ -0,0 +1,98 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from posts import view_counts, views
+from posts.models import Comment, Follow, Group, Post, User
+
+
+# the pages of the sample rows must not outlive the rollback
+AUDIT_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class Rollback(Exception):
+    """Raised to undo the sample rows created for the audit."""
+
+
+def query_plan(sql: str) -> list:
+    """Returns the EXPLAIN QUERY PLAN details for a query."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_full_scan(detail: str) -> bool:
+    """A SCAN step without an index reads the whole table."""
+    return detail.startswith('SCAN') and 'INDEX' not in detail
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN QUERY PLAN для запросов страниц '
+            'с лентами постов и падает, если запрос читает всю таблицу.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Аудит поддерживает только SQLite.')
+        try:
+            with override_settings(CACHES=AUDIT_CACHES), \
+                    transaction.atomic():
+                captured = self.capture_view_queries()
+                plans = {
+                    name: [(sql, query_plan(sql)) for sql in queries]
+                    for name, queries in captured.items()}
+                raise Rollback
+        except Rollback:
+            pass
+        scans = 0
+        for name, queries in plans.items():
+            for sql, plan in queries:
+                full_scans = [step for step in plan if is_full_scan(step)]
+                scans += len(full_scans)
+                for step in full_scans:
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: {step}\n    {sql}'))
+                if options['verbosity'] > 1 and not full_scans:
+                    self.stdout.write(f'{name}: {"; ".join(plan)}')
+        if scans:
+            raise CommandError(
+                f'Найдено полных просмотров таблиц: {scans}.')
+        self.stdout.write(self.style.SUCCESS(
+            'Все запросы лент используют индексы.'))
+
+    def capture_view_queries(self) -> dict:
+        """Creates a sample author, group, post, comment and follow,
+        calls every listing view and returns {view: [SELECT ...]}.
+        Run it in a transaction that is rolled back and with a cache
+        that is thrown away."""
+        author = User.objects.create_user(username='audit-author')
+        reader = User.objects.create_user(username='audit-reader')
+        group = Group.objects.create(title='audit', slug='audit-group',
+                                     description='audit')
+        post = Post.objects.create(text='audit', author=author, group=group)
+        Comment.objects.create(text='audit', author=reader, post=post)
+        Follow.objects.create(user=reader, author=author)
+        calls = {
+            'index': (views.index, {}, AnonymousUser()),
+            'group_posts': (views.group_posts,
+                            {'slug': group.slug}, AnonymousUser()),
+            'profile': (views.profile,
+                        {'username': author.username}, reader),
+            'post_detail': (views.post_detail,
+                            {'post_id': post.pk}, AnonymousUser()),
+            'follow_index': (views.follow_index, {}, reader),
+        }
+        factory = RequestFactory()
+        captured = {}
+        for name, (view, kwargs, user) in calls.items():
+            request = factory.get('/')
+            request.user = user
+            with CaptureQueriesContext(connection) as context:
+                view(request, **kwargs)
+            captured[name] = [
+                query['sql'] for query in context.captured_queries
+                if query['sql'].startswith('SELECT')]
+        view_counts.discard([post.pk])
+        return captured
@@ -0,0 +1,190 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.management.commands.bench_views import git_revision, percentiles
+from posts.models import Post, User
+
+MODES = ('baseline', 'tuned')
+COMMENT_TEXT = 'bench_concurrency'
+# the debug toolbar is shown to INTERNAL_IPS only
+REMOTE_ADDR = '10.0.0.1'
+
+
+@contextmanager
+def throwaway_site(directory: str):
+    """Points the site at a copy of the database in directory, with its
+    own cache, write queue and metrics file and without replicas. The
+    comments, views and scores written by the benchmark go to the copy,
+    and the forked workers inherit the settings."""
+    database = settings.DATABASES['default']
+    name = database['NAME']
+    connections.close_all()
+    source = sqlite3.connect(name)
+    copy = sqlite3.connect(os.path.join(directory, 'db.sqlite3'))
+    try:
+        source.backup(copy)
+    finally:
+        copy.close()
+        source.close()
+    database['NAME'] = os.path.join(directory, 'db.sqlite3')
+    try:
+        with override_settings(
+                CACHES={'default': {
+                    **settings.CACHES['default'],
+                    'LOCATION': os.path.join(directory, 'cache.sqlite3')}},
+                WRITE_QUEUE_PATH=os.path.join(directory, 'queue.sqlite3'),
+                METRICS_FILE=os.path.join(directory, 'metrics.jsonl'),
+                DATABASE_REPLICAS=[]):
+            yield
+    finally:
+        connections.close_all()
+        database['NAME'] = name
+
+
+def set_journal_mode(mode: str) -> None:
+    """The journal mode is stored in the database file, so it is
+    switched once, while no worker is connected."""
+    connections.close_all()
+    db = sqlite3.connect(settings.DATABASES['default']['NAME'])
+    try:
+        db.execute('PRAGMA journal_mode = '
+                   + ('WAL' if mode == 'tuned' else 'DELETE'))
+    finally:
+        db.close()
+
+
+def run_worker(mode: str, seed: int, duration: float, write_share: float,
+               post_id: int, user_id: int) -> dict:
+    """Runs in a forked process: mixes reads of the index and the post
+    page with comments on the post until the time is up."""
+    connections.close_all()
+    database = connections['default'].settings_dict
+    if mode == 'baseline':
+        # Django defaults: no pragmas, a new connection for every request
+        settings.SQLITE_PRAGMAS = {}
+        database['CONN_MAX_AGE'] = 0
+    rng = random.Random(seed)
+    client = Client(REMOTE_ADDR=REMOTE_ADDR)
+    client.force_login(User.objects.get(pk=user_id))
+    index = reverse('posts:index')
+    post = reverse('posts:post_detail', args=[post_id])
+    comment = reverse('posts:add_comment', args=[post_id])
+    durations = {'read': [], 'write': []}
+    errors = 0
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline:
+            kind = 'write' if rng.random() < write_share else 'read'
+            started = time.perf_counter()
+            try:
+                if kind == 'write':
+                    response = client.post(comment, {'text': COMMENT_TEXT})
+                else:
+                    response = client.get(rng.choice((index, post)))
+            except OperationalError:
+                errors += 1
+                continue
+            if response.status_code >= 500:
+                errors += 1
+                continue
+            durations[kind].append((time.perf_counter() - started) * 1000)
+    finally:
+        connections.close_all()
+    return {'durations': durations, 'errors': errors}
+
+
+class Command(BaseCommand):
+    help = ('Нагружает index, post_detail и add_comment из нескольких '
+            'процессов сразу: SQLite по умолчанию (журнал отката, новое '
+            'соединение на каждый запрос) против SQLITE_PRAGMAS и '
+            'CONN_MAX_AGE. Замер идёт на копии базы со своим кэшем '
+            'и очередью записи, рабочая база не меняется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Секунд на каждый режим.')
+        parser.add_argument('--write-share', type=float, default=0.2,
+                            help='Доля запросов add_comment.')
+        parser.add_argument('--mode', choices=MODES, action='append',
+                            help='Режим; по умолчанию оба.')
+        parser.add_argument('--output', help='Файл для результатов в JSON.')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Замер только для SQLite.')
+        directory = tempfile.mkdtemp()
+        try:
+            with throwaway_site(directory):
+                results = self.run_modes(options)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as dump:
+                json.dump(results, dump, ensure_ascii=False, indent=2)
+
+    def run_modes(self, options) -> dict:
+        post = Post.objects.order_by('-comment_count').first()
+        user = (User.objects.annotate(total=Count('follower'))
+                .order_by('-total').first())
+        if post is None or user is None:
+            raise CommandError('В базе нет данных, сначала выполните seed.')
+        results = {'revision': git_revision(),
+                   'options': {key: options[key] for key in (
+                       'processes', 'duration', 'write_share')},
+                   'modes': {}}
+        self.stdout.write(f'{"режим":<10}{"чтений/с":>10}{"записей/с":>11}'
+                          f'{"p50 чт.":>9}{"p99 чт.":>9}{"p50 зап.":>10}'
+                          f'{"p99 зап.":>10}{"ошибок":>8}')
+        for mode in options['mode'] or MODES:
+            measured = self.measure(mode, post.pk, user.pk, options)
+            results['modes'][mode] = measured
+            self.report(mode, measured)
+        return results
+
+    def measure(self, mode: str, post_id: int, user_id: int,
+                options) -> dict:
+        set_journal_mode(mode)
+        duration = options['duration']
+        context = multiprocessing.get_context('fork')
+        with context.Pool(options['processes']) as pool:
+            runs = pool.starmap(run_worker, [
+                (mode, seed, duration, options['write_share'], post_id,
+                 user_id)
+                for seed in range(options['processes'])])
+        measured = {'errors': sum(run['errors'] for run in runs)}
+        for kind in ('read', 'write'):
+            durations = [value for run in runs
+                         for value in run['durations'][kind]]
+            measured[kind] = {
+                'per_second': round(len(durations) / duration, 1),
+                'latency_ms': (percentiles(durations)
+                               if len(durations) > 1 else None),
+            }
+        return measured
+
+    def report(self, mode: str, measured: dict) -> None:
+        latency = {kind: measured[kind]['latency_ms'] or {'p50': '-',
+                                                          'p99': '-'}
+                   for kind in ('read', 'write')}
+        self.stdout.write(
+            f'{mode:<10}{measured["read"]["per_second"]:>10}'
+            f'{measured["write"]["per_second"]:>11}'
+            f'{latency["read"]["p50"]:>9}{latency["read"]["p99"]:>9}'
+            f'{latency["write"]["p50"]:>10}{latency["write"]["p99"]:>10}'
+            f'{measured["errors"]:>8}')
@@ -0,0 +1,238 @@
+import heapq
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from posts import ranking
+from posts.management.commands.bench_views import percentiles
+from posts.management.commands.seed import chunks
+from posts.models import Comment, Group, Post, User
+from posts.synthetic import zipf_weights
+
+BATCH_SIZE = 10_000
+DAY = 60 * 60 * 24
+# the top lists of the generated posts must not reach the site's cache
+BENCH_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def timed(func, repeat: int) -> list:
+    """Durations of repeat calls of func in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def moment(at: float) -> str:
+    """The unix time at as a value of a DateTimeField."""
+    return connection.ops.adapt_datetimefield_value(
+        datetime.fromtimestamp(at, timezone.utc))
+
+
+def insert(model, fields: tuple, rows) -> None:
+    """Inserts rows of values of the model fields with executemany;
+    millions of rows are too many to build model instances for."""
+    columns = ', '.join(model._meta.get_field(name).column
+                        for name in fields)
+    marks = ', '.join(['%s'] * len(fields))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {model._meta.db_table} '
+                           f'({columns}) VALUES ({marks})', rows)
+
+
+def query(sql: str, params=()) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет posts.ranking на временной базе, созданной '
+            'миграциями и заполненной сгенерированными постами: списки '
+            'популярного по таблице очков против агрегата с затуханием '
+            'по всем комментариям, пересчёт очков и добавление одного '
+            'события. Рабочая база и кэш сайта не затрагиваются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--comments', type=int, default=10_000_000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--zipf', type=float, default=1.1)
+        parser.add_argument('--top-k', type=int,
+                            default=settings.RANKING_TOP_K)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--aggregate-repeat', type=int, default=2,
+                            help='Повторов медленных агрегатов.')
+        parser.add_argument('--events', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.now = time.time()
+        directory = tempfile.mkdtemp()
+        # migrated like the test database, but in a file:
+        # millions of rows do not fit in memory
+        test_settings = connection.settings_dict['TEST']
+        test_name = test_settings['NAME']
+        test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES,
+                                   RANKING_TOP_K=options['top_k']):
+                self.build()
+                self.stdout.write(f'{"список":<12}{"способ":<12}'
+                                  f'{"p50, мс":>10}{"p99, мс":>10}'
+                                  f'{"макс, мс":>10}')
+                self.compare()
+                self.incremental()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def step(self, title: str, func) -> None:
+        started = time.perf_counter()
+        func()
+        self.stdout.write(f'{title} за {time.perf_counter() - started:.1f} с')
+
+    def build(self) -> None:
+        options = self.options
+        self.step(f'{options["posts"]} постов и {options["comments"]} '
+                  f'комментариев созданы', self.generate)
+        self.step('Очки пересчитаны по комментариям',
+                  ranking.rebuild_scores)
+        # the most active group, as on the page of trending groups
+        self.group_id = ranking._top_groups()[0]
+
+    def generate(self) -> None:
+        """Posts spread evenly over --days with Zipf-distributed groups;
+        comments on Zipf-distributed posts at any time after the post."""
+        options = self.options
+        count = options['posts']
+        start = self.now - options['days'] * DAY
+        step = (self.now - start) / count
+        author = User.objects.create_user(username='bench_ranking')
+        Group.objects.bulk_create(
+            Group(title=f'Группа {num}', slug=f'group-{num}',
+                  description='')
+            for num in range(1, options['groups'] + 1))
+        group_ids = list(Group.objects.values_list('pk', flat=True))
+        groups = zipf_weights(len(group_ids), options['zipf'])
+        # popular posts of any age, as in the seed command
+        self.popular = list(range(1, count + 1))
+        self.rng.shuffle(self.popular)
+        self.cum_weights = zipf_weights(count, options['zipf'])
+        for post_ids in chunks(range(1, count + 1), BATCH_SIZE):
+            insert(Post, ('id', 'author', 'text', 'image', 'comment_count',
+                          'views', 'pub_date', 'group'),
+                   ((post_id, author.pk, '', '', 0, 0,
+                     moment(start + step * post_id),
+                     self.rng.choices(group_ids, cum_weights=groups)[0]
+                     if self.rng.random() > 0.3 else None)
+                    for post_id in post_ids))
+        for offset in range(0, options['comments'], BATCH_SIZE):
+            size = min(BATCH_SIZE, options['comments'] - offset)
+            targets = self.rng.choices(self.popular,
+                                       cum_weights=self.cum_weights, k=size)
+            insert(Comment, ('post', 'author', 'text', 'created'),
+                   ((post_id, author.pk, '',
+                     moment(self.now - (self.now - start - step * post_id)
+                            * self.rng.random()))
+                    for post_id in targets))
+
+    def report(self, name: str, method: str, durations: list) -> None:
+        cuts = (percentiles(durations) if len(durations) > 1
+                else dict.fromkeys(('p50', 'p99', 'max'), durations[0]))
+        self.stdout.write(f'{name:<12}{method:<12}{cuts["p50"]:>10.1f}'
+                          f'{cuts["p99"]:>10.1f}{cuts["max"]:>10.1f}')
+
+    def compare(self) -> None:
+        """The top lists read by posts.ranking from the scores, against
+        the same lists computed from every comment."""
+        repeat = self.options['repeat']
+        slow = self.options['aggregate_repeat']
+        cases = (
+            ('все посты', ranking._top_posts, self.aggregate),
+            ('группа', lambda: ranking._top_posts(self.group_id),
+             lambda: self.aggregate(self.group_id)),
+            ('группы', ranking._top_groups, self.aggregate_groups),
+            ('все списки', ranking.refresh, self.aggregate_refresh),
+        )
+        for name, by_scores, by_aggregate in cases:
+            self.report(name, 'очки', timed(by_scores, repeat))
+            self.report(name, 'агрегат', timed(by_aggregate, slow))
+
+    def decayed(self) -> str:
+        """The decayed sum of the comments joined as c, in SQL,
+        relative to now so EXP cannot overflow."""
+        tau = settings.RANKING_HALF_LIFE / math.log(2)
+        return (f'SUM(EXP((JULIANDAY(c.created) - JULIANDAY({self.now}, '
+                f"'unixepoch')) * {DAY} / {tau}))")
+
+    def joined(self) -> str:
+        return (f'FROM {Comment._meta.db_table} c '
+                f'JOIN {Post._meta.db_table} p ON p.id = c.post_id')
+
+    def aggregate(self, group_id: int = None) -> list:
+        where, params = (('WHERE p.group_id = %s', [group_id])
+                         if group_id is not None else ('', []))
+        return query(f'SELECT c.post_id, {self.decayed()} AS activity '
+                     f'{self.joined()} {where} GROUP BY c.post_id '
+                     f'ORDER BY activity DESC LIMIT %s',
+                     [*params, settings.RANKING_TOP_K])
+
+    def aggregate_groups(self) -> list:
+        return query(f'SELECT p.group_id, {self.decayed()} AS activity '
+                     f'{self.joined()} WHERE p.group_id IS NOT NULL '
+                     f'GROUP BY p.group_id ORDER BY activity DESC LIMIT %s',
+                     [settings.RANKING_TOP_K])
+
+    def aggregate_refresh(self) -> None:
+        """Every list from one pass over the comments."""
+        top_k = settings.RANKING_TOP_K
+        best = defaultdict(list)
+        groups = defaultdict(float)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT c.post_id, p.group_id, {self.decayed()} '
+                           f'{self.joined()} GROUP BY c.post_id')
+            for post_id, group_id, activity in cursor:
+                for key in (None, group_id) if group_id else (None,):
+                    if len(best[key]) < top_k:
+                        heapq.heappush(best[key], (activity, post_id))
+                    else:
+                        heapq.heappushpop(best[key], (activity, post_id))
+                if group_id:
+                    groups[group_id] += activity
+        heapq.nlargest(top_k, groups.items(), key=lambda item: item[1])
+
+    def incremental(self) -> None:
+        """One comment: ranking.record() as the comment signal calls it,
+        an UPDATE of the post score and of the group score."""
+        groups = dict(Post.objects.exclude(group=None)
+                      .values_list('pk', 'group_id'))
+        targets = self.rng.choices(self.popular,
+                                   cum_weights=self.cum_weights,
+                                   k=self.options['events'])
+        durations = []
+        for post_id in targets:
+            started = time.perf_counter()
+            ranking.record('comment', {post_id: 1},
+                           {post_id: groups.get(post_id)})
+            durations.append((time.perf_counter() - started) * 1000)
+        self.report('событие', 'очки', durations)
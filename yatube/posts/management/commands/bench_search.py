@@ -0,0 +1,133 @@
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import search
+from posts.synthetic import texts, vocabulary
+
+BATCH_SIZE = 10000
+
+
+def timings(db, queries, repeat: int) -> list:
+    """Runs every (sql, params) pair repeat times,
+    returns the durations of the whole set in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for sql, params in queries:
+            db.execute(sql, params).fetchall()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость поиска по постам через FTS5 и через '
+            "LIKE '%слово%' на сгенерированной базе SQLite.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--words-per-post', type=int, default=30)
+        parser.add_argument('--vocabulary', type=int, default=50_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--inverted-index', action='store_true',
+                            help='Проверить и запасной индекс на диске '
+                                 '(долго строится на больших базах).')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def build(self, db, options, words, rng) -> None:
+        db.execute('CREATE TABLE posts_post '
+                   '(id INTEGER PRIMARY KEY, text TEXT NOT NULL)')
+        started = time.perf_counter()
+        generated = texts(options['posts'], words,
+                          options['words_per_post'], rng)
+        for start in range(0, options['posts'], BATCH_SIZE):
+            db.executemany(
+                'INSERT INTO posts_post (text) VALUES (?)',
+                ((next(generated),) for _ in range(
+                    min(BATCH_SIZE, options['posts'] - start))))
+        db.commit()
+        self.stdout.write(f'{options["posts"]} постов созданы за '
+                          f'{time.perf_counter() - started:.1f} с')
+        started = time.perf_counter()
+        db.execute(search.CREATE_FTS_SQL)
+        db.execute(f'INSERT INTO {search.FTS_TABLE} (rowid, text) '
+                   f'SELECT id, text FROM posts_post')
+        db.commit()
+        self.stdout.write(f'Индекс FTS5 построен за '
+                          f'{time.perf_counter() - started:.1f} с')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = vocabulary(options['vocabulary'], rng)
+        directory = tempfile.mkdtemp()
+        try:
+            db = sqlite3.connect(os.path.join(directory, 'bench.sqlite3'))
+            self.build(db, options, words, rng)
+            # a frequent, a common and a rare word, and two words at once
+            cases = {
+                'частое': [words[9]],
+                'среднее': [words[999]],
+                'редкое': [words[-100]],
+                'два слова': [words[9], words[999]],
+            }
+            index = None
+            if options['inverted_index']:
+                index = search.InvertedIndex(
+                    os.path.join(directory, 'index'))
+                started = time.perf_counter()
+                rows = db.execute('SELECT id, text FROM posts_post')
+                while True:
+                    batch = rows.fetchmany(BATCH_SIZE)
+                    if not batch:
+                        break
+                    index.add_many(batch)
+                self.stdout.write(f'Индекс на диске построен за '
+                                  f'{time.perf_counter() - started:.1f} с')
+            self.stdout.write(f'{"запрос":<12}{"способ":<10}{"найдено":>10}'
+                              f'{"p50, мс":>10}{"макс, мс":>10}')
+            for name, query_words in cases.items():
+                self.run_case(db, index, name, query_words,
+                              options['repeat'])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run_case(self, db, index, name, query_words, repeat) -> None:
+        """A search page needs the number of hits and the first ten."""
+        like = ' AND '.join(['text LIKE ?'] * len(query_words))
+        like_params = [f'%{word}%' for word in query_words]
+        match = search.match_query(query_words)
+        backends = {
+            'LIKE': [
+                (f'SELECT COUNT(*) FROM posts_post WHERE {like}',
+                 like_params),
+                (f'SELECT id, text FROM posts_post WHERE {like} '
+                 f'ORDER BY id DESC LIMIT 10', like_params)],
+            'FTS5': [
+                (search.FTS_COUNT_SQL.replace('%s', '?'), [match]),
+                (search.FTS_SEARCH_SQL.replace('%s', '?'),
+                 [search.MARK_START, search.MARK_END, search.ELLIPSIS,
+                  search.SNIPPET_WORDS, match, 10, 0])],
+        }
+        for backend, queries in backends.items():
+            found = db.execute(*queries[0]).fetchone()[0]
+            durations = timings(db, queries, repeat)
+            self.stdout.write(
+                f'{name:<12}{backend:<10}{found:>10}'
+                f'{statistics.median(durations):>10.1f}'
+                f'{max(durations):>10.1f}')
+        if index is not None:
+            durations = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                found = len(index.search(query_words))
+                durations.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f'{name:<12}{"индекс":<10}{found:>10}'
+                f'{statistics.median(durations):>10.1f}'
+                f'{max(durations):>10.1f}')
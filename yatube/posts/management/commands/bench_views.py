@@ -0,0 +1,186 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def percentile(ordered: list, percent: int) -> float:
+    """Interpolates between the nearest ranks of sorted values, as
+    statistics.quantiles(method='inclusive') does on Python 3.8+."""
+    position = (len(ordered) - 1) * percent / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def percentiles(durations: list) -> dict:
+    """p50/p90/p99/max of durations in milliseconds."""
+    ordered = sorted(durations)
+    return {'p50': round(percentile(ordered, 50), 2),
+            'p90': round(percentile(ordered, 90), 2),
+            'p99': round(percentile(ordered, 99), 2),
+            'max': round(ordered[-1], 2)}
+
+
+def scenarios() -> list:
+    """(name, url, user) for the busiest group, author, post and reader,
+    where the views do the most work."""
+    group = (Group.objects.annotate(total=Count('posts'))
+             .order_by('-total').first())
+    author = (User.objects.annotate(total=Count('posts'))
+              .order_by('-total').first())
+    post = Post.objects.order_by('-comment_count').first()
+    reader = (User.objects.annotate(total=Count('follower'))
+              .order_by('-total').first())
+    if None in (group, author, post, reader):
+        raise CommandError('В базе нет данных, сначала выполните seed.')
+    return [
+        ('index', reverse('posts:index'), None),
+        ('group_posts', reverse('posts:group_list', args=[group.slug]),
+         None),
+        ('profile', reverse('posts:profile', args=[author.username]), None),
+        ('post_detail', reverse('posts:post_detail', args=[post.pk]), None),
+        ('follow_index', reverse('posts:follow_index'), reader),
+        ('trending', reverse('posts:trending'), None),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет index, group_posts, profile, post_detail и '
+            'follow_index через тестовый клиент на текущей базе: '
+            'задержки (p50/p90/p99), число запросов и пик памяти. '
+            'Результат сохраняется в JSON для сравнения между коммитами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом.')
+        parser.add_argument('--output',
+                            help='Файл для результатов, по умолчанию '
+                                 'bench-views-<коммит>.json.')
+        parser.add_argument('--compare',
+                            help='Прошлый файл результатов для сравнения.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('Нужно хотя бы 2 запроса на страницу.')
+        revision = git_revision()
+        results = {
+            'revision': revision,
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'debug': settings.DEBUG,
+            'options': {key: options[key]
+                        for key in ('requests', 'warmup', 'cold')},
+            'data': {model.__name__: model.objects.count()
+                     for model in (User, Group, Post, Comment, Follow)},
+            'views': {},
+        }
+        if settings.DEBUG:
+            self.stderr.write('DEBUG = True: задержки завышены.')
+        self.stdout.write(f'{"страница":<14}{"p50":>8}{"p90":>8}{"p99":>8}'
+                          f'{"запросов":>10}{"память, КБ":>12}')
+        for name, url, user in scenarios():
+            measured = self.measure(url, user, options)
+            results['views'][name] = measured
+            self.stdout.write(
+                f'{name:<14}{measured["latency_ms"]["p50"]:>8}'
+                f'{measured["latency_ms"]["p90"]:>8}'
+                f'{measured["latency_ms"]["p99"]:>8}'
+                f'{measured["queries"]:>10}'
+                f'{measured["peak_memory_kb"]:>12}')
+        output = options['output'] or f'bench-views-{revision}.json'
+        with open(output, 'w', encoding='utf-8') as dump:
+            json.dump(results, dump, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты сохранены в {output}.'))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get(self, client: Client, url: str, cold: bool):
+        if cold:
+            cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} ответил {response.status_code}.')
+        return response
+
+    def measure(self, url: str, user, options) -> dict:
+        """Times the page first, then counts queries and memory
+        in separate requests, so they do not slow down the timing."""
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        cold = options['cold']
+        for _ in range(options['warmup']):
+            self.get(client, url, cold)
+        durations = []
+        for _ in range(options['requests']):
+            if cold:
+                cache.clear()
+            started = time.perf_counter()
+            response = self.get(client, url, cold=False)
+            durations.append((time.perf_counter() - started) * 1000)
+        # request_started empties the log, so the captured queries
+        # are counted before the next request
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.get(client, url, cold)
+        query_count = len(queries)
+        tracemalloc.start()
+        try:
+            self.get(client, url, cold)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'url': url,
+            'latency_ms': percentiles(durations),
+            'queries': query_count,
+            'peak_memory_kb': round(peak / 1024),
+            'response_bytes': len(response.content),
+        }
+
+    def compare(self, path: str, results: dict) -> None:
+        """Prints how p50 and queries changed since a previous run."""
+        try:
+            with open(path, encoding='utf-8') as dump:
+                previous = json.load(dump)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        self.stdout.write(f'Сравнение с {previous.get("revision")}:')
+        for name, measured in results['views'].items():
+            before = previous.get('views', {}).get(name)
+            if before is None:
+                continue
+            old = before['latency_ms']['p50']
+            new = measured['latency_ms']['p50']
+            change = (new - old) / old * 100 if old else 0
+            self.stdout.write(
+                f'{name:<14}p50 {old} → {new} мс ({change:+.0f}%), '
+                f'запросов {before["queries"]} → {measured["queries"]}')
@@ -0,0 +1,65 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Post
+
+FIELDS = ('id', 'text', 'pub_date', 'author', 'group', 'image')
+
+
+class Command(BaseCommand):
+    help = ('Выгружает все посты в JSON Lines или CSV с полями '
+            f'{", ".join(FIELDS)}, которые понимает import_posts. '
+            'Посты читаются пачками, так что память не растёт '
+            'с числом постов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для stdout.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def rows(self, chunk_size: int):
+        posts = (Post.objects.order_by('pk')
+                 .values_list('pk', 'text', 'pub_date', 'author__username',
+                              'group__slug', 'image')
+                 .iterator(chunk_size=chunk_size))
+        for pk, text, pub_date, author, group, image in posts:
+            yield dict(zip(FIELDS, (pk, text, pub_date.isoformat(),
+                                    author, group or '', image)))
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl')
+        try:
+            stream = (sys.stdout if path == '-'
+                      else open(path, 'w', encoding='utf-8', newline=''))
+        except OSError as error:
+            raise CommandError(error)
+        started = time.perf_counter()
+        exported = 0
+        try:
+            rows = self.rows(options['chunk_size'])
+            if file_format == 'csv':
+                writer = csv.DictWriter(stream, FIELDS)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    exported += 1
+            else:
+                for row in rows:
+                    stream.write(json.dumps(row, ensure_ascii=False))
+                    stream.write('\n')
+                    exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = time.perf_counter() - started
+        # the report must not end up in the dump written to stdout
+        report = self.stderr if path == '-' else self.stdout
+        report.write(f'Выгружено постов: {exported} за {elapsed:.1f} с '
+                     f'({exported / max(elapsed, 1e-9):.0f} в секунду).',
+                     style_func=self.style.SUCCESS)
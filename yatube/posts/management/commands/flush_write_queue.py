@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import write_queue
+
+
+class Command(BaseCommand):
+    help = ('Переносит в базу всё, что ждёт в очереди отложенной записи '
+            '(WRITE_BEHIND), и показывает её состояние.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true',
+                            help='Только показать длину очереди '
+                                 'и задержку последних пачек.')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            total = 0
+            while True:
+                written = write_queue.flush()
+                if not written:
+                    break
+                total += written
+            self.stdout.write(self.style.SUCCESS(
+                f'Из очереди записано: {total}.'))
+        for name, value in write_queue.stats().items():
+            self.stdout.write(f'{name}: {value}')
@@ -0,0 +1,263 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.utils.dateparse import parse_datetime
+
+from posts import feed_cache, search, timeline
+from posts.models import AuthorStats, Group, Post, User
+
+FORMATS = ('jsonl', 'csv')
+
+
+def read_rows(stream, file_format: str):
+    """Yields (line number, dict) pairs one at a time."""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                row = {'error': str(error)}
+            if not isinstance(row, dict):
+                row = {'error': 'ожидался объект JSON'}
+            yield line_num, row
+
+
+@contextmanager
+def keep_dates(model, field_name: str):
+    """bulk_create would overwrite an auto_now_add date with now."""
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class NaturalKeys:
+    """
+    In-memory map from a natural key (username, group slug) to a pk.
+
+    Keys are looked up once per batch with one IN query, and are
+    created with make(key) if missing and make is given.
+    """
+    def __init__(self, queryset, field: str, make=None):
+        self.queryset = queryset
+        self.field = field
+        self.make = make
+        self.pks = {}
+        self.created = 0
+
+    def resolve(self, keys) -> None:
+        # rows with other values are skipped by make_post
+        missing = {key for key in keys
+                   if isinstance(key, str) and key and key not in self.pks}
+        if not missing:
+            return
+        self.pks.update(self.queryset.filter(
+            **{f'{self.field}__in': missing}).values_list(self.field, 'pk'))
+        missing -= self.pks.keys()
+        if missing and self.make is not None:
+            self.queryset.model.objects.bulk_create(
+                [self.make(key) for key in missing])
+            self.created += len(missing)
+            self.pks.update(self.queryset.filter(
+                **{f'{self.field}__in': missing})
+                .values_list(self.field, 'pk'))
+
+    def get(self, key):
+        return self.pks.get(key)
+
+
+def new_user(username: str) -> User:
+    user = User(username=username)
+    user.set_unusable_password()
+    return user
+
+
+def parse_pub_date(value):
+    """Returns an aware datetime for an ISO 8601 string, or None for
+    anything else, including well-formed but impossible dates."""
+    try:
+        pub_date = parse_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if pub_date is not None and timezone.is_naive(pub_date):
+        pub_date = timezone.make_aware(pub_date)
+    return pub_date
+
+
+def copy_image(source: str) -> str:
+    """Saves a file into the storage, returns its name there."""
+    with open(source, 'rb') as image:
+        return default_storage.save(
+            f'{Post.image.field.upload_to}{os.path.basename(source)}',
+            File(image))
+
+
+class Command(BaseCommand):
+    help = ('Загружает посты из файла JSON Lines или CSV с полями text, '
+            'author (username), group (slug), pub_date и image. '
+            'Миниатюры картинок потом готовит warm_images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для stdin.')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Потоки для копирования картинок.')
+        parser.add_argument('--images-from',
+                            help='Папка, относительно которой указаны '
+                                 'картинки. Без неё имена картинок '
+                                 'сохраняются как есть.')
+        parser.add_argument('--create-missing', action='store_true',
+                            help='Создавать неизвестных авторов и группы '
+                                 'вместо пропуска строк.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl')
+        create = options['create_missing']
+        self.authors = NaturalKeys(User.objects.all(), 'username',
+                                   new_user if create else None)
+        self.groups = NaturalKeys(
+            Group.objects.all(), 'slug',
+            (lambda slug: Group(title=slug, slug=slug, description=''))
+            if create else None)
+        self.images_from = options['images_from']
+        self.imported = self.skipped = self.images = 0
+        try:
+            stream = (sys.stdin if path == '-'
+                      else open(path, encoding='utf-8', newline=''))
+        except OSError as error:
+            raise CommandError(error)
+        started = time.perf_counter()
+        try:
+            rows = read_rows(stream, file_format)
+            with ThreadPoolExecutor(options['workers']) as pool, \
+                    keep_dates(Post, 'pub_date'):
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    self.import_batch(batch, pool)
+                    if options['verbosity'] > 1:
+                        self.report(started)
+        except OSError as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        if self.imported:
+            feed_cache.invalidate(feed_cache.ALL_FEEDS)
+        self.report(started, self.style.SUCCESS)
+
+    def report(self, started: float, style=str) -> None:
+        elapsed = time.perf_counter() - started
+        self.stdout.write(style(
+            f'Импортировано постов: {self.imported} за {elapsed:.1f} с '
+            f'({self.imported / max(elapsed, 1e-9):.0f} в секунду), '
+            f'картинок: {self.images}, пропущено строк: {self.skipped}, '
+            f'создано авторов: {self.authors.created}, '
+            f'групп: {self.groups.created}.'))
+
+    def skip(self, line_num: int, reason: str) -> None:
+        self.skipped += 1
+        self.stderr.write(f'Строка {line_num} пропущена: {reason}')
+
+    def import_batch(self, batch, pool) -> None:
+        self.authors.resolve(row.get('author') for _, row in batch)
+        self.groups.resolve(row.get('group') for _, row in batch)
+        posts = []
+        for line_num, row in batch:
+            post = self.make_post(line_num, row)
+            if post is not None:
+                posts.append(post)
+        self.copy_images(posts, pool)
+        if not posts:
+            return
+        with transaction.atomic():
+            Post.objects.bulk_create(posts)
+            # SQLite does not return the pks from bulk_create; the batch
+            # is the newest rows, as the transaction holds the write lock
+            created = list(Post.objects.order_by('-pk')
+                           .only('author_id', 'pub_date', 'text')
+                           [:len(posts)])
+            AuthorStats.change_many(
+                'posts', Counter(post.author_id for post in created))
+            timeline.fan_out_many(created)
+            search.index_posts(created)
+        self.imported += len(posts)
+
+    def make_post(self, line_num: int, row: dict):
+        """Returns an unsaved Post for the row, or None to skip it."""
+        if 'error' in row:
+            return self.skip(line_num, row['error'])
+        if not row.get('text'):
+            return self.skip(line_num, 'нет текста')
+        for field in ('author', 'group'):
+            if not isinstance(row.get(field) or '', str):
+                return self.skip(line_num,
+                                 f'{field} не строка: {row[field]!r}')
+        author_id = self.authors.get(row.get('author'))
+        if author_id is None:
+            return self.skip(line_num,
+                             f'нет автора {row.get("author")!r}')
+        group_id = None
+        if row.get('group'):
+            group_id = self.groups.get(row['group'])
+            if group_id is None:
+                return self.skip(line_num, f'нет группы {row["group"]!r}')
+        pub_date = timezone.now()
+        if row.get('pub_date'):
+            pub_date = parse_pub_date(row['pub_date'])
+            if pub_date is None:
+                return self.skip(line_num,
+                                 f'неверная дата {row["pub_date"]!r}')
+        return Post(text=row['text'], author_id=author_id,
+                    group_id=group_id, pub_date=pub_date,
+                    image=row.get('image') or '')
+
+    def copy_images(self, posts, pool) -> None:
+        """Copies the images of the batch into the storage in parallel;
+        posts whose image cannot be read are imported without it."""
+        if not self.images_from:
+            return
+        copies = []
+        for post in posts:
+            if not post.image:
+                continue
+            try:
+                source = safe_join(self.images_from, post.image.name)
+            except SuspiciousFileOperation as error:
+                self.stderr.write(f'Картинка не скопирована: {error}')
+                post.image = ''
+                continue
+            copies.append((post, source, pool.submit(copy_image, source)))
+        for post, source, copy in copies:
+            try:
+                post.image = copy.result()
+                self.images += 1
+            except OSError as error:
+                self.stderr.write(f'Картинка {source} не скопирована: '
+                                  f'{error}')
+                post.image = ''
@@ -0,0 +1,44 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import AuthorStats, Comment, Follow, Post, User
+
+
+def count_by(queryset, field: str) -> Counter:
+    """Returns {user id: number of rows} in one GROUP BY query."""
+    return Counter({
+        row[field]: row['total']
+        for row in queryset.order_by().values(field).annotate(
+            total=Count('pk'))
+    })
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику авторов (AuthorStats) с нуля.'
+
+    def add_arguments(self, parser):
+        # by default Django picks a size SQLite accepts
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        posts = count_by(Post.objects.all(), 'author')
+        comments = count_by(Comment.objects.all(), 'author')
+        followers = count_by(Follow.objects.all(), 'author')
+        following = count_by(Follow.objects.all(), 'user')
+        stats = [
+            AuthorStats(author_id=user_id,
+                        posts=posts[user_id],
+                        comments=comments[user_id],
+                        followers=followers[user_id],
+                        following=following[user_id])
+            for user_id in User.objects.values_list('pk', flat=True)
+        ]
+        with transaction.atomic():
+            AuthorStats.objects.all().delete()
+            AuthorStats.objects.bulk_create(
+                stats, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Статистика пересчитана для {len(stats)} пользователей.'))
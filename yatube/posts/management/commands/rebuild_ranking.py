@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import ranking
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает популярность постов и групп (PostScore, '
+            'GroupScore) по всем комментариям и обновляет списки лучших.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        scored = ranking.rebuild_scores()
+        self.stdout.write(self.style.SUCCESS(
+            f'Популярность пересчитана для {scored} постов за '
+            f'{time.perf_counter() - started:.1f} с.'))
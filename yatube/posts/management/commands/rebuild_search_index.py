@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заново строит поисковый индекс по текстам всех постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def rebuild_fts(self) -> int:
+        table = search.FTS_TABLE
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(search.CREATE_FTS_SQL)
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(f'INSERT INTO {table} (rowid, text) '
+                           f'SELECT id, text FROM {Post._meta.db_table}')
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            return cursor.fetchone()[0]
+
+    def rebuild_index(self, batch_size: int) -> int:
+        index = search.inverted_index()
+        index.clear()
+        posts = (Post.objects.order_by().values_list('pk', 'text')
+                 .iterator(chunk_size=batch_size))
+        total = 0
+        batch = []
+        for post in posts:
+            batch.append(post)
+            if len(batch) == batch_size:
+                index.add_many(batch)
+                total += len(batch)
+                batch = []
+        index.add_many(batch)
+        return total + len(batch)
+
+    def handle(self, *args, **options):
+        if search.uses_fts():
+            total = self.rebuild_fts()
+        else:
+            total = self.rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'В поисковый индекс добавлено постов: {total}.'))
@@ -0,0 +1,187 @@
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts import feed_cache, search, timeline
+from posts.management.commands.import_posts import keep_dates
+from posts.models import Comment, Follow, Group, Post, User
+from posts.synthetic import texts, vocabulary, zipf_weights
+
+# the largest IN (...) list sent to the database at once
+IN_LIMIT = 500
+
+
+def chunks(items, size: int):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу пользователями, группами, подписками, постами '
+            'и комментариями. Авторы, группы, подписки и комментарии '
+            'распределены по Ципфу: немногие пишут и собирают почти всё.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20_000)
+        parser.add_argument('--comments', type=int, default=50_000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Среднее число подписок пользователя.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней растянуть посты.')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения Ципфа.')
+        parser.add_argument('--words-per-post', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--prefix', default='seed',
+                            help='Начало имён пользователей и групп.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.weights = {}
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Пользователи {prefix}-* уже есть, '
+                               f'укажите другой --prefix.')
+        started = time.perf_counter()
+        users = self.create_users(prefix)
+        groups = self.create_groups(prefix)
+        follows = self.create_follows(users)
+        with keep_dates(Post, 'pub_date'), keep_dates(Comment, 'created'):
+            posts = self.create_posts(users, groups)
+            comments = self.create_comments(posts, users)
+        # one pass per feed instead of pushing every post to every follower
+        for chunk in chunks(users, IN_LIMIT):
+            timeline.rebuild(chunk)
+        call_command('rebuild_author_stats', stdout=self.stdout)
+        call_command('rebuild_ranking', stdout=self.stdout)
+        feed_cache.invalidate(feed_cache.ALL_FEEDS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, групп: {len(groups)}, '
+            f'подписок: {follows}, постов: {len(posts)}, '
+            f'комментариев: {comments} '
+            f'за {time.perf_counter() - started:.1f} с.'))
+
+    def zipf_choices(self, population: list, count: int) -> list:
+        size = len(population)
+        if size not in self.weights:
+            self.weights[size] = zipf_weights(size, self.options['zipf'])
+        return self.rng.choices(population, k=count,
+                                cum_weights=self.weights[size])
+
+    def create_users(self, prefix: str) -> list:
+        """Returns user ids, the most active first."""
+        users = []
+        for num in range(self.options['users']):
+            user = User(username=f'{prefix}-{num}')
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users)
+        return list(User.objects.filter(username__startswith=f'{prefix}-')
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def create_groups(self, prefix: str) -> list:
+        """Returns group ids, the most popular first."""
+        Group.objects.bulk_create(
+            Group(title=f'Группа {num}', slug=f'{prefix}-{num}',
+                  description=f'Сгенерированная группа {num}')
+            for num in range(self.options['groups']))
+        return list(Group.objects.filter(slug__startswith=f'{prefix}-')
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def create_follows(self, users: list) -> int:
+        """Everyone follows a few authors, mostly the popular ones."""
+        average = self.options['follows']
+        follows = []
+        for user_id in users:
+            count = min(self.rng.randint(0, 2 * average), len(users) - 1)
+            authors = set(self.zipf_choices(users, count))
+            authors.discard(user_id)
+            follows.extend(Follow(user_id=user_id, author_id=author_id)
+                           for author_id in authors)
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        return len(follows)
+
+    def create_posts(self, users: list, groups: list) -> list:
+        """Returns (post id, pub_date) pairs, the oldest first.
+        Posts are spread evenly over --days, so ids grow with time."""
+        count = self.options['posts']
+        now = timezone.now()
+        start = now - timedelta(days=self.options['days'])
+        step = (now - start) / max(count, 1)
+        generated = texts(count, vocabulary(5000, self.rng),
+                          self.options['words_per_post'], self.rng)
+        posts = []
+        for offset in range(0, count, self.options['batch_size']):
+            size = min(self.options['batch_size'], count - offset)
+            authors = self.zipf_choices(users, size)
+            # about a third of the posts are outside any group
+            in_groups = [
+                group_id if self.rng.random() > 0.3 else None
+                for group_id in (self.zipf_choices(groups, size)
+                                 if groups else [None] * size)]
+            batch = [
+                Post(text=next(generated), author_id=author_id,
+                     group_id=group_id,
+                     pub_date=start + step * (offset + num
+                                              + self.rng.random()))
+                for num, (author_id, group_id)
+                in enumerate(zip(authors, in_groups))]
+            with transaction.atomic():
+                Post.objects.bulk_create(batch)
+                created = list(Post.objects.order_by('-pk')
+                               .only('author_id', 'pub_date', 'text')
+                               [:len(batch)])[::-1]
+                search.index_posts(created)
+            posts.extend((post.pk, post.pub_date) for post in created)
+        return posts
+
+    def create_comments(self, posts: list, users: list) -> int:
+        """A few posts get most of the comments, whatever their age."""
+        if not posts:
+            return 0
+        popular = list(posts)
+        self.rng.shuffle(popular)
+        now = timezone.now()
+        counts = Counter()
+        for offset in range(0, self.options['comments'],
+                            self.options['batch_size']):
+            size = min(self.options['batch_size'],
+                       self.options['comments'] - offset)
+            targets = self.zipf_choices(popular, size)
+            authors = self.zipf_choices(users, size)
+            Comment.objects.bulk_create(
+                Comment(post_id=post_id, author_id=author_id,
+                        text=f'Комментарий {offset + num}',
+                        created=pub_date
+                        + (now - pub_date) * self.rng.random())
+                for num, ((post_id, pub_date), author_id)
+                in enumerate(zip(targets, authors)))
+            counts.update(post_id for post_id, _ in targets)
+        self.count_comments(counts)
+        return sum(counts.values())
+
+    def count_comments(self, counts: Counter) -> None:
+        """One UPDATE per distinct number of new comments."""
+        by_count = defaultdict(list)
+        for post_id, count in counts.items():
+            by_count[count].append(post_id)
+        for count, post_ids in by_count.items():
+            for chunk in chunks(post_ids, IN_LIMIT):
+                Post.objects.filter(pk__in=chunk).update(
+                    comment_count=F('comment_count') + count)
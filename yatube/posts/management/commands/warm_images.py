@@ -0,0 +1,45 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import feed_cache
+from posts.models import Post
+from posts.thumbnails import make_variants
+
+
+def make_thumbnails(post_ids) -> int:
+    """Runs in a worker process; returns the number of images done."""
+    try:
+        return sum(make_variants(post_id, invalidate=False)
+                   for post_id in post_ids)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Готовит уменьшенные копии картинок всех постов '
+            'в нескольких процессах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--chunk-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.exclude(image='')
+                        .order_by('-pub_date')
+                        .values_list('pk', flat=True))
+        size = options['chunk_size']
+        chunks = [post_ids[num:num + size]
+                  for num in range(0, len(post_ids), size)]
+        # worker processes must not share the parent's connection
+        connections.close_all()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            made = sum(pool.map(make_thumbnails, chunks))
+        feed_cache.invalidate(feed_cache.ALL_FEEDS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {made} '
+            f'за {time.perf_counter() - started:.1f} с.'))
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveSmallIntegerField(verbose_name='Ширина')),
+                ('height', models.PositiveSmallIntegerField(verbose_name='Высота')),
+                ('format', models.CharField(choices=[('jpeg', 'JPEG'), ('webp', 'WebP')], max_length=4, verbose_name='Формат')),
+                ('image', models.ImageField(upload_to='posts/variants/', verbose_name='Файл')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_variants', to='posts.Post')),
+            ],
+            options={
+                'ordering': ['width'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='imagevariant',
+            constraint=models.UniqueConstraint(fields=('post', 'width', 'format'), name='unique_image_variant'),
+        ),
+    ]
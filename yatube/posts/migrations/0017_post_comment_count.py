@@ -0,0 +1,31 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:09
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+
+
+def count_comments(apps, schema_editor):
+    """Fills comment_count of existing posts in one UPDATE."""
+    Comment = apps.get_model('posts', 'Comment')
+    Post = apps.get_model('posts', 'Post')
+    counts = (Comment.objects.filter(post=OuterRef('pk'))
+              .order_by().values('post')
+              .annotate(total=Count('pk')).values('total'))
+    Post.objects.filter(comments__isnull=False).update(
+        comment_count=Subquery(counts, output_field=IntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_imagevariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число комментариев'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
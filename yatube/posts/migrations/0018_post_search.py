@@ -0,0 +1,41 @@
+from django.db import migrations
+
+FTS_TABLE = 'posts_post_fts'
+
+
+def has_fts5(connection) -> bool:
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5'
+                   for option, in cursor.fetchall())
+
+
+def create_search_table(apps, schema_editor):
+    """Copies the texts of existing posts into an FTS5 table.
+    Without FTS5 posts.search falls back to an index on disk."""
+    if not has_fts5(schema_editor.connection):
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        f"text, tokenize='unicode61 remove_diacritics 2')")
+    schema_editor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, text) '
+        f'SELECT id, text FROM posts_post')
+
+
+def drop_search_table(apps, schema_editor):
+    if has_fts5(schema_editor.connection):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
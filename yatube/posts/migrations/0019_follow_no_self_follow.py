@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:54
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+def delete_self_follows(apps, schema_editor):
+    """Rows the new constraint forbids; the old view never created
+    them, but the admin could."""
+    Follow = apps.get_model('posts', 'Follow')
+    Follow.objects.filter(user=models.F('author')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_self_follows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(_negated=True, user=django.db.models.expressions.F('author')), name='no_self_follow'),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from collections import defaultdict
+
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -26,8 +30,28 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by every post listing.
+    """
+    def feed(self):
+        """
+        Returns posts ready for a feed page: author and group are
+        joined in the same query, image variants are fetched in one
+        more query and columns the feed templates never show
+        are deferred.
+        """
+        return self.select_related('author', 'group').prefetch_related(
+            'image_variants').defer(
+            'group__description',
+            'author__password',
+            'author__last_login',
+            'author__email',
+            'author__date_joined')
+
+
 class Post(models.Model):
-   """
+    """
     Represents a post in the application.
 
     Fields:
@@ -36,7 +60,11 @@ class Post(models.Model):
     - author: the user who authored the post(ForeignKey to the User model)
     - group: the group the post belongs
     to(ForeignKey to the Group model, can be null)
-    - image: an optional image to include in the post.
+    - image: an optional image to include in the post
+    - comment_count: the number of comments on the post, kept up to date
+    by posts.signals
+    - views: the number of times the post page was served, written
+    in batches by posts.view_counts.
     """
     text = models.TextField('Текст поста',
                             help_text='Введите текст поста')
@@ -58,6 +86,14 @@ class Post(models.Model):
                               upload_to='posts/',
                               blank=True,
                               help_text='Загрузите картинку')
+    comment_count = models.PositiveIntegerField('Число комментариев',
+                                                default=0,
+                                                editable=False)
+    views = models.PositiveIntegerField('Просмотров',
+                                        default=0,
+                                        editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         """
@@ -73,6 +109,14 @@ class Post(models.Model):
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date'],
+                         name='post_group_pub_date_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -103,6 +147,10 @@ class Comment(models.Model):
         Specifies the metadata for the Comment model.
         """
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['post', '-created'],
+                         name='comment_post_created_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -123,3 +171,245 @@ class Follow(models.Model):
                                on_delete=models.CASCADE,
                                related_name='following',
                                help_text='Автор поста')
+
+    class Meta:
+        """
+        Specifies the metadata for the Follow model.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+            models.CheckConstraint(check=~models.Q(user=F('author')),
+                                   name='no_self_follow'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """
+    Denormalized counters for a user, so pages do not have to
+    run COUNT queries over posts, comments and follows.
+
+    Fields:
+    - author: the user the counters belong to
+    (OneToOneField to the User model)
+    - posts: the number of posts written by the user
+    - comments: the number of comments written by the user
+    - followers: the number of users following the user
+    - following: the number of authors the user follows.
+    """
+    author = models.OneToOneField(User,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='stats',
+                                  verbose_name='Автор')
+    posts = models.PositiveIntegerField('Постов', default=0)
+    comments = models.PositiveIntegerField('Комментариев', default=0)
+    followers = models.PositiveIntegerField('Подписчиков', default=0)
+    following = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        """
+        Specifies the metadata for the AuthorStats model.
+        """
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    @classmethod
+    def recount(cls, author_id: int) -> 'AuthorStats':
+        """
+        Counts everything for the user from scratch
+        and stores the result.
+        """
+        stats, _ = cls.objects.update_or_create(
+            author_id=author_id,
+            defaults={
+                'posts': Post.objects.filter(author_id=author_id).count(),
+                'comments': Comment.objects.filter(
+                    author_id=author_id).count(),
+                'followers': Follow.objects.filter(
+                    author_id=author_id).count(),
+                'following': Follow.objects.filter(
+                    user_id=author_id).count(),
+            })
+        return stats
+
+    @classmethod
+    def get_for(cls, author) -> 'AuthorStats':
+        """
+        Returns the counters for the user,
+        creating them on first access.
+        """
+        try:
+            # free when the author was fetched with select_related('stats')
+            return author.stats
+        except cls.DoesNotExist:
+            return cls.recount(author.pk)
+
+    @classmethod
+    def change(cls, author_id: int, field: str, delta: int) -> None:
+        """
+        Adds delta to one counter in a single UPDATE.
+        A missing row is recounted instead, so users created
+        before the table existed still get correct numbers.
+        """
+        updated = cls.objects.filter(author_id=author_id).update(
+            **{field: Greatest(F(field) + delta, 0)})
+        if not updated and delta > 0:
+            cls.recount(author_id)
+
+    @classmethod
+    def change_many(cls, field: str, deltas: dict) -> None:
+        """
+        Like change() for {user id: delta}, with one UPDATE
+        per distinct delta instead of one per user.
+        """
+        by_delta = defaultdict(list)
+        for author_id, delta in deltas.items():
+            by_delta[delta].append(author_id)
+        for delta, author_ids in by_delta.items():
+            cls.objects.filter(author_id__in=author_ids).update(
+                **{field: Greatest(F(field) + delta, 0)})
+        if any(delta > 0 for delta in by_delta):
+            known = set(cls.objects.filter(author_id__in=deltas)
+                        .values_list('author_id', flat=True))
+            for author_id, delta in deltas.items():
+                if delta > 0 and author_id not in known:
+                    cls.recount(author_id)
+
+
+class TimelineEntry(models.Model):
+    """
+    Represents a post pushed into a follower's home feed,
+    so follow_index reads a pre-sorted list of ids instead of
+    joining Follow and Post on every request.
+
+    Fields:
+    - user: the follower whose feed holds the entry
+    (ForeignKey to the User model)
+    - post: the post in the feed (ForeignKey to the Post model)
+    - author: the author of the post, copied from the post
+    so entries can be pruned on unfollow
+    - pub_date: the date the post was published, copied from the post
+    so the feed is sorted without a join.
+    """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             db_index=False,
+                             related_name='timeline')
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               db_index=False,
+                               related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        """
+        Specifies the metadata for the TimelineEntry model.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_post'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class ImageVariant(models.Model):
+    """
+    Represents one resized copy of a post image, so templates can
+    build srcset without looking at the files.
+
+    Fields:
+    - post: the post the image belongs to (ForeignKey to the Post model)
+    - width: the width of the copy in pixels
+    - height: the height of the copy in pixels
+    - format: the file format of the copy (jpeg or webp)
+    - image: the file of the copy.
+    """
+    JPEG = 'jpeg'
+    WEBP = 'webp'
+    FORMATS = ((JPEG, 'JPEG'), (WEBP, 'WebP'))
+
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='image_variants')
+    width = models.PositiveSmallIntegerField('Ширина')
+    height = models.PositiveSmallIntegerField('Высота')
+    format = models.CharField('Формат', max_length=4, choices=FORMATS)
+    image = models.ImageField('Файл', upload_to='posts/variants/')
+
+    class Meta:
+        """
+        Specifies the metadata for the ImageVariant model.
+        """
+        ordering = ['width']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'width', 'format'],
+                                    name='unique_image_variant'),
+        ]
+
+
+class PostScore(models.Model):
+    """
+    Represents the time-decayed activity score of a post,
+    kept up to date by posts.ranking.
+
+    Fields:
+    - post: the scored post (OneToOneField to the Post model)
+    - group: the group of the post, copied from the post
+    so the top posts of a group are read from one index
+    - score: the natural logarithm of the decayed activity,
+    see posts.ranking.
+    """
+    post = models.OneToOneField(Post,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='+')
+    group = models.ForeignKey(Group,
+                              blank=True,
+                              null=True,
+                              on_delete=models.SET_NULL,
+                              db_index=False,
+                              related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        """
+        Specifies the metadata for the PostScore model.
+        """
+        indexes = [
+            models.Index(fields=['-score'], name='post_score_idx'),
+            models.Index(fields=['group', '-score'],
+                         name='post_score_group_idx'),
+        ]
+
+
+class GroupScore(models.Model):
+    """
+    Represents the time-decayed activity score of a group: the activity
+    of its posts, kept up to date by posts.ranking.
+
+    Fields:
+    - group: the scored group (OneToOneField to the Group model)
+    - score: the natural logarithm of the decayed activity.
+    """
+    group = models.OneToOneField(Group,
+                                 on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        """
+        Specifies the metadata for the GroupScore model.
+        """
+        indexes = [
+            models.Index(fields=['-score'], name='group_score_idx'),
+        ]
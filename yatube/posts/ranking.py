@@ -0,0 +1,218 @@
+"""Trending posts and groups, ranked by time-decayed activity.
+
+Each comment, and each view written by posts.view_counts, adds its
+weight from settings.RANKING_WEIGHTS to the score of its post and of
+the post's group. Both go through record(). The weight of an event
+halves every settings.RANKING_HALF_LIFE seconds.
+
+Scores are never decayed as time passes. Instead, an event at time t
+adds w * e**((t - EPOCH) / tau), its weight grown by its age relative
+to EPOCH (forward decay). Dividing every score by the same growth gives
+the decayed activity at any moment. So the order of the scores is
+always the order of the decayed activity and changes only when
+something happens. Scores are stored as natural logarithms of these
+sums, which stay small numbers for centuries. Adding an event is a
+single UPDATE of score = ln(e**score + e**x).
+
+PostScore and GroupScore are the compact tables. PostScore copies the
+group of its post, so the top posts of a group are read from an index.
+top_posts() and top_groups() keep the ids of the best
+settings.RANKING_TOP_K rows in the cache for settings.RANKING_REFRESH
+seconds.
+
+Deleted comments are not subtracted. rebuild_scores() (the
+rebuild_ranking command) recomputes the scores from the comments,
+e.g. after RANKING_HALF_LIFE or RANKING_WEIGHTS change. Views are not
+stored with their times, so a rebuild drops them and they count again
+from then on. A kind weighted 0 (or less) is not counted at all."""
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+
+from .models import Comment, Group, GroupScore, Post, PostScore
+
+# scores are relative to it; moving it shifts every score alike
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+# the score of a row that has seen nothing yet: e**EMPTY is 0
+EMPTY = -1e9
+ALL = 'all'
+BATCH_SIZE = 10000
+
+
+def exponent(at: float) -> float:
+    """ln of the growth of an event at the unix time at."""
+    return (at - EPOCH) * math.log(2) / settings.RANKING_HALF_LIFE
+
+
+def log_add(score: float, x: float) -> float:
+    """ln(e**score + e**x) without overflow."""
+    return max(score, x) + math.log1p(math.exp(-abs(score - x)))
+
+
+def _added(x: float):
+    """log_add() of the score column and x, in SQL."""
+    x = Value(x, output_field=FloatField())
+    return Greatest(F('score'), x) + Ln(1 + Exp(-Abs(F('score') - x)))
+
+
+def _update(model, increments: dict) -> int:
+    """One UPDATE per distinct increment, returns the rows changed."""
+    by_x = defaultdict(list)
+    for pk, x in increments.items():
+        by_x[x].append(pk)
+    return sum(model.objects.filter(pk__in=pks).update(score=_added(x))
+               for x, pks in by_x.items())
+
+
+def _add(model, increments: dict, new) -> None:
+    """Adds {pk: x} to the scores. Missing rows are created by new(pk)
+    with an EMPTY score first, so rows created by a concurrent request
+    in the meantime are not lost."""
+    if _update(model, increments) == len(increments):
+        return
+    known = set(model.objects.filter(pk__in=increments)
+                .values_list('pk', flat=True))
+    missing = {pk: x for pk, x in increments.items() if pk not in known}
+    model.objects.bulk_create([new(pk) for pk in missing],
+                              ignore_conflicts=True)
+    _update(model, missing)
+
+
+def record(kind: str, counts: dict, group_ids: dict = None,
+           at: float = None) -> None:
+    """Adds {post id: number of events} of one kind (a key of
+    settings.RANKING_WEIGHTS) that happened at the unix time at, now
+    by default. group_ids maps the post ids to their groups; without it
+    the groups are read, and posts that no longer exist are skipped."""
+    if group_ids is None:
+        group_ids = dict(Post.objects.filter(pk__in=counts)
+                         .values_list('pk', 'group_id'))
+        counts = {pk: count for pk, count in counts.items()
+                  if pk in group_ids}
+    weight = settings.RANKING_WEIGHTS[kind]
+    # ln() of a weight or a count that is not positive is undefined
+    counts = {pk: count for pk, count in counts.items() if count > 0}
+    if weight <= 0 or not counts:
+        return
+    base = exponent(time.time() if at is None else at)
+    per_group = Counter()
+    for post_id, count in counts.items():
+        if group_ids.get(post_id):
+            per_group[group_ids[post_id]] += count
+    with transaction.atomic():
+        _add(PostScore,
+             {pk: base + math.log(weight * count)
+              for pk, count in counts.items()},
+             lambda pk: PostScore(post_id=pk, group_id=group_ids.get(pk),
+                                  score=EMPTY))
+        if per_group:
+            _add(GroupScore,
+                 {pk: base + math.log(weight * count)
+                  for pk, count in per_group.items()},
+                 lambda pk: GroupScore(group_id=pk, score=EMPTY))
+
+
+def moved(post) -> None:
+    """Keeps the copied group of an edited post. The activity the post
+    brought to its old group stays there until it decays."""
+    PostScore.objects.filter(post_id=post.pk).update(group_id=post.group_id)
+
+
+def _top_posts(group_id=None) -> list:
+    scores = PostScore.objects.order_by('-score')
+    if group_id is not None:
+        scores = scores.filter(group_id=group_id)
+    return list(scores.values_list('post_id', flat=True)
+                [:settings.RANKING_TOP_K])
+
+
+def _top_groups() -> list:
+    return list(GroupScore.objects.order_by('-score')
+                .values_list('group_id', flat=True)
+                [:settings.RANKING_TOP_K])
+
+
+def _cached(key: str, compute) -> list:
+    ids = cache.get(key)
+    if ids is None:
+        ids = compute()
+        cache.set(key, ids, settings.RANKING_REFRESH)
+    return ids
+
+
+def top_posts(group_id: int = None) -> list:
+    """Ids of the top posts of the group, or of all posts."""
+    return _cached(f'ranking:posts:{group_id or ALL}',
+                   lambda: _top_posts(group_id))
+
+
+def top_groups() -> list:
+    """Ids of the top groups."""
+    return _cached('ranking:groups', _top_groups)
+
+
+def refresh() -> None:
+    """Recomputes every top list at once."""
+    lists = {f'ranking:posts:{ALL}': _top_posts(),
+             'ranking:groups': _top_groups()}
+    for group_id in Group.objects.values_list('pk', flat=True):
+        lists[f'ranking:posts:{group_id}'] = _top_posts(group_id)
+    cache.set_many(lists, settings.RANKING_REFRESH)
+
+
+def _batches(objects):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def rebuild_scores() -> int:
+    """Computes every score from the comments again,
+    returns the number of scored posts."""
+    weight = settings.RANKING_WEIGHTS['comment']
+    comments = Comment.objects.order_by()
+    if weight <= 0:
+        # comments do not count, so every score is dropped
+        comments, weight = comments.none(), 1
+    shift = math.log(weight)
+    scores = {}
+    for post_id, created in (comments.values_list('post_id', 'created')
+                             .iterator(chunk_size=BATCH_SIZE)):
+        x = exponent(created.timestamp()) + shift
+        scores[post_id] = (log_add(scores[post_id], x)
+                           if post_id in scores else x)
+    groups = {}
+    group_scores = {}
+    for post_id, group_id in (Post.objects.exclude(group=None).order_by()
+                              .values_list('pk', 'group_id')
+                              .iterator(chunk_size=BATCH_SIZE)):
+        if post_id in scores:
+            groups[post_id] = group_id
+            score = scores[post_id]
+            group_scores[group_id] = (log_add(group_scores[group_id], score)
+                                      if group_id in group_scores
+                                      else score)
+    with transaction.atomic():
+        PostScore.objects.all().delete()
+        GroupScore.objects.all().delete()
+        for batch in _batches(
+                PostScore(post_id=post_id, group_id=groups.get(post_id),
+                          score=score)
+                for post_id, score in scores.items()):
+            PostScore.objects.bulk_create(batch)
+        GroupScore.objects.bulk_create(
+            GroupScore(group_id=group_id, score=score)
+            for group_id, score in group_scores.items())
+    refresh()
+    return len(scores)
@@ -0,0 +1,360 @@
+"""Full-text search over posts.
+
+When the database is SQLite built with FTS5, the text of every post is
+copied into the posts_post_fts virtual table and results are ranked by
+bm25. Otherwise (another database, SQLite without FTS5, or
+settings.SEARCH_BACKEND = 'index') an inverted index is kept on disk in
+settings.SEARCH_INDEX_DIR and ranked with the same bm25 formula in
+Python. Both match every query word as a prefix.
+
+Both are updated by posts.signals when a post is saved or deleted;
+``manage.py rebuild_search_index`` fills them from scratch."""
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+CREATE_FTS_SQL = (f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                  f'USING fts5(text, '
+                  f"tokenize='unicode61 remove_diacritics 2')")
+FTS_SEARCH_SQL = (f'SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, %s, %s) '
+                  f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                  f'ORDER BY rank, rowid DESC LIMIT %s OFFSET %s')
+FTS_COUNT_SQL = (f'SELECT COUNT(*) FROM {FTS_TABLE} '
+                 f'WHERE {FTS_TABLE} MATCH %s')
+FTS_IDS_SQL = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+
+WORD_RE = re.compile(r'\w+')
+MAX_WORDS = 8
+# the best matches filter_posts takes from the inverted index: they are
+# sent as an IN list, within the variables any SQLite accepts
+FILTER_LIMIT = 500
+SNIPPET_WORDS = 16
+# marks around matched words, replaced with <mark> after escaping
+MARK_START, MARK_END = '\x02', '\x03'
+ELLIPSIS = '…'
+# bm25 parameters, the same as FTS5 uses
+K1, B = 1.2, 0.75
+# upper bound for a prefix range of words
+LAST_CHAR = chr(0x10FFFF)
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    occurrences INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (term, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_post ON postings (post_id);
+CREATE TABLE IF NOT EXISTS documents (
+    post_id INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (docs INTEGER, length INTEGER);
+INSERT INTO totals SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM totals);
+'''
+
+_fts5 = {}
+
+
+def words(text: str) -> list:
+    return WORD_RE.findall(text.lower())
+
+
+def fts5_available(conn=connection) -> bool:
+    """Tells whether the database is SQLite with FTS5 compiled in."""
+    if conn.vendor != 'sqlite':
+        return False
+    if conn.alias not in _fts5:
+        with conn.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            _fts5[conn.alias] = any(
+                option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+    return _fts5[conn.alias]
+
+
+def uses_fts() -> bool:
+    if settings.SEARCH_BACKEND is not None:
+        return settings.SEARCH_BACKEND == 'fts5'
+    return fts5_available()
+
+
+def match_query(query_words) -> str:
+    """All words must be present; each one also matches as a prefix."""
+    return ' '.join(f'"{word}"*' for word in query_words)
+
+
+def highlight(snippet: str):
+    """Escapes the snippet and turns the marks into <mark> tags."""
+    return mark_safe(escape(snippet)
+                     .replace(MARK_START, '<mark>')
+                     .replace(MARK_END, '</mark>'))
+
+
+def make_snippet(text: str, query_words) -> str:
+    """Cuts SNIPPET_WORDS words around the first match and marks
+    the matched words, the way FTS5 snippet() does."""
+    matches = list(WORD_RE.finditer(text))
+    prefixes = tuple(query_words)
+
+    def wanted(match) -> bool:
+        return match.group().lower().startswith(prefixes)
+
+    first = next((num for num, match in enumerate(matches)
+                  if wanted(match)), 0)
+    start = max(first - SNIPPET_WORDS // 4, 0)
+    window = matches[start:start + SNIPPET_WORDS]
+    if not window:
+        return text
+    parts = [ELLIPSIS] if start else []
+    position = window[0].start()
+    for match in window:
+        parts.append(text[position:match.start()])
+        if wanted(match):
+            parts.append(f'{MARK_START}{match.group()}{MARK_END}')
+        else:
+            parts.append(match.group())
+        position = match.end()
+    if window[-1] is not matches[-1]:
+        parts.append(ELLIPSIS)
+    return ''.join(parts)
+
+
+class InvertedIndex:
+    """
+    Inverted index of post texts in a plain SQLite file (no FTS5 needed):
+    one row per (word, post) with the number of occurrences and the
+    length of the post. Words are looked up by prefix on the primary
+    key; tokenizing and bm25 ranking are done in Python.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, 'posts.sqlite3')
+        self._local = threading.local()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after fork."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(INDEX_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _remove(db, post_ids: list) -> None:
+        placeholders = ','.join('?' * len(post_ids))
+        removed = db.execute(
+            f'SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents '
+            f'WHERE post_id IN ({placeholders})', post_ids).fetchone()
+        db.execute(f'DELETE FROM postings WHERE post_id IN ({placeholders})',
+                   post_ids)
+        db.execute(f'DELETE FROM documents '
+                   f'WHERE post_id IN ({placeholders})', post_ids)
+        db.execute('UPDATE totals SET docs = docs - ?, length = length - ?',
+                   removed)
+
+    def add(self, post_id: int, text: str) -> None:
+        self.add_many([(post_id, text)])
+
+    def add_many(self, posts) -> None:
+        """Indexes (post id, text) pairs in one transaction."""
+        postings, documents = [], []
+        for post_id, text in posts:
+            terms = Counter(words(text))
+            length = sum(terms.values())
+            postings.extend((term, post_id, occurrences, length)
+                            for term, occurrences in terms.items())
+            documents.append((post_id, length))
+        if not documents:
+            return
+        with self._write() as db:
+            for start in range(0, len(documents), 500):
+                self._remove(db, [post_id for post_id, _
+                                  in documents[start:start + 500]])
+            db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                           postings)
+            db.executemany('INSERT INTO documents VALUES (?, ?)', documents)
+            db.execute('UPDATE totals SET docs = docs + ?, '
+                       'length = length + ?',
+                       [len(documents),
+                        sum(length for _, length in documents)])
+
+    def remove(self, post_id: int) -> None:
+        with self._write() as db:
+            self._remove(db, [post_id])
+
+    def clear(self) -> None:
+        with self._write() as db:
+            db.execute('DELETE FROM postings')
+            db.execute('DELETE FROM documents')
+            db.execute('UPDATE totals SET docs = 0, length = 0')
+
+    def _postings(self, word: str) -> dict:
+        """Returns {post id: (occurrences, length)} for the words
+        starting with the given one."""
+        found = {}
+        rows = self._db.execute(
+            'SELECT post_id, occurrences, length FROM postings '
+            'WHERE term >= ? AND term < ?', [word, word + LAST_CHAR])
+        for post_id, occurrences, length in rows:
+            previous = found.get(post_id, (0, length))[0]
+            found[post_id] = (previous + occurrences, length)
+        return found
+
+    def search(self, query_words) -> list:
+        """Returns ids of the posts containing every word (as a prefix),
+        best bm25 score first."""
+        docs, total = self._db.execute(
+            'SELECT docs, length FROM totals').fetchone()
+        if not query_words or not docs:
+            return []
+        postings = []
+        for word in query_words:
+            posting = self._postings(word)
+            if not posting:
+                return []
+            postings.append(posting)
+        average = total / docs
+        found = set.intersection(*(set(posting) for posting in postings))
+        scores = dict.fromkeys(found, 0.0)
+        for posting in postings:
+            idf = math.log(1 + (docs - len(posting) + 0.5)
+                           / (len(posting) + 0.5))
+            for post_id in found:
+                occurrences, length = posting[post_id]
+                scores[post_id] += idf * occurrences * (K1 + 1) / (
+                    occurrences + K1 * (1 - B + B * length / average))
+        return sorted(found, key=lambda pk: (scores[pk], pk), reverse=True)
+
+
+def inverted_index() -> InvertedIndex:
+    return InvertedIndex(settings.SEARCH_INDEX_DIR)
+
+
+def index_post(post) -> None:
+    """Puts the current text of a saved post into the index."""
+    index_posts([post])
+
+
+def index_posts(posts) -> None:
+    """Puts the current texts of saved posts into the index at once."""
+    rows = [(post.pk, post.text) for post in posts]
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                               [[post_id] for post_id, _ in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, text) '
+                               f'VALUES (%s, %s)', rows)
+    else:
+        transaction.on_commit(lambda: inverted_index().add_many(rows))
+
+
+def remove_post(post_id: int) -> None:
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [post_id])
+    else:
+        transaction.on_commit(lambda: inverted_index().remove(post_id))
+
+
+def filter_posts(posts, query: str):
+    """Narrows a Post queryset down to the posts matching the query,
+    keeping its ordering. With FTS5 the matches are a subquery; the
+    inverted index lives in another file, so only its FILTER_LIMIT
+    best matches by bm25 are kept."""
+    query_words = words(query)[:MAX_WORDS]
+    if not query_words:
+        return posts
+    if uses_fts():
+        return posts.extra(
+            where=[f'{Post._meta.db_table}.id IN ({FTS_IDS_SQL})'],
+            params=[match_query(query_words)])
+    return posts.filter(
+        pk__in=inverted_index().search(query_words)[:FILTER_LIMIT])
+
+
+class SearchResults:
+    """
+    Posts matching a query, best first, each with a highlighted
+    snippet attribute.
+
+    Supports count() and slicing, so it can be handed to Paginator
+    like the feeds.
+    """
+    def __init__(self, query: str):
+        self.words = words(query)[:MAX_WORDS]
+        self.fts = uses_fts()
+        self._ranked = None
+
+    def ranked(self) -> list:
+        """Ids of all matching posts, for the on-disk index."""
+        if self._ranked is None:
+            self._ranked = inverted_index().search(self.words)
+        return self._ranked
+
+    def count(self) -> int:
+        if not self.words:
+            return 0
+        if not self.fts:
+            return len(self.ranked())
+        with connection.cursor() as cursor:
+            cursor.execute(FTS_COUNT_SQL,
+                           [match_query(self.words)])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index: slice) -> list:
+        if not self.words:
+            return []
+        if self.fts:
+            with connection.cursor() as cursor:
+                cursor.execute(FTS_SEARCH_SQL, [
+                    MARK_START, MARK_END, ELLIPSIS, SNIPPET_WORDS,
+                    match_query(self.words),
+                    index.stop - index.start, index.start])
+                snippets = dict(cursor.fetchall())
+        else:
+            snippets = dict.fromkeys(self.ranked()[index])
+        posts = Post.objects.feed().in_bulk(list(snippets))
+        found = []
+        for post_id, snippet in snippets.items():
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            if snippet is None:
+                snippet = make_snippet(post.text, self.words)
+            post.snippet = highlight(snippet)
+            found.append(post)
+        return found
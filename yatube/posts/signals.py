@@ -0,0 +1,78 @@
+"""Keeps AuthorStats counters, comment counts of posts, follower
+timelines, the search index, trending scores and cached feed pages in
+step with posts, groups, comments and follows."""
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import feed_cache, follows, ranking, search, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.change(instance.author_id, 'posts', 1)
+        timeline.fan_out(instance)
+    elif getattr(instance, '_saved_group_id', None) != instance.group_id:
+        ranking.moved(instance)
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    AuthorStats.change(instance.author_id, 'posts', -1)
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.change(instance.author_id, 'comments', 1)
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1)
+        ranking.record('comment', {instance.post_id: 1},
+                       {instance.post_id: instance.post.group_id})
+        feed_cache.invalidate(f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    AuthorStats.change(instance.author_id, 'comments', -1)
+    Post.objects.filter(pk=instance.post_id).update(
+        comment_count=Greatest(F('comment_count') - 1, 0))
+    feed_cache.invalidate(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        follows.followed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follows.unfollowed(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def post_moving(sender, instance, **kwargs):
+    """Remembers the group an edited post is saved from."""
+    if instance.pk:
+        instance._saved_group_id = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group_id', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    feed_cache.invalidate_post(instance,
+                               getattr(instance, '_saved_group_id', None))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    feed_cache.invalidate(feed_cache.ALL_FEEDS)
@@ -0,0 +1,33 @@
+"""Random but realistically skewed data for seeding and benchmarks.
+
+Real communities are far from uniform: a few authors write most of the
+posts, a few words make up most of the text, a few posts collect most
+of the comments. Ranks are drawn from a Zipf distribution, where the
+item of rank r is picked about 1/r**s times as often as the first."""
+import random
+from itertools import accumulate
+
+SYLLABLES = ('ко', 'ра', 'ми', 'то', 'ла', 'не', 'ст', 'ви',
+             'да', 'по', 'ре', 'ну', 'жи', 'са', 'ше', 'лю')
+
+
+def zipf_weights(count: int, exponent: float = 1.0) -> list:
+    """Cumulative weights for random.choices over count ranked items."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+def vocabulary(size: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def texts(count: int, words: list, per_post: int, rng: random.Random):
+    """Yields post texts where the word of rank r appears
+    about 1/r times as often as the most frequent one."""
+    cum_weights = zipf_weights(len(words))
+    for _ in range(count):
+        yield ' '.join(rng.choices(words, cum_weights=cum_weights,
+                                   k=per_post))
@@ -0,0 +1,17 @@
+from django import template
+
+from posts.follows import followed_ids
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/follow_button.html',
+                        takes_context=True)
+def follow_button(context, author):
+    """Кнопка подписки на автора или отписки от него. Подписки
+    посетителя читаются одним запросом на всю страницу."""
+    request = context['request']
+    own = request.user.pk == author.pk
+    return {'author': author,
+            'own': own,
+            'following': not own and author.pk in followed_ids(request)}
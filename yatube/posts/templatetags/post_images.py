@@ -0,0 +1,34 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+SIZES = '(max-width: 960px) 100vw, 960px'
+
+
+def srcset(variants) -> str:
+    return ', '.join(f'{variant.image.url} {variant.width}w'
+                     for variant in variants)
+
+
+@register.filter
+def image_variants(post):
+    """Возвращает данные для <picture> из готовых копий картинки поста
+    или ставит их в очередь и возвращает None."""
+    if not post.image:
+        return None
+    variants = list(post.image_variants.all())
+    if not variants:
+        thumbnails.schedule(post.pk)
+        return None
+    by_format = {}
+    for variant in sorted(variants, key=lambda variant: variant.width):
+        by_format.setdefault(variant.format, []).append(variant)
+    fallback = by_format.get('jpeg') or variants
+    src = [variant for variant in fallback
+           if variant.width <= thumbnails.FEED_SIZE[0]] or fallback
+    return {'src': src[-1],
+            'jpeg': srcset(by_format.get('jpeg', [])),
+            'webp': srcset(by_format.get('webp', [])),
+            'sizes': SIZES}
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Group, Post
+from ..pagination import EstimatedCountPaginator
+
+User = get_user_model()
+POST_CHANGELIST = '/admin/posts/post/'
+GROUP_CHANGELIST = '/admin/posts/group/'
+
+
+class PostAdminTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        cls.groups = [
+            Group.objects.create(title=f'Группа {num}', slug=f'group-{num}',
+                                 description='Тестовое описание')
+            for num in range(3)]
+        cls.authors = [User.objects.create_user(username=f'author-{num}')
+                       for num in range(3)]
+
+    def setUp(self):
+        self.admin_client = Client()
+        self.admin_client.force_login(self.admin)
+
+    def create_posts(self, count: int) -> None:
+        Post.objects.bulk_create(
+            Post(text=f'Тестовый пост {num}',
+                 author=self.authors[num % len(self.authors)],
+                 group=(self.groups[num % len(self.groups)]
+                        if num % 4 else None))
+            for num in range(count))
+
+    def changelist_queries(self, url: str = POST_CHANGELIST) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.admin_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count(self):
+        """Число запросов списка постов не зависит от числа строк."""
+        self.create_posts(5)
+        few = self.changelist_queries()
+        self.create_posts(95)
+        self.assertEqual(self.changelist_queries(), few)
+        # сессия, пользователь, оценка и число постов, страница
+        # с авторами и группами, границы дат и годы для date_hierarchy
+        self.assertEqual(few, 7)
+
+    def test_changelist_no_group_select(self):
+        """Группа редактируется по id, а не списком всех групп."""
+        self.create_posts(4)
+        response = self.admin_client.get(POST_CHANGELIST)
+        self.assertNotContains(response, '<select name="form-0-group"')
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertContains(response, 'Группа 1')
+
+    def test_changelist_search_and_dates(self):
+        """Поиск и фильтр по дате сужают список постов."""
+        self.create_posts(4)
+        Post.objects.create(text='Редкое слово', author=self.authors[0])
+        response = self.admin_client.get(POST_CHANGELIST, {'q': 'редкое'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        post = Post.objects.first()
+        response = self.admin_client.get(POST_CHANGELIST, {
+            'pub_date__year': post.pub_date.year,
+            'pub_date__month': post.pub_date.month})
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_group_changelist(self):
+        """Список групп открывается."""
+        self.assertEqual(self.changelist_queries(GROUP_CHANGELIST), 5)
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=3)
+    def test_estimated_count(self):
+        """Без фильтров число постов берётся из наибольшего id."""
+        self.create_posts(5)
+        posts = Post.objects.all()
+        posts.order_by('pk').first().delete()
+        last = posts.order_by('pk').last().pk
+        self.assertEqual(EstimatedCountPaginator(posts, 10).count, last)
+        filtered = posts.filter(group=self.groups[1])
+        self.assertEqual(EstimatedCountPaginator(filtered, 10).count,
+                         filtered.count())
+        with self.settings(ESTIMATED_COUNT_THRESHOLD=last + 1):
+            self.assertEqual(EstimatedCountPaginator(posts, 10).count, 4)
@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db.models import Count, F
+from django.test import TestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from .. import search
+from ..models import (AuthorStats, Comment, Follow, Group, Post,
+                      TimelineEntry)
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImportExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-slug',
+                                         description='Тестовое описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_jsonl(self, rows) -> str:
+        path = os.path.join(self.directory, 'posts.jsonl')
+        with open(path, 'w', encoding='utf-8') as dump:
+            for row in rows:
+                dump.write(row if isinstance(row, str)
+                           else json.dumps(row, ensure_ascii=False))
+                dump.write('\n')
+        return path
+
+    def run_command(self, *args, **options) -> str:
+        out = StringIO()
+        call_command(*args, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        """Выгруженные посты загружаются обратно с датами и группами."""
+        Post.objects.create(text='Первый пост', author=self.author,
+                            group=self.group)
+        Post.objects.create(text='Второй пост', author=self.reader)
+        expected = list(Post.objects.order_by('pk').values_list(
+            'text', 'pub_date', 'author', 'group'))
+        for file_name in ('posts.jsonl', 'posts.csv'):
+            with self.subTest(file_name=file_name):
+                path = os.path.join(self.directory, file_name)
+                output = self.run_command('export_posts', path)
+                self.assertIn('Выгружено постов: 2', output)
+                Post.objects.all().delete()
+                output = self.run_command('import_posts', path,
+                                          batch_size=1)
+                self.assertIn('Импортировано постов: 2', output)
+                self.assertEqual(list(Post.objects.order_by('pk')
+                                      .values_list('text', 'pub_date',
+                                                   'author', 'group')),
+                                 expected)
+
+    def test_import_updates_derived_data(self):
+        """Импорт обновляет статистику, ленты подписчиков и поиск."""
+        path = self.write_jsonl([
+            {'text': 'Кот на крыше', 'author': 'auth',
+             'pub_date': '2021-11-17T19:14:00+00:00'},
+            {'text': 'Собака в будке', 'author': 'auth',
+             'group': 'test-slug'},
+        ])
+        self.run_command('import_posts', path)
+        self.assertEqual(AuthorStats.objects.get(author=self.author).posts,
+                         2)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2)
+        cat_post = Post.objects.get(text='Кот на крыше')
+        self.assertEqual(cat_post.pub_date,
+                         datetime(2021, 11, 17, 19, 14, tzinfo=timezone.utc))
+        self.assertEqual(search.SearchResults('кот')[0:10], [cat_post])
+
+    def test_import_skips_bad_rows(self):
+        """Строки без автора, группы, с невозможной датой, с автором
+        или группой не строкой или с ошибками пропускаются,
+        а с --create-missing авторы и группы создаются."""
+        path = self.write_jsonl([
+            {'text': 'Пост', 'author': 'auth'},
+            {'text': 'Чужой пост', 'author': 'stranger'},
+            {'text': 'Пост в новой группе', 'author': 'auth',
+             'group': 'new-group'},
+            {'author': 'auth'},
+            '{not json',
+            {'text': 'Пост', 'author': 'auth',
+             'pub_date': '2021-02-30T10:00:00'},
+            {'text': 'Пост', 'author': 'auth', 'pub_date': 20210101},
+            {'text': 'Пост', 'author': ['auth']},
+            {'text': 'Пост', 'author': 'auth', 'group': {'slug': 'x'}},
+        ])
+        output = self.run_command('import_posts', path)
+        self.assertIn('Импортировано постов: 1', output)
+        self.assertIn('пропущено строк: 8', output)
+        output = self.run_command('import_posts', path, create_missing=True)
+        self.assertIn('Импортировано постов: 3', output)
+        self.assertTrue(User.objects.filter(username='stranger').exists())
+        self.assertTrue(Group.objects.filter(slug='new-group').exists())
+
+    def test_import_missing_file(self):
+        """Отсутствующий файл — ошибка команды, а не трейсбек."""
+        with self.assertRaises(CommandError):
+            self.run_command('import_posts',
+                             os.path.join(self.directory, 'missing.jsonl'))
+
+    def test_import_copies_images(self):
+        """Картинки копируются из папки --images-from."""
+        os.makedirs(os.path.join(self.directory, 'posts'))
+        with open(os.path.join(self.directory, 'posts', 'cat.gif'),
+                  'wb') as image:
+            image.write(b'GIF89a')
+        path = self.write_jsonl([
+            {'text': 'С картинкой', 'author': 'auth',
+             'image': 'posts/cat.gif'},
+            {'text': 'С потерянной картинкой', 'author': 'auth',
+             'image': 'posts/lost.gif'},
+            {'text': 'Из чужой папки', 'author': 'auth',
+             'image': '../secret.gif'},
+        ])
+        output = self.run_command('import_posts', path,
+                                  images_from=self.directory)
+        self.assertIn('картинок: 1', output)
+        post = Post.objects.get(text='С картинкой')
+        self.assertTrue(post.image.name.startswith('posts/cat'))
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertFalse(Post.objects.get(text='Из чужой папки').image)
+
+
+class SeedTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        call_command('seed', users=30, groups=4, posts=300, comments=400,
+                     follows=5, batch_size=100, stdout=StringIO())
+
+    def test_seed(self):
+        """seed создаёт данные с перекосом и согласованные счётчики."""
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 400)
+        top, *_, last = (User.objects.annotate(total=Count('posts'))
+                         .order_by('-total'))
+        self.assertGreater(top.total, 3 * last.total)
+        for stats in AuthorStats.objects.all():
+            with self.subTest(author=stats.author_id):
+                self.assertEqual(stats.posts, Post.objects.filter(
+                    author_id=stats.author_id).count())
+        self.assertFalse(Post.objects.annotate(total=Count('comments'))
+                         .exclude(comment_count=F('total')).exists())
+        follow = Follow.objects.first()
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=follow.user,
+                                         author=follow.author).count(),
+            Post.objects.filter(author=follow.author).count())
+        self.assertFalse(Post.objects.exclude(
+            pub_date__lt=django_timezone.now()).exists())
+        with self.assertRaises(CommandError):
+            call_command('seed', users=1, stdout=StringIO())
+
+    def test_bench_views(self):
+        """bench_views сохраняет задержки, запросы и память в JSON."""
+        output = os.path.join(self.directory, 'bench.json')
+        call_command('bench_views', requests=3, warmup=1, output=output,
+                     stdout=StringIO(), stderr=StringIO())
+        call_command('bench_views', requests=3, warmup=0, cold=True,
+                     output=output, compare=output,
+                     stdout=StringIO(), stderr=StringIO())
+        with open(output, encoding='utf-8') as dump:
+            results = json.load(dump)
+        self.assertEqual(set(results['views']), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'trending'})
+        for name, measured in results['views'].items():
+            with self.subTest(view=name):
+                self.assertGreater(measured['queries'], 0)
+                self.assertGreater(measured['peak_memory_kb'], 0)
+                self.assertLessEqual(measured['latency_ms']['p50'],
+                                     measured['latency_ms']['max'])
@@ -1,5 +1,7 @@
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.test import Client, TestCase, override_settings
 from http import HTTPStatus
@@ -7,7 +9,9 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from PIL import Image
 
+from .. import thumbnails
 from ..models import Post, Group, Comment
 
 User = get_user_model()
@@ -115,6 +119,73 @@ class PostFormTests(TestCase):
         # Проверяем, число постов осталось прежним
         self.assertEqual(Post.objects.count(), post_count)
 
+    def upload_small_gif(self):
+        """Отправляет форму нового поста с картинкой 2x1."""
+        small_gif = (b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                     b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                     b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                     b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                     b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                     b'\x0A\x00\x3B')
+        uploaded = SimpleUploadedFile(name='limit.gif', content=small_gif,
+                                      content_type='image/gif')
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': uploaded})
+
+    def test_image_limits(self):
+        """Слишком большой файл или картинка отклоняются при загрузке."""
+        post_count = Post.objects.count()
+        limits = {'POST_IMAGE_MAX_SIZE': 20, 'POST_IMAGE_MAX_PIXELS': 1}
+        for name, value in limits.items():
+            with self.subTest(name=name), override_settings(**{name: value}):
+                response = self.upload_small_gif()
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertTrue(response.context['form'].errors['image'])
+                self.assertEqual(Post.objects.count(), post_count)
+
+    def test_image_metadata_removed(self):
+        """Из загруженной картинки удаляются EXIF-данные."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, 'JPEG',
+                                               exif=exif.tobytes())
+        uploaded = SimpleUploadedFile(name='photo.jpg',
+                                      content=buffer.getvalue(),
+                                      content_type='image/jpeg')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Фото', 'image': uploaded})
+        post = Post.objects.get(text='Фото')
+        original = post.image.name
+        self.assertTrue(thumbnails.make_variants(post.pk))
+        post.refresh_from_db()
+        self.assertFalse(post.image.storage.exists(original))
+        with post.image.open('rb') as image_file:
+            image = Image.open(image_file)
+            self.assertNotIn('exif', image.info)
+            self.assertEqual(image.size, (40, 30))
+
+    def test_image_variants_replaced(self):
+        """Повторное создание копий картинки заменяет строки целиком,
+        а старые файлы удаляются после записи новых."""
+        self.upload_small_gif()
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertTrue(thumbnails.make_variants(post.pk))
+        old = list(post.image_variants.all())
+        self.assertTrue(old)
+        # TestCase не фиксирует транзакции, on_commit выполняем сразу
+        with mock.patch.object(thumbnails.transaction, 'on_commit',
+                               lambda func: func()):
+            self.assertTrue(thumbnails.make_variants(post.pk))
+        new = list(post.image_variants.all())
+        self.assertEqual(len(new), len(old))
+        for variant in old:
+            self.assertFalse(variant.image.storage.exists(variant.image.name))
+        for variant in new:
+            self.assertTrue(variant.image.storage.exists(variant.image.name))
+
     def test_comment_acsess(self):
         """Kомментировать посты может авторизованный пользователь."""
         count_comment = Comment.objects.count()
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 
-from ..models import Post, Group
+from ..models import AuthorStats, Comment, Follow, Post, Group
 
 User = get_user_model()
 
@@ -39,3 +42,43 @@ class PostModelTest(TestCase):
         max_length_group = group._meta.get_field('title').max_length
         length_title_group = len(group.title)
         self.assertLessEqual(length_title_group, max_length_group)
+
+
+class AuthorStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def test_stats_follow_creates_and_deletes(self):
+        """Счётчики AuthorStats меняются при создании и удалении."""
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        Comment.objects.create(text='Комментарий',
+                               author=self.reader,
+                               post=post)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        author_stats = AuthorStats.get_for(self.author)
+        reader_stats = AuthorStats.get_for(self.reader)
+        self.assertEqual(author_stats.posts, 1)
+        self.assertEqual(author_stats.followers, 1)
+        self.assertEqual(reader_stats.comments, 1)
+        self.assertEqual(reader_stats.following, 1)
+        follow.delete()
+        post.delete()
+        author_stats.refresh_from_db()
+        reader_stats.refresh_from_db()
+        self.assertEqual(author_stats.posts, 0)
+        self.assertEqual(author_stats.followers, 0)
+        self.assertEqual(reader_stats.comments, 0)
+        self.assertEqual(reader_stats.following, 0)
+
+    def test_rebuild_author_stats(self):
+        """Команда rebuild_author_stats пересчитывает счётчики с нуля."""
+        Post.objects.bulk_create([
+            Post(text=f'Запись {num}', author=self.author)
+            for num in range(3)])
+        AuthorStats.objects.all().delete()
+        call_command('rebuild_author_stats', stdout=StringIO())
+        self.assertEqual(AuthorStats.objects.get(author=self.author).posts, 3)
+        self.assertEqual(AuthorStats.objects.get(author=self.reader).posts, 0)
@@ -0,0 +1,105 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import ranking
+from ..models import Comment, Group, GroupScore, Post, PostScore
+
+User = get_user_model()
+DAY = 60 * 60 * 24
+
+
+class RankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-slug',
+                                         description='Тестовое описание')
+        cls.other_group = Group.objects.create(title='Другая группа',
+                                               slug='other-slug',
+                                               description='Описание')
+        cls.old = Post.objects.create(text='Старое обсуждение',
+                                      author=cls.author, group=cls.group)
+        cls.fresh = Post.objects.create(text='Свежее обсуждение',
+                                        author=cls.author, group=cls.group)
+        cls.quiet = Post.objects.create(text='Тихий пост',
+                                        author=cls.author,
+                                        group=cls.other_group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recent_activity_ranks_higher(self):
+        """Старые комментарии весят меньше новых: три комментария
+        трёхдневной давности уступают одному сегодняшнему."""
+        ranking.record('comment', {self.old.pk: 3}, at=time.time() - 3 * DAY)
+        ranking.record('comment', {self.fresh.pk: 1})
+        self.assertEqual(ranking.top_posts(),
+                         [self.fresh.pk, self.old.pk])
+        ranking.record('comment', {self.old.pk: 1})
+        cache.clear()
+        self.assertEqual(ranking.top_posts(),
+                         [self.old.pk, self.fresh.pk])
+        self.assertEqual(ranking.top_posts(self.other_group.pk), [])
+
+    def test_comments_update_scores(self):
+        """Комментарии сразу меняют очки поста и группы, и они
+        совпадают с пересчётом с нуля."""
+        for post in (self.old, self.fresh, self.fresh, self.quiet):
+            Comment.objects.create(text='Комментарий', author=self.author,
+                                   post=post)
+        self.assertEqual(ranking.top_groups(),
+                         [self.group.pk, self.other_group.pk])
+        scores = dict(PostScore.objects.values_list('post_id', 'score'))
+        group_scores = dict(GroupScore.objects.values_list('group_id',
+                                                           'score'))
+        self.assertEqual(ranking.rebuild_scores(), 3)
+        for post_id, score in PostScore.objects.values_list('post_id',
+                                                            'score'):
+            self.assertAlmostEqual(scores[post_id], score, places=3)
+        for group_id, score in GroupScore.objects.values_list('group_id',
+                                                              'score'):
+            self.assertAlmostEqual(group_scores[group_id], score, places=3)
+
+    def test_moved_post_changes_group_list(self):
+        """Пост, перенесённый в другую группу, попадает в её список."""
+        ranking.record('comment', {self.old.pk: 1})
+        self.old.group = self.other_group
+        self.old.save()
+        self.assertEqual(ranking.top_posts(self.other_group.pk),
+                         [self.old.pk])
+        self.assertEqual(ranking.top_posts(self.group.pk), [])
+
+    def test_trending_pages(self):
+        """Вкладки популярного показывают посты и группы по очкам."""
+        ranking.record('comment', {self.fresh.pk: 2, self.quiet.pk: 1})
+        client = Client()
+        response = client.get(reverse('posts:trending'))
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.fresh, self.quiet])
+        response = client.get(reverse('posts:group_trending',
+                                      kwargs={'slug': 'other-slug'}))
+        self.assertEqual(response.context['group'], self.other_group)
+        self.assertEqual(list(response.context['page_obj']), [self.quiet])
+        response = client.get(reverse('posts:trending_groups'))
+        self.assertEqual(response.context['groups'],
+                         [self.group, self.other_group])
+        self.fresh.delete()
+        response = client.get(reverse('posts:trending'))
+        self.assertEqual(list(response.context['page_obj']), [self.quiet])
+
+    @override_settings(RANKING_WEIGHTS={'comment': 0, 'view': 0.1})
+    def test_zero_weight_is_not_counted(self):
+        """Вид событий с нулевым весом не влияет на очки и не ломает
+        ни комментарии, ни пересчёт."""
+        ranking.record('comment', {self.fresh.pk: 1})
+        Comment.objects.create(text='Комментарий', author=self.author,
+                               post=self.old)
+        self.assertFalse(PostScore.objects.exists())
+        self.assertFalse(GroupScore.objects.exists())
+        self.assertEqual(ranking.rebuild_scores(), 0)
+        self.assertEqual(ranking.top_posts(), [])
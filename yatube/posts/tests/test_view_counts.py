@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import ranking, view_counts
+from ..models import Post, PostScore
+
+User = get_user_model()
+
+
+class ViewCountTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # views counted by other tests belong to their posts
+        view_counts.flush()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        cls.url = reverse('posts:post_detail', kwargs={'post_id': cls.post.pk})
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_views_written_in_batches(self):
+        """Просмотры копятся в памяти и пишутся одной транзакцией,
+        в том числе просмотры страниц из кэша."""
+        for client in (self.client, self.client, self.author_client):
+            client.get(self.url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 0)
+        self.assertEqual(view_counts.stats()['pending_views'], 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(view_counts.flush(), 3)
+        self.assertEqual(
+            [query['sql'] for query in queries
+             if query['sql'].startswith('UPDATE "posts_post" ')],
+            [f'UPDATE "posts_post" SET "views" = ("posts_post"."views" + 3) '
+             f'WHERE "posts_post"."id" IN ({self.post.pk})'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+        self.assertTrue(PostScore.objects.filter(post=self.post).exists())
+        self.assertEqual(ranking.top_posts(), [self.post.pk])
+        self.assertEqual(view_counts.flush(), 0)
+
+    def test_failed_flush_keeps_views(self):
+        """Если запись не удалась, просмотры ждут следующей."""
+        self.client.get(self.url)
+        self.client.get(self.url)
+        with mock.patch.object(view_counts, 'write',
+                               side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                view_counts.flush()
+        self.assertEqual(view_counts.stats()['pending_views'], 2)
+        self.assertEqual(view_counts.flush(), 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 2)
+
+    def test_missing_post_not_counted(self):
+        """Несуществующие посты не попадают в счётчики."""
+        self.client.get(reverse('posts:post_detail', kwargs={'post_id': 0}))
+        self.assertEqual(view_counts.stats()['pending_views'], 0)
@@ -1,5 +1,7 @@
 import shutil
 import tempfile
+from http import HTTPStatus
+from unittest import mock
 
 from django.test import TestCase, Client, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -8,9 +10,16 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django import forms
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
 
 
-from ..models import Post, Group, Comment, Follow
+from ..models import (AuthorStats, Post, Group, Comment, Follow,
+                      TimelineEntry)
+from .. import search, timeline, view_counts
+from ..thumbnails import make_variants
 
 User = get_user_model()
 POSTS_PER_PAGE = 11
@@ -65,6 +74,31 @@ class PostPaginatorTests(TestCase):
                 response_two = self.authorized_client.get(template + '?page=2')
                 self.assertEqual(len(response_two.context['page_obj']), 2)
 
+    @override_settings(KEYSET_PAGINATION_VIEWS=('index', 'group_list',
+                                                'profile'))
+    def test_keyset_paginator(self):
+        """Тестирование пагинации курсором."""
+        templates = [INDEX_URL, GROUP_LIST_URL, PROFILE_URL]
+        for template in templates:
+            with self.subTest(template=template):
+                response = self.authorized_client.get(template)
+                page_obj = response.context['page_obj']
+                self.assertEqual(len(page_obj), 10)
+                self.assertFalse(page_obj.has_previous())
+                response_two = self.authorized_client.get(
+                    template + f'?after={page_obj.next_cursor}')
+                page_two = response_two.context['page_obj']
+                self.assertEqual(len(page_two), 2)
+                self.assertFalse(page_two.has_next())
+                self.assertFalse(
+                    {post.pk for post in page_obj}
+                    & {post.pk for post in page_two})
+                response_back = self.authorized_client.get(
+                    template + f'?before={page_two.prev_cursor}')
+                self.assertEqual(
+                    [post.pk for post in response_back.context['page_obj']],
+                    [post.pk for post in page_obj])
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PageTests(TestCase):
@@ -114,6 +148,9 @@ class PageTests(TestCase):
                                            user=cls.author_test)
 
     def setUp(self) -> None:
+        # откат транзакции теста не отправляет сигналы,
+        # поэтому закэшированные страницы сбрасываются вручную
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.create_user(username='NoName')
         self.authorized_client = Client()
@@ -206,19 +243,39 @@ class PageTests(TestCase):
     def test_cache_index(self):
         """Проверка работы кэширования."""
         response = self.authorized_client.get(INDEX_URL).content
-        form_data = {
-            'group': self.group.pk,
-            'text': 'Страницы нет', }
-        self.authorized_client.post(
-            reverse('posts:post_create'),
-            data=form_data,
-            follow=True)
+        # update() не отправляет сигналы, страница берётся из кэша
+        Post.objects.filter(pk=self.post.pk).update(text='Страницы нет')
         response_two = self.authorized_client.get(INDEX_URL).content
         self.assertEqual(response_two, response)
         cache.clear()
         response_cache = self.authorized_client.get(INDEX_URL).content
         self.assertNotEqual(response_cache, response)
 
+    def test_cache_invalidated_by_new_post(self):
+        """Новый пост сразу появляется на закэшированных страницах."""
+        pages = [INDEX_URL, GROUP_LIST_URL, PROFILE_URL]
+        for adress in pages:
+            self.author_client.get(adress)
+        form_data = {
+            'group': self.group.pk,
+            'text': 'Новая запись', }
+        self.author_client.post(reverse('posts:post_create'),
+                                data=form_data)
+        for adress in pages:
+            with self.subTest(adress=adress):
+                response = self.author_client.get(adress)
+                self.assertContains(response, 'Новая запись')
+
+    def test_image_variants_placeholder(self):
+        """Пока копии картинки не готовы, показывается заглушка."""
+        response = self.guest_client.get(POST_DETAIL_URL)
+        self.assertContains(response, 'Картинка обрабатывается')
+        make_variants(self.post.pk)
+        response = self.guest_client.get(POST_DETAIL_URL)
+        self.assertNotContains(response, 'Картинка обрабатывается')
+        self.assertContains(response, '<img class="card-img my-2"')
+        self.assertContains(response, ' 320w')
+
     def test_follow(self):
         """Проверка работы функций подписки на авторов."""
         follows_before = Follow.objects.count()
@@ -255,3 +312,488 @@ class PageTests(TestCase):
         post = Post.objects.get(text='А ты не подписан')
         response_unfollow = self.author_test_client.get('/follow/')
         self.assertNotContains(response_unfollow, post)
+
+
+class FeedQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',)
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for num in range(POSTS_PER_PAGE):
+            author = User.objects.create_user(username=f'auth-{num}')
+            group = Group.objects.create(title=f'Группа {num}',
+                                         slug=f'slug-{num}',
+                                         description='Описание')
+            Follow.objects.create(user=cls.reader, author=author)
+            Post.objects.create(text=f'Тестовая запись {num}',
+                                author=author,
+                                group=group)
+            Post.objects.create(text=f'Запись автора {num}',
+                                author=cls.author,
+                                group=cls.group)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feed_query_count(self):
+        """Число запросов на страницах лент не зависит от числа постов."""
+        pages_queries = {
+            INDEX_URL: 3,
+            GROUP_LIST_URL: 4,
+            PROFILE_URL: 5,
+        }
+        for adress, queries in pages_queries.items():
+            with self.subTest(adress=adress):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    self.guest_client.get(adress)
+        self.guest_client.get(INDEX_URL)
+        with self.assertNumQueries(0):
+            self.guest_client.get(INDEX_URL)
+        cache.clear()
+        # сессия и пользователь + подписки для ETag + авторы для
+        # подмешивания + count + id постов из ленты + выборка постов
+        # + копии картинок
+        with self.assertNumQueries(8):
+            self.reader_client.get(reverse('posts:follow_index'))
+
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент не читают таблицы целиком."""
+        call_command('audit_indexes', stdout=StringIO())
+
+    def test_audit_leaves_no_traces(self):
+        """Аудит индексов не оставляет в кэше и счётчиках просмотров
+        страниц с удалёнными образцами."""
+        self.guest_client.get(INDEX_URL)
+        pending = view_counts.stats()['pending_views']
+        call_command('audit_indexes', stdout=StringIO())
+        response = self.guest_client.get(INDEX_URL)
+        self.assertNotContains(response, 'audit-author')
+        self.assertNotContains(response, 'audit-group')
+        self.assertEqual(view_counts.stats()['pending_views'], pending)
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth-follow')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(text='Старая запись',
+                                           author=cls.author)
+
+    def setUp(self) -> None:
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def follow_page_posts(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return [post.text for post in response.context['page_obj']]
+
+    def test_timeline_follow_post_unfollow(self):
+        """Лента подписок заполняется при подписке и новых постах
+        и очищается при отписке."""
+        self.reader_client.get(PROFILE_FOLLOW)
+        self.assertEqual(self.follow_page_posts(), ['Старая запись'])
+        Post.objects.create(text='Новая запись', author=self.author)
+        self.assertEqual(self.follow_page_posts(),
+                         ['Новая запись', 'Старая запись'])
+        self.reader_client.get(PROFILE_UNFOLLOW)
+        self.assertEqual(self.follow_page_posts(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_timeline_length(self):
+        """Лента подписок не длиннее TIMELINE_LENGTH."""
+        self.reader_client.get(PROFILE_FOLLOW)
+        for num in range(3):
+            Post.objects.create(text=f'Запись {num}', author=self.author)
+        self.assertEqual(self.follow_page_posts(), ['Запись 2', 'Запись 1'])
+
+    @override_settings(TIMELINE_LENGTH=1)
+    def test_timeline_trim_single_query(self):
+        """Переполненные ленты всех подписчиков обрезаются одним
+        запросом, а не по запросу на подписчика."""
+        readers = [User.objects.create_user(username=f'trim-{num}')
+                   for num in range(3)]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=self.author)
+        post = Post.objects.create(text='Новая запись', author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            timeline.fan_out(post)
+        self.assertEqual(
+            sum(query['sql'].startswith('DELETE') for query in queries), 1)
+        for reader in readers:
+            self.assertEqual(
+                list(TimelineEntry.objects.filter(user=reader)
+                     .values_list('post_id', flat=True)), [post.pk])
+
+    @override_settings(KEYSET_PAGINATION_VIEWS=('follow_index',))
+    def test_timeline_keyset_paginator(self):
+        """Лента подписок листается курсором, в том числе
+        с постами, подмешанными при чтении."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.bulk_create(
+            [Post(text=f'Запись {num}', author=self.author)
+             for num in range(POSTS_PER_PAGE)])
+        timeline.rebuild([self.reader.pk])
+        url = reverse('posts:follow_index')
+        for limit in (5000, 0):
+            with self.subTest(fanout_limit=limit), \
+                    override_settings(TIMELINE_FANOUT_LIMIT=limit):
+                page_obj = self.reader_client.get(url).context['page_obj']
+                self.assertEqual(len(page_obj), 10)
+                self.assertFalse(page_obj.has_previous())
+                page_two = self.reader_client.get(
+                    url, {'after': page_obj.next_cursor}).context['page_obj']
+                self.assertEqual(len(page_two), 2)
+                self.assertFalse(page_two.has_next())
+                self.assertEqual(page_two[1], self.old_post)
+                page_back = self.reader_client.get(
+                    url, {'before': page_two.prev_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(page_back), list(page_obj))
+                self.assertFalse(page_back.has_previous())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_timeline_pulls_popular_authors(self):
+        """Посты авторов с большим числом подписчиков
+        подмешиваются при чтении ленты."""
+        self.reader_client.get(PROFILE_FOLLOW)
+        Post.objects.create(text='Новая запись', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_page_posts(),
+                         ['Новая запись', 'Старая запись'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_author_crosses_fanout_limit(self):
+        """Посты, написанные, пока автор подмешивался при чтении,
+        остаются в ленте, когда подписчиков снова становится мало."""
+        other = User.objects.create_user(username='other-reader')
+        self.reader_client.get(PROFILE_FOLLOW)
+        expected = ['Старая запись']
+        for num in range(2):
+            with self.subTest(round=num):
+                follow = Follow.objects.create(user=other, author=self.author)
+                Post.objects.create(text=f'Запись {num}', author=self.author)
+                expected.insert(0, f'Запись {num}')
+                self.assertEqual(self.follow_page_posts(), expected)
+                follow.delete()
+                self.assertEqual(
+                    TimelineEntry.objects.filter(user=self.reader).count(),
+                    len(expected))
+                self.assertEqual(self.follow_page_posts(), expected)
+                self.assertFalse(
+                    TimelineEntry.objects.filter(user=other).exists())
+
+
+class FollowTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth-follow')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def setUp(self) -> None:
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def counters(self) -> tuple:
+        return (AuthorStats.objects.get(author=self.author).followers,
+                AuthorStats.objects.get(author=self.reader).following)
+
+    def test_follow_twice(self):
+        """Повторная подписка и отписка ничего не ломают и не
+        сбивают счётчики."""
+        for _ in range(2):
+            self.reader_client.get(PROFILE_FOLLOW)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(self.counters(), (1, 1))
+        for _ in range(2):
+            response = self.reader_client.get(PROFILE_UNFOLLOW)
+            self.assertRedirects(response, reverse(
+                'posts:profile', kwargs={'username': 'auth-follow'}))
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_no_self_follow(self):
+        """На себя подписаться нельзя ни через страницу, ни в базе."""
+        self.reader_client.get(reverse('posts:profile_follow',
+                                       kwargs={'username': 'reader'}))
+        self.assertFalse(Follow.objects.exists())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.reader, author=self.reader)
+
+    def follow_queries(self, client, url) -> int:
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return sum('FROM "posts_follow" WHERE' in query['sql']
+                   for query in queries)
+
+    def test_followed_ids_loaded_once(self):
+        """Подписки посетителя читаются одним запросом на страницу,
+        у анонима — ни одним."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Запись', author=self.author)
+        pages = (reverse('posts:profile',
+                         kwargs={'username': 'auth-follow'}),
+                 reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+                 reverse('posts:follow_index'))
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.follow_queries(self.reader_client, url), 1)
+                response = self.reader_client.get(url)
+                self.assertEqual(
+                    'Отписаться' in response.content.decode(),
+                    url != reverse('posts:follow_index'))
+        for url in pages[:2]:
+            with self.subTest(url=url, anonymous=True):
+                self.assertEqual(self.follow_queries(self.client, url), 0)
+
+    def test_follow_unknown_user(self):
+        """Подписка на несуществующего пользователя отвечает 404."""
+        for name in ('posts:profile_follow', 'posts:profile_unfollow'):
+            with self.subTest(name=name):
+                response = self.reader_client.get(
+                    reverse(name, kwargs={'username': 'nobody'}))
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class CommentsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Тестовая запись',
+                                       author=cls.author)
+        cls.comments_per_page = 20
+        for num in range(cls.comments_per_page + 5):
+            commenter = User.objects.create_user(username=f'reader-{num}')
+            Comment.objects.create(text=f'Комментарий {num}',
+                                   author=commenter,
+                                   post=cls.post)
+        cls.detail_url = reverse('posts:post_detail',
+                                 kwargs={'post_id': cls.post.pk})
+        cls.comments_url = reverse('posts:post_comments',
+                                   kwargs={'post_id': cls.post.pk})
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.guest_client = Client()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_post_detail_query_count(self):
+        """Страница поста читается постоянным числом запросов,
+        гости получают её из кэша до изменения поста или комментариев."""
+        # автор поста для ETag + пост + копии картинок + комментарии
+        with self.assertNumQueries(4):
+            self.guest_client.get(self.detail_url)
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(self.detail_url)
+        self.assertContains(response, 'Комментарий 24')
+        with self.assertNumQueries(5):
+            response = self.author_client.get(self.detail_url)
+        self.assertContains(response, 'Добавить комментарий')
+        self.assertContains(response, 'Комментарий 24')
+        Comment.objects.create(text='Новый комментарий',
+                               author=self.author,
+                               post=self.post)
+        response = self.guest_client.get(self.detail_url)
+        self.assertContains(response, 'Новый комментарий')
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        response = self.guest_client.get(self.detail_url)
+        self.assertContains(response, 'Исправленный текст')
+
+    def test_comment_count(self):
+        """Число комментариев хранится в посте."""
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, self.comments_per_page + 5)
+        self.post.comments.first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, self.comments_per_page + 4)
+
+    def test_comments_paginated(self):
+        """Комментарии выводятся страницами, следующие отдаются в JSON."""
+        response = self.guest_client.get(self.detail_url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), self.comments_per_page)
+        self.assertEqual(comments[0].text, 'Комментарий 24')
+        response = self.guest_client.get(
+            self.comments_url, {'after': comments.next_cursor})
+        data = response.json()
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['html'].count('class="media mb-4"'), 5)
+        self.assertIn('Комментарий 0', data['html'])
+        missing = reverse('posts:post_comments', kwargs={'post_id': 0})
+        self.assertEqual(self.guest_client.get(missing).status_code, 404)
+
+    def test_comments_query_count(self):
+        """Число запросов не зависит от числа комментариев."""
+        response = self.guest_client.get(self.comments_url)
+        with self.assertNumQueries(1):
+            self.guest_client.get(self.comments_url)
+        with self.assertNumQueries(1):
+            self.guest_client.get(
+                self.comments_url,
+                {'after': response.json()['next']})
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',)
+        cls.post = Post.objects.create(text='Тестовая запись',
+                                       author=cls.author,
+                                       group=cls.group)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def repeat(self, client, address):
+        """Повторяет запрос с ETag первого ответа,
+        возвращает второй ответ и число сэкономленных байт."""
+        first = client.get(address)
+        self.assertEqual(first.status_code, HTTPStatus.OK)
+        second = client.get(address, HTTP_IF_NONE_MATCH=first['ETag'])
+        return second, len(first.content) - len(second.content)
+
+    def test_not_modified(self):
+        """Неизменившиеся страницы отдаются ответом 304 без тела."""
+        post_url = reverse('posts:post_detail',
+                           kwargs={'post_id': self.post.pk})
+        pages = {
+            INDEX_URL: self.guest_client,
+            GROUP_LIST_URL: self.guest_client,
+            PROFILE_URL: self.reader_client,
+            post_url: self.guest_client,
+            reverse('posts:follow_index'): self.reader_client,
+        }
+        saved = 0
+        for address, client in pages.items():
+            with self.subTest(address=address):
+                response, saved_bytes = self.repeat(client, address)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertEqual(response.content, b'')
+                self.assertGreater(saved_bytes, 0)
+                saved += saved_bytes
+        self.assertGreater(saved, 1000 * len(pages))
+
+    def test_modified(self):
+        """После изменений страницы отдаются заново."""
+        first = self.reader_client.get(reverse('posts:follow_index'))
+        Post.objects.create(text='Новая запись', author=self.author)
+        response = self.reader_client.get(reverse('posts:follow_index'),
+                                          HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Новая запись')
+        first = self.guest_client.get(INDEX_URL)
+        response = self.guest_client.get(
+            INDEX_URL, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertNotIn('Last-Modified', self.reader_client.get(INDEX_URL))
+        self.assertNotEqual(
+            self.reader_client.get(INDEX_URL)['ETag'], first['ETag'])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.cat_post = Post.objects.create(
+            text='Кот сидит на окне, кот смотрит на <птиц>.',
+            author=cls.author)
+        cls.dog_post = Post.objects.create(
+            text='Собака и кот гуляют во дворе.',
+            author=cls.author)
+        for num in range(POSTS_PER_PAGE):
+            Post.objects.create(text=f'Кошки спят весь день {num}',
+                                author=cls.author)
+        cls.search_url = reverse('posts:search')
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_search_ranks_and_highlights(self):
+        """Поиск находит посты, лучшие совпадения идут первыми,
+        найденные слова подсвечиваются."""
+        response = self.guest_client.get(self.search_url, {'q': 'КОТ'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.paginator.count, 2)
+        self.assertEqual(page_obj[0], self.cat_post)
+        self.assertIn('<mark>Кот</mark>', page_obj[0].snippet)
+        self.assertIn('&lt;птиц&gt;', page_obj[0].snippet)
+        response = self.guest_client.get(self.search_url,
+                                         {'q': 'кот собака'})
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.dog_post])
+
+    def test_search_pagination(self):
+        """Результаты поиска разбиты на страницы, ссылки хранят запрос."""
+        response = self.guest_client.get(self.search_url, {'q': 'кошки'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertContains(response, '?q=%D0%BA%D0%BE%D1%88%D0%BA%D0%B8'
+                                      '&amp;page=2')
+        response = self.guest_client.get(self.search_url,
+                                         {'q': 'кошки', 'page': 2})
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+    def test_search_follows_changes(self):
+        """Индекс обновляется при изменении и удалении постов."""
+        cat_post = Post.objects.get(pk=self.cat_post.pk)
+        cat_post.text = 'Попугай сидит на окне'
+        cat_post.save()
+        Post.objects.get(pk=self.dog_post.pk).delete()
+        response = self.guest_client.get(self.search_url, {'q': 'кот'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 0)
+        response = self.guest_client.get(self.search_url, {'q': 'попуг'})
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.cat_post])
+
+    def test_inverted_index(self):
+        """Запасной индекс на диске ищет так же, как FTS5."""
+        directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(SEARCH_BACKEND='index',
+                               SEARCH_INDEX_DIR=directory):
+            call_command('rebuild_search_index', stdout=StringIO())
+            response = self.guest_client.get(self.search_url, {'q': 'кот'})
+            page_obj = response.context['page_obj']
+            self.assertEqual(list(page_obj),
+                             [self.cat_post, self.dog_post])
+            self.assertIn('<mark>Кот</mark>', page_obj[0].snippet)
+            with mock.patch.object(search, 'FILTER_LIMIT', 1):
+                self.assertEqual(
+                    list(search.filter_posts(Post.objects.all(), 'кот')),
+                    [self.cat_post])
+            index = search.inverted_index()
+            index.remove(self.cat_post.pk)
+            index.add(self.dog_post.pk, 'Собака гуляет')
+            self.assertEqual(index.search(['кот']), [])
+            self.assertEqual(index.search(['собака']), [self.dog_post.pk])
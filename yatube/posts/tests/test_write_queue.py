@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import search, write_queue
+from ..models import AuthorStats, Comment, Follow, Group, Post, TimelineEntry
+
+User = get_user_model()
+QUEUE_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(WRITE_BEHIND=True,
+                   WRITE_QUEUE_PATH=f'{QUEUE_DIR}/queue.sqlite3')
+class WriteQueueTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-slug',
+                                         description='Тестовое описание')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(QUEUE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.addCleanup(self.drain)
+
+    def drain(self):
+        while write_queue.flush():
+            pass
+
+    def test_comment_written_later(self):
+        """Комментарий ждёт в очереди, автор видит его сразу,
+        остальные — после записи пачки."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.author_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Отложенный комментарий'})
+        self.assertFalse(Comment.objects.exists())
+        self.assertContains(self.author_client.get(url),
+                            'Отложенный комментарий')
+        self.assertNotContains(self.client.get(url),
+                               'Отложенный комментарий')
+        self.assertEqual(write_queue.stats()['depth'], 1)
+        self.assertEqual(write_queue.flush(), 1)
+        comment = Comment.objects.get()
+        self.assertEqual(comment.author, self.author)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(AuthorStats.objects.get(author=self.author).comments,
+                         1)
+        self.assertContains(self.client.get(url), 'Отложенный комментарий')
+        stats = write_queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['flushes'], 1)
+
+    def test_post_written_later(self):
+        """Новый пост виден автору в профиле до записи, а после неё
+        попадает в ленты, счётчики и поиск."""
+        self.author_client.post(reverse('posts:post_create'),
+                                {'text': 'Отложенный пост',
+                                 'group': self.group.pk})
+        self.assertEqual(Post.objects.count(), 1)
+        profile = reverse('posts:profile', kwargs={'username': 'auth'})
+        self.assertContains(self.author_client.get(profile),
+                            'Отложенный пост')
+        self.assertNotContains(self.client.get(profile), 'Отложенный пост')
+        call_command('flush_write_queue', stdout=StringIO())
+        post = Post.objects.get(text='Отложенный пост')
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(AuthorStats.objects.get(author=self.author).posts,
+                         2)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertContains(self.client.get(profile), 'Отложенный пост')
+        self.assertEqual(search.SearchResults('отложенный')[0:10], [post])
+
+    def test_rows_of_deleted_objects_dropped(self):
+        """Комментарии к удалённому посту не мешают записи пачки."""
+        other = Post.objects.create(text='Удалим', author=self.author)
+        write_queue.enqueue_comment(self.reader, other, 'Пропадёт')
+        write_queue.enqueue_comment(self.reader, self.post, 'Останется')
+        other.delete()
+        self.assertEqual(write_queue.flush(), 2)
+        self.assertEqual(list(Comment.objects.values_list('text',
+                                                          flat=True)),
+                         ['Останется'])
+
+    def test_leased_rows_not_taken_twice(self):
+        """Пачку, которую пишет один процесс, другой не берёт."""
+        write_queue.enqueue_comment(self.reader, self.post, 'Один раз')
+        queue = write_queue.get_queue()
+        leased = queue.lease(10, 60)
+        self.assertEqual(len(leased), 1)
+        self.assertEqual(write_queue.flush(), 0)
+        self.assertEqual(queue.lease(10, 60), [])
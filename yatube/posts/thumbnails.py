@@ -0,0 +1,204 @@
+"""Resized copies of post images, made outside the request.
+
+Every uploaded image is cut to the feed crop (960x339) at several
+widths, as JPEG and, when Pillow supports it, WebP. The copies are
+tracked in ImageVariant rows, so templates build srcset from the
+database alone. Missing copies are made by a small thread pool after
+the transaction commits, and the feeds showing the post are
+invalidated once they are ready. The same workers re-save uploads
+carrying EXIF or XMP (camera, GPS) without that metadata."""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps, features
+
+from . import feed_cache
+from .models import ImageVariant, Post
+
+WIDTHS = (320, 640, 960, 1920)
+FEED_SIZE = (960, 339)
+FORMATS = {
+    ImageVariant.JPEG: ('JPEG', {'quality': 82, 'optimize': True,
+                                 'progressive': True}),
+    ImageVariant.WEBP: ('WEBP', {'quality': 80, 'method': 4}),
+}
+# formats of the originals that are re-saved without metadata,
+# others (GIF keeps its animation) are left as uploaded
+CLEAN_FORMATS = {
+    'JPEG': {'quality': 90, 'optimize': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 90},
+}
+METADATA_KEYS = {'exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop'}
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+_pending = set()
+_executor = None
+
+
+def available_formats() -> list:
+    """WebP is made only if Pillow was built with libwebp."""
+    return [name for name in FORMATS
+            if name != ImageVariant.WEBP or features.check('webp')]
+
+
+def render_variants(source: Image.Image, post_id: int):
+    """Yields unsaved ImageVariant objects with their file contents
+    for every width not larger than the source image."""
+    widths = [width for width in WIDTHS if width <= source.width]
+    for width in widths or WIDTHS[:1]:
+        height = round(width * FEED_SIZE[1] / FEED_SIZE[0])
+        resized = ImageOps.fit(source, (width, height), Image.LANCZOS)
+        for name in available_formats():
+            pil_format, params = FORMATS[name]
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **params)
+            variant = ImageVariant(post_id=post_id, width=width,
+                                   height=height, format=name)
+            yield variant, ContentFile(buffer.getvalue(),
+                                       name=f'{post_id}-{width}.{name}')
+
+
+def has_metadata(source: Image.Image) -> bool:
+    return (source.format in CLEAN_FORMATS
+            and bool(METADATA_KEYS & source.info.keys()))
+
+
+def strip_metadata(source: Image.Image) -> tuple:
+    """Rotates the image as its EXIF orientation says and returns it
+    with a copy in the original format without metadata.
+    The ICC profile is kept."""
+    pil_format = source.format
+    params = dict(CLEAN_FORMATS[pil_format])
+    if source.info.get('icc_profile'):
+        params['icc_profile'] = source.info['icc_profile']
+    rotated = ImageOps.exif_transpose(source)
+    rotated.info = {}
+    buffer = BytesIO()
+    rotated.save(buffer, pil_format, **params)
+    return rotated, ContentFile(buffer.getvalue())
+
+
+def replace_original(post, content: ContentFile) -> None:
+    """Saves the cleaned image next to the original, points the post
+    at it and only then deletes the original, so the post never refers
+    to a missing file."""
+    storage = post.image.storage
+    original = post.image.name
+    saved = storage.save(original, content)  # the storage picks a free name
+    try:
+        Post.objects.filter(pk=post.pk).update(image=saved)
+    except Exception:
+        storage.delete(saved)
+        raise
+    post.image.name = saved
+    storage.delete(original)
+
+
+def swap_variants(post, variants: list) -> None:
+    """Replaces the variant rows of the post with the given ones, whose
+    files are already saved, in one transaction. The files of the old
+    rows are deleted after the commit, so pages never point at missing
+    files. Workers making copies of the same post take turns on the
+    lock of the post row; if the swap fails, the new files are
+    deleted instead."""
+    try:
+        with transaction.atomic():
+            # a write first: the row lock, or the write lock on SQLite,
+            # is held before the current variants are read
+            Post.objects.filter(pk=post.pk).update(image=F('image'))
+            stale = list(ImageVariant.objects.filter(post_id=post.pk))
+            ImageVariant.objects.filter(
+                pk__in=[variant.pk for variant in stale]).delete()
+            ImageVariant.objects.bulk_create(variants)
+    except Exception:
+        for variant in variants:
+            variant.image.delete(save=False)
+        raise
+    transaction.on_commit(
+        lambda: [variant.image.delete(save=False) for variant in stale])
+
+
+def make_variants(post_id: int, invalidate: bool = True) -> bool:
+    """Replaces the resized copies of a post image, stripping the
+    metadata of the original first. Returns False if the post
+    has no image."""
+    post = (Post.objects.filter(pk=post_id)
+            .only('image', 'author', 'group').first())
+    if post is None or not post.image:
+        return False
+    clean = None
+    with post.image.open('rb') as image_file:
+        source = Image.open(image_file)
+        size = source.size
+        if has_metadata(source):
+            source, clean = strip_metadata(source)
+        else:
+            # JPEG can be decoded at a reduced scale, which saves memory
+            source.draft('RGB', (max(WIDTHS), max(WIDTHS)))
+            source = ImageOps.exif_transpose(source)
+        decoded = source.width * source.height * len(source.getbands())
+        source = source.convert('RGB')
+    if clean is not None:
+        replace_original(post, clean)
+    # the size of the decoded pixels of this image, the bulk of the
+    # memory it takes; the peak of the process says nothing per image
+    logger.info('Image of post %s (%dx%d): %.1f MB decoded%s',
+                post_id, *size, decoded / 2 ** 20,
+                ', metadata removed' if clean else '')
+    variants = []
+    for variant, content in render_variants(source, post.pk):
+        variant.image.save(content.name, content, save=False)
+        variants.append(variant)
+    swap_variants(post, variants)
+    if invalidate:
+        feed_cache.invalidate_post(post)
+    return True
+
+
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def _run(post_id: int) -> None:
+    try:
+        make_variants(post_id)
+    except Exception:
+        logger.exception('Image variants for post %s failed', post_id)
+    finally:
+        with _lock:
+            _pending.discard(post_id)
+        connections.close_all()
+
+
+def _submit(post_id: int) -> None:
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            make_variants(post_id)
+        except Exception:
+            logger.exception('Image variants for post %s failed', post_id)
+        return
+    with _lock:
+        if post_id in _pending:
+            return
+        _pending.add(post_id)
+    _executor_instance().submit(_run, post_id)
+
+
+def schedule(post_id: int) -> None:
+    """Queues the resized copies of a post image for the background
+    workers once the current transaction commits."""
+    transaction.on_commit(lambda: _submit(post_id))
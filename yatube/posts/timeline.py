@@ -0,0 +1,229 @@
+"""Fan-out-on-write home timelines for follow_index.
+
+A new post is pushed into the TimelineEntry rows of every follower of
+its author. Authors with more than settings.TIMELINE_FANOUT_LIMIT
+followers are not pushed; their posts are pulled and merged in when
+the feed is read. When unfollows bring such an author back to the
+limit, their latest posts are copied into every follower's feed, so
+the posts made while they were pulled stay in the feeds."""
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, IntegerField, Q, Value, Window
+from django.db.models.functions import RowNumber
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+
+
+def is_pulled(author_id: int) -> bool:
+    """Authors with too many followers are read on demand."""
+    return AuthorStats.objects.filter(
+        author_id=author_id,
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT).exists()
+
+
+def trim(user_ids) -> None:
+    """Drops the oldest entries of feeds longer than
+    settings.TIMELINE_LENGTH, for all the users in one DELETE."""
+    if not user_ids:
+        return
+    # entries numbered from the newest within each feed; Django cannot
+    # filter on a window yet, so the numbered query becomes a subquery
+    numbered = (TimelineEntry.objects.filter(user_id__in=user_ids)
+                .annotate(position=Window(
+                    RowNumber(), partition_by=[F('user_id')],
+                    order_by=[F('pub_date').desc(), F('post_id').desc()]))
+                .values_list('pk', 'position'))
+    sql, params = numbered.query.sql_with_params()
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE id IN '
+                       f'(SELECT id FROM ({sql}) numbered '
+                       f'WHERE position > %s)',
+                       [*params, settings.TIMELINE_LENGTH])
+
+
+def fan_out(post) -> None:
+    """Pushes a new post into the feeds of the author's followers."""
+    if is_pulled(post.author_id):
+        return
+    followers = list(Follow.objects.filter(author_id=post.author_id)
+                     .values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post=post,
+                       author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in followers],
+        batch_size=500,
+        ignore_conflicts=True)
+    trim(followers)
+
+
+def fan_out_many(posts) -> None:
+    """Pushes many new posts (of any authors) into the feeds of
+    their followers with a few queries for the whole list."""
+    author_ids = {post.author_id for post in posts}
+    pulled = set(AuthorStats.objects.filter(
+        author_id__in=author_ids,
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT,
+    ).values_list('author_id', flat=True))
+    followers = defaultdict(list)
+    for user_id, author_id in (Follow.objects
+                               .filter(author_id__in=author_ids - pulled)
+                               .values_list('user_id', 'author_id')):
+        followers[author_id].append(user_id)
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post=post,
+                       author_id=post.author_id, pub_date=post.pub_date)
+         for post in posts
+         for user_id in followers.get(post.author_id, ())],
+        batch_size=500,
+        ignore_conflicts=True)
+    trim({user_id for users in followers.values() for user_id in users})
+
+
+def backfill(user_id: int, author_id: int) -> None:
+    """Copies the author's latest posts into a new follower's feed."""
+    if is_pulled(author_id):
+        return
+    posts = (Post.objects.filter(author_id=author_id)
+             .order_by('-pub_date', '-pk')
+             .values_list('pk', 'pub_date')[:settings.TIMELINE_LENGTH])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id,
+                       author_id=author_id, pub_date=pub_date)
+         for post_id, pub_date in posts],
+        batch_size=500,
+        ignore_conflicts=True)
+    trim([user_id])
+
+
+def rebuild(user_ids) -> None:
+    """Fills the users' feeds from scratch with the latest posts of the
+    authors they follow, e.g. after posts were created in bulk."""
+    pulled = AuthorStats.objects.filter(
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT).values('author_id')
+    follows = defaultdict(list)
+    for user_id, author_id in (Follow.objects.filter(user_id__in=user_ids)
+                               .exclude(author_id__in=pulled)
+                               .values_list('user_id', 'author_id')):
+        follows[user_id].append(author_id)
+    table = TimelineEntry._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        TimelineEntry.objects.filter(user_id__in=user_ids).delete()
+        for user_id, author_ids in follows.items():
+            # copied inside the database, hundreds of rows per feed;
+            # annotations are selected after the model fields
+            posts = (Post.objects.filter(author_id__in=author_ids)
+                     .annotate(reader=Value(user_id, IntegerField()))
+                     .order_by('-pub_date', '-pk')
+                     .values_list('pk', 'author_id', 'pub_date', 'reader')
+                     [:settings.TIMELINE_LENGTH])
+            sql, params = posts.query.sql_with_params()
+            cursor.execute(f'INSERT INTO {table} '
+                           f'(post_id, author_id, pub_date, user_id) {sql}',
+                           params)
+
+
+def repush(author_id: int) -> None:
+    """Copies the author's latest posts into the feeds of all their
+    followers, in one INSERT ... SELECT inside the database."""
+    latest = (Post.objects.filter(author_id=author_id)
+              .order_by('-pub_date', '-pk')
+              .values('pk')[:settings.TIMELINE_LENGTH])
+    # a row per post and follower of its author, inner-joined
+    rows = (Post.objects.filter(pk__in=latest,
+                                author__following__isnull=False)
+            .order_by()
+            .values_list('pk', 'author_id', 'pub_date',
+                         'author__following__user_id'))
+    sql, params = rows.query.sql_with_params()
+    ops = connection.ops
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{TimelineEntry._meta.db_table} '
+            f'(post_id, author_id, pub_date, user_id) {sql} '
+            f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            params)
+    trim(list(Follow.objects.filter(author_id=author_id)
+              .values_list('user_id', flat=True)))
+
+
+def unfollowed(author_id: int) -> None:
+    """Pushes the author again once an unfollow brings them back to
+    settings.TIMELINE_FANOUT_LIMIT followers; nothing was pushed for
+    the posts they made while they were pulled."""
+    if AuthorStats.objects.filter(
+            author_id=author_id,
+            followers=settings.TIMELINE_FANOUT_LIMIT).exists():
+        repush(author_id)
+
+
+def prune(user_id: int, author_id: int) -> None:
+    """Removes the author's posts from a former follower's feed."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+class Timeline:
+    """
+    Post ids of a user's home feed, newest first.
+
+    Supports count() and slicing, so it can be handed to Paginator;
+    slices return ids, which the view turns into posts. seek() pages
+    through the same ids by a (pub_date, id) cursor.
+    """
+    def __init__(self, user):
+        pulled_authors = list(Follow.objects.filter(
+            user=user,
+            author__stats__followers__gt=settings.TIMELINE_FANOUT_LIMIT,
+        ).values_list('author_id', flat=True))
+        self.pushed = (TimelineEntry.objects.filter(user=user)
+                       .order_by('-pub_date', '-post_id')
+                       .values_list('pub_date', 'post_id'))
+        self.pulled = None
+        if pulled_authors:
+            self.pushed = self.pushed.exclude(author_id__in=pulled_authors)
+            self.pulled = (Post.objects.filter(author_id__in=pulled_authors)
+                           .order_by('-pub_date', '-pk')
+                           .values_list('pub_date', 'pk'))
+
+    def count(self) -> int:
+        if self.pulled is None:
+            return self.pushed.count()
+        return self.pushed.count() + self.pulled.count()
+
+    def __len__(self):
+        return self.count()
+
+    def seek(self, cursor, limit: int, newer: bool = False) -> list:
+        """Up to limit post ids right after (older than) the
+        (pub_date, id) cursor, newest first; with newer=True the ids
+        right before (newer than) it. An index seek on both sides of
+        the merge, so deep pages cost the same as the first one."""
+        lookup = 'gt' if newer else 'lt'
+
+        def keyset(rows, pk: str):
+            if cursor is not None:
+                stamp, last = cursor
+                rows = rows.filter(
+                    Q(**{f'pub_date__{lookup}': stamp})
+                    | Q(**{'pub_date': stamp, f'{pk}__{lookup}': last}))
+            return (rows.reverse() if newer else rows)[:limit]
+
+        rows = keyset(self.pushed, 'post_id')
+        if self.pulled is not None:
+            rows = heapq.merge(rows, keyset(self.pulled, 'pk'),
+                               reverse=not newer)
+        ids = [pk for _, pk in rows][:limit]
+        return ids[::-1] if newer else ids
+
+    def __getitem__(self, index: slice) -> list:
+        if self.pulled is None:
+            return [pk for _, pk in self.pushed[index]]
+        merged = heapq.merge(self.pushed[:index.stop],
+                             self.pulled[:index.stop],
+                             reverse=True)
+        return [pk for _, pk in merged][index]
@@ -0,0 +1,88 @@
+"""Early checks for uploaded images.
+
+ImageLimitUploadHandler runs before Django's own upload handlers and
+sees every chunk as it arrives: it stops an upload as soon as it grows
+past settings.POST_IMAGE_MAX_SIZE and reads the image size from the
+first bytes of the file (Image.open only parses the header) to reject
+images larger than settings.POST_IMAGE_MAX_PIXELS without decoding
+them. Rejected files are skipped and the reason is stored in
+request.upload_errors for the form to report."""
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# image headers (with EXIF and ICC profiles) fit into this many bytes
+HEADER_LIMIT = 256 * 1024
+
+
+def check_dimensions(width: int, height: int):
+    """Returns an error message for images that are too large."""
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        megapixels = settings.POST_IMAGE_MAX_PIXELS / 1_000_000
+        return (f'Картинка {width}x{height} слишком большая, '
+                f'допустимо не больше {megapixels:g} Мп.')
+    return None
+
+
+def check_size(size: int):
+    """Returns an error message for files that are too large."""
+    if size > settings.POST_IMAGE_MAX_SIZE:
+        return ('Файл слишком большой, допустимо не больше '
+                f'{filesizeformat(settings.POST_IMAGE_MAX_SIZE)}.')
+    return None
+
+
+class ImageLimitUploadHandler(FileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = BytesIO()
+        self.checked = not (self.content_type or '').startswith('image/')
+
+    def reject(self, message: str):
+        errors = getattr(self.request, 'upload_errors', {})
+        errors[self.field_name] = message
+        self.request.upload_errors = errors
+        logger.info('Upload %s rejected after %d bytes: %s',
+                    self.file_name, self.received, message)
+        raise SkipFile
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        error = check_size(self.received)
+        if error:
+            self.reject(error)
+        if not self.checked:
+            self.check_header(raw_data)
+        return raw_data
+
+    def check_header(self, raw_data) -> None:
+        self.header.write(raw_data)
+        self.header.seek(0)
+        try:
+            image = Image.open(self.header)
+        except Image.DecompressionBombError:
+            self.reject('Картинка слишком большая.')
+        except OSError:
+            # the header has not arrived yet, or this is not an image,
+            # which the form field reports
+            if self.header.getbuffer().nbytes > HEADER_LIMIT:
+                self.checked = True
+            self.header.seek(0, 2)
+            return
+        self.checked = True
+        error = check_dimensions(*image.size)
+        if error:
+            self.reject(error)
+
+    def file_complete(self, file_size):
+        logger.info('Upload %s: %d bytes, %d bytes buffered for the header',
+                    self.file_name, file_size, self.header.getbuffer().nbytes)
+        self.header = None
+        return None
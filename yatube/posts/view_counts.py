@@ -0,0 +1,145 @@
+"""Buffered view counters of posts.
+
+post_detail calls hit() for every page it serves. An UPDATE per view
+would take the write lock of the database for every read of a post, so
+hits are only added up in the memory of the process. A background
+thread writes them every settings.VIEW_COUNT_FLUSH_INTERVAL seconds, or
+as soon as settings.VIEW_COUNT_MAX_PENDING views are waiting. Each
+flush is one transaction: one UPDATE per distinct number of views, plus
+their weight in the trending scores (posts.ranking).
+
+A crash of the process loses the views it has not written yet: at most
+one interval of them, and never much more than VIEW_COUNT_MAX_PENDING.
+On a normal exit the rest is written by an atexit hook, and a flush
+that fails puts its counts back for the next one. Pages answered with
+304 by posts.conditional are not counted."""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from . import ranking
+from .models import Post
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+_wake = threading.Event()
+_pending = Counter()
+_total = 0
+_pid = None
+_flusher = None
+_last_flush = {}
+
+
+def _own_counts() -> None:
+    """Counts copied from the parent by fork are the parent's
+    to write. Call with _lock held."""
+    global _pending, _total, _pid
+    if _pid != os.getpid():
+        _pending = Counter()
+        _total = 0
+        _pid = os.getpid()
+
+
+def hit(post_id: int) -> None:
+    """Counts one view of the post; starts the flusher of this
+    process on first use."""
+    global _flusher, _total
+    with _lock:
+        _own_counts()
+        _pending[post_id] += 1
+        _total += 1
+        full = _total >= settings.VIEW_COUNT_MAX_PENDING
+        if settings.VIEW_COUNT_FLUSH_INTERVAL and (
+                _flusher is None or not _flusher.is_alive()):
+            _flusher = threading.Thread(target=_flush_forever, daemon=True,
+                                        name='view-counts')
+            _flusher.start()
+    if full:
+        _wake.set()
+
+
+def discard(post_ids) -> None:
+    """Forgets the views counted for the posts, e.g. sample posts
+    of a transaction that is rolled back."""
+    global _total
+    with _lock:
+        _own_counts()
+        for post_id in post_ids:
+            _total -= _pending.pop(post_id, 0)
+
+
+def write(counts: dict) -> None:
+    """Adds {post id: views} to the posts in one transaction."""
+    by_count = defaultdict(list)
+    for post_id, count in counts.items():
+        by_count[count].append(post_id)
+    with transaction.atomic():
+        for count, post_ids in by_count.items():
+            Post.objects.filter(pk__in=post_ids).update(
+                views=F('views') + count)
+        ranking.record('view', counts)
+
+
+def flush() -> int:
+    """Writes the views counted so far, returns their number."""
+    global _pending, _total
+    with _lock:
+        _own_counts()
+        counts, views = _pending, _total
+        _pending, _total = Counter(), 0
+    if not counts:
+        return 0
+    started = time.perf_counter()
+    try:
+        write(counts)
+    except Exception:
+        with _lock:
+            _pending.update(counts)
+            _total += views
+        raise
+    _last_flush.update(at=time.time(), views=views,
+                       duration=time.perf_counter() - started)
+    return views
+
+
+def _flush_forever() -> None:
+    while True:
+        _wake.wait(settings.VIEW_COUNT_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('View count flush failed')
+        finally:
+            connections.close_all()
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    if not settings.VIEW_COUNT_FLUSH_INTERVAL:
+        return
+    try:
+        flush()
+    except Exception:
+        logger.exception('View count flush failed')
+
+
+def stats() -> dict:
+    with _lock:
+        _own_counts()
+        stats = {'pending_views': _total,
+                 'pending_posts': len(_pending)}
+    if _last_flush:
+        stats.update({
+            'last_flush_ago_s': round(time.time() - _last_flush['at'], 1),
+            'last_flush_views': _last_flush['views'],
+            'last_flush_ms': round(_last_flush['duration'] * 1000, 1),
+        })
+    return stats
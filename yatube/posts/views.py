@@ -1,80 +1,223 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpRequest
+from django.http import Http404, HttpResponse, HttpRequest, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
 
+from . import feed_cache, follows, ranking, view_counts, write_queue
+from .conditional import (conditional_page, follow_stamps, group_stamps,
+                          index_stamps, page_object_or_404, post_stamps,
+                          profile_stamps)
 from .forms import PostForm, CommentForm
-from .models import Post, Group, User, Comment, Follow
+from .models import AuthorStats, Post, Group, User, Comment
+from .pagination import CursorPage, decode_cursor, get_cursor_page
+from .search import SearchResults
+from .timeline import Timeline
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+
+
+def uses_keyset(request: HttpRequest) -> bool:
+    """This function tells whether the requested view is listed
+    in settings.KEYSET_PAGINATION_VIEWS."""
+    match = request.resolver_match
+    return bool(match and match.url_name in settings.KEYSET_PAGINATION_VIEWS)
 
 
 def paginator(request: HttpRequest, posts):
     """This function takes an HTTP request and a list
     of posts as input and returns a paginated page
-    object containing the posts."""
-    paginator = Paginator(posts, 10)
+    object containing the posts.
+    Views listed in settings.KEYSET_PAGINATION_VIEWS get a cursor
+    page keyed on (pub_date, id) instead of a numbered one."""
+    if uses_keyset(request):
+        return get_cursor_page(posts, POSTS_PER_PAGE,
+                               after=decode_cursor(request.GET.get('after')),
+                               before=decode_cursor(request.GET.get('before')))
+    paginator = Paginator(posts, POSTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return(page_obj)
 
 
+def ids_paginator(request: HttpRequest, ids):
+    """This function works like paginator() for a sequence of post
+    ids in the order they are shown, such as a timeline or a top list.
+    The posts of the page are fetched in one query."""
+    page_obj = Paginator(ids, POSTS_PER_PAGE).get_page(
+        request.GET.get('page'))
+    posts = Post.objects.feed().in_bulk(page_obj.object_list)
+    page_obj.object_list = [posts[pk] for pk in page_obj.object_list
+                            if pk in posts]
+    return page_obj
+
+
+def timeline_paginator(request: HttpRequest, timeline: Timeline):
+    """This function works like ids_paginator() for a timeline.
+    Views listed in settings.KEYSET_PAGINATION_VIEWS get a cursor
+    page keyed on (pub_date, id), sought in the timeline itself."""
+    if not uses_keyset(request):
+        return ids_paginator(request, timeline)
+    before = decode_cursor(request.GET.get('before'))
+    after = decode_cursor(request.GET.get('after'))
+    if before is not None:
+        # one extra id tells whether there are newer pages
+        ids = timeline.seek(before, POSTS_PER_PAGE + 1, newer=True)
+        has_next, has_previous = True, len(ids) > POSTS_PER_PAGE
+        ids = ids[-POSTS_PER_PAGE:]
+    else:
+        ids = timeline.seek(after, POSTS_PER_PAGE + 1)
+        has_next, has_previous = len(ids) > POSTS_PER_PAGE, after is not None
+        ids = ids[:POSTS_PER_PAGE]
+    posts = Post.objects.feed().in_bulk(ids)
+    return CursorPage([posts[pk] for pk in ids if pk in posts],
+                      has_next, has_previous)
+
+
+def cached_paginator(request: HttpRequest, posts, scope: str):
+    """This function works like paginator() but keeps the page
+    in the cache until a post or group of the feed changes.
+    It returns the page object and the context for the cached
+    fragment of the posts list."""
+    key = feed_cache.page_key(scope,
+                              uses_keyset(request),
+                              request.GET.get('page'),
+                              request.GET.get('after'),
+                              request.GET.get('before'))
+    page_obj = feed_cache.get_page(key)
+    if page_obj is None:
+        page_obj = paginator(request, posts)
+        feed_cache.set_page(key, page_obj)
+    return page_obj, {'feed_key': key,
+                      'feed_cache_timeout': feed_cache.timeout()}
+
+
+@conditional_page(index_stamps)
 def index(request: HttpRequest) -> HttpResponse:
     """This function takes an HTTP request as input and
     returns the ten most recent posts on the homepage."""
     template = 'posts/index.html'
-    post_list = Post.objects.all()
-    page_obj = paginator(request, post_list)
-    context = {'page_obj': page_obj, }
+    post_list = Post.objects.feed()
+    page_obj, feed_context = cached_paginator(request, post_list, 'index')
+    context = {'page_obj': page_obj,
+               **feed_context}
     return render(request, template, context)
 
 
+@conditional_page(index_stamps)
+def search(request: HttpRequest) -> HttpResponse:
+    """This function takes an HTTP request as input and returns
+    the posts matching the ?q= query, best matches first,
+    with the matched words highlighted."""
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    page_obj = Paginator(SearchResults(query), POSTS_PER_PAGE).get_page(
+        request.GET.get('page'))
+    context = {'query': query,
+               'page_obj': page_obj,
+               'page_query': urlencode({'q': query}) + '&'}
+    return render(request, template, context)
+
+
+@conditional_page(group_stamps)
 def group_posts(request: HttpRequest, slug: str) -> HttpResponse:
     """This function takes an HTTP request and a slug (a short label)
     as input and returns the ten most recent posts that belong
     to the specified group.."""
     template = 'posts/group_list.html'
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = paginator(request, posts)
+    group = page_object_or_404(request, Group.objects.all(), slug=slug)
+    posts = group.posts.feed()
+    page_obj, feed_context = cached_paginator(request, posts,
+                                              f'group:{group.pk}')
     context = {'group': group,
-               'page_obj': page_obj, }
+               'page_obj': page_obj,
+               **feed_context}
     return render(request, template, context)
 
 
+@conditional_page(profile_stamps)
 def profile(request: HttpRequest, username: str) -> HttpResponse:
     """This function takes an HTTP request and a username as input
     and returns the user's profile page, along with all of their
     posts and the option to follow or unfollow them."""
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=author)
-    author_post = author.posts.filter(author=author)
-    post_count = posts.count()
-    page_obj = paginator(request, author_post)
-    following = Follow.objects.filter(
-        user=request.user and request.user.is_authenticated,
-        author=author).exists()
+    author = page_object_or_404(request, User.objects.all(),
+                                username=username)
+    author_post = author.posts.feed()
+    post_count = AuthorStats.get_for(author).posts
+    page_obj, feed_context = cached_paginator(request, author_post,
+                                              f'profile:{author.pk}')
+    pending_posts = (write_queue.pending_posts(request.user)
+                     if request.user.pk == author.pk else [])
     context = {'post_count': post_count,
                'author': author,
                'page_obj': page_obj,
-               'following': following}
+               'pending_posts': pending_posts,
+               **feed_context}
     return render(request, template, context)
 
 
+def comments_page(request: HttpRequest, post_id: int):
+    """Returns a CursorPage of the post's comments, newest first,
+    starting after the ?after= cursor."""
+    comments = (Comment.objects.filter(post_id=post_id)
+                .select_related('author')
+                .only('text', 'created', 'post_id', 'author__username'))
+    return get_cursor_page(comments, COMMENTS_PER_PAGE,
+                           after=decode_cursor(request.GET.get('after')),
+                           field='created')
+
+
+@conditional_page(post_stamps)
 def post_detail(request: HttpRequest, post_id: int) -> HttpResponse:
     """This function takes an HTTP request and a post ID as input and
     returns a page containing the post's details, including
-    the author, text, and comments."""
+    the author, text, and the first page of comments.
+    Anonymous visitors get the whole page from the cache.
+    Every page served counts as a view of the post."""
     template = 'posts/post_detail.html'
-    post_page = Post.objects.get(pk=post_id)
-    post_count = Post.objects.filter(author=post_page.author).count()
-    comments = Comment.objects.filter(post_id=post_id)
+    cacheable = (not request.user.is_authenticated
+                 and 'after' not in request.GET)
+    if cacheable:
+        content = feed_cache.get_post_page(post_id)
+        if content is not None:
+            view_counts.hit(post_id)
+            return HttpResponse(content)
+    post_page = get_object_or_404(
+        Post.objects.feed().select_related('author__stats'), pk=post_id)
+    view_counts.hit(post_page.pk)
+    stamps = feed_cache.post_versions(post_page.pk, post_page.author_id)
+    post_count = AuthorStats.get_for(post_page.author).posts
+    comments = comments_page(request, post_id)
     form = CommentForm()
     context = {'post_page': post_page,
                'post_count': post_count,
                'form': form,
-               'comments': comments}
-    return render(request, template, context)
+               'comments': comments,
+               'pending_comments': write_queue.pending_comments(
+                   request.user, post_page.pk),
+               'post_key': f'{post_page.pk}:{stamps}',
+               'feed_cache_timeout': feed_cache.timeout()}
+    response = render(request, template, context)
+    if cacheable:
+        feed_cache.set_post_page(post_page, stamps, response.content)
+    return response
+
+
+def post_comments(request: HttpRequest, post_id: int) -> JsonResponse:
+    """This function takes an HTTP request and a post ID as input and
+    returns the next page of the post's comments as an HTML fragment
+    in JSON, for the "load more" button of the post page."""
+    comments = comments_page(request, post_id)
+    if not comments and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    html = render_to_string('posts/includes/comments.html',
+                            {'comments': comments}, request)
+    return JsonResponse({'html': html, 'next': comments.next_cursor})
 
 
 @login_required
@@ -88,11 +231,13 @@ def post_create(request: HttpRequest) -> HttpResponse:
         post_author = Post(author=request.user)
         form = PostForm(request.POST or None,
                         files=request.FILES or None,
-                        instance=post_author)
+                        instance=post_author,
+                        upload_errors=getattr(request, 'upload_errors', None))
         if form.is_valid():
-            form.cleaned_data['text']
-            form.cleaned_data['group']
-            form.save()
+            if settings.WRITE_BEHIND:
+                write_queue.enqueue_post(request.user, form.cleaned_data)
+            else:
+                form.save()
             return redirect('posts:profile', request.user)
         return render(request, template, {'form': form})
     return render(request, template, context)
@@ -108,7 +253,8 @@ def post_edit(request: HttpRequest, post_id: int) -> HttpResponse:
     is_edit = True
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
-                    instance=post)
+                    instance=post,
+                    upload_errors=getattr(request, 'upload_errors', None))
     if form.is_valid():
         form.save()
         return redirect('posts:post_detail', post_id=post_id)
@@ -125,7 +271,10 @@ def add_comment(request: HttpRequest, post_id: int) -> HttpResponse:
     and allows the user to add a comment to the specified post."""
     form = CommentForm(request.POST or None)
     post = get_object_or_404(Post, pk=post_id)
-    if form.is_valid():
+    if form.is_valid() and settings.WRITE_BEHIND:
+        write_queue.enqueue_comment(request.user, post,
+                                    form.cleaned_data['text'])
+    elif form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
@@ -134,34 +283,61 @@ def add_comment(request: HttpRequest, post_id: int) -> HttpResponse:
 
 
 @login_required
+@conditional_page(follow_stamps)
 def follow_index(request: HttpRequest) -> HttpResponse:
     """This function takes an HTTP request as input and returns a page
     containing all of the posts from the users
-    the current user is following."""
+    the current user is following.
+    Post ids come pre-sorted from the user's timeline."""
     template = 'posts/follow.html'
-    posts_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator(request, posts_list)
+    page_obj = timeline_paginator(request, Timeline(request.user))
+    context = {'page_obj': page_obj, }
+    return render(request, template, context)
+
+
+def trending(request: HttpRequest) -> HttpResponse:
+    """This function takes an HTTP request as input and returns
+    the posts with the most recent activity, best first."""
+    template = 'posts/trending.html'
+    page_obj = ids_paginator(request, ranking.top_posts())
     context = {'page_obj': page_obj, }
     return render(request, template, context)
 
 
+def group_trending(request: HttpRequest, slug: str) -> HttpResponse:
+    """This function takes an HTTP request and a slug as input and
+    returns the posts of the group with the most recent activity."""
+    template = 'posts/trending.html'
+    group = get_object_or_404(Group, slug=slug)
+    page_obj = ids_paginator(request, ranking.top_posts(group.pk))
+    context = {'group': group,
+               'page_obj': page_obj, }
+    return render(request, template, context)
+
+
+def trending_groups(request: HttpRequest) -> HttpResponse:
+    """This function takes an HTTP request as input and returns
+    the groups with the most recent activity, best first."""
+    template = 'posts/trending_groups.html'
+    group_ids = ranking.top_groups()
+    groups = Group.objects.in_bulk(group_ids)
+    context = {'groups': [groups[pk] for pk in group_ids if pk in groups]}
+    return render(request, template, context)
+
+
 @login_required
 def profile_follow(request, username):
     """This function takes an HTTP request and a username as input
     and allows the user to follow the specified user."""
-    template = 'posts:profile'
-    author = User.objects.get(username=username)
-    exist_following = Follow.objects.filter(user=request.user,
-                                            author=author).exists()
-    if request.user.username != username and not exist_following:
-        Follow.objects.create(user=request.user, author=author)
-    return redirect(template, username=username)
+    author = get_object_or_404(User, username=username)
+    follows.follow(request.user, author)
+    return redirect('posts:profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
     """This function takes an HTTP request and a username as input
     and allows the user to unfollow the specified user."""
-    author = User.objects.get(username=username)
-    Follow.objects.get(user=request.user, author=author).delete()
+    author = get_object_or_404(User, username=username)
+    follows.unfollow(request.user, author)
     return redirect('posts:profile', username=username)
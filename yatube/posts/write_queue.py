@@ -0,0 +1,336 @@
+"""Write-behind queue for new comments and posts (settings.WRITE_BEHIND).
+
+Under a burst of comments every request waits for the write lock of
+the main database and holds it for the comment, the counters and the
+cache invalidation. In write-behind mode the views only append the new
+object to a queue in its own small SQLite file (WAL, so a committed
+append survives a crash of the process) and return. A consumer thread
+in every worker process takes the oldest rows in batches, writes them
+with bulk_create and the same derived updates as posts.signals in one
+transaction, and then deletes them from the queue.
+
+A batch is leased to one consumer for settings.WRITE_QUEUE_LEASE
+seconds, so workers do not write the same rows twice; the rows of a
+consumer that died are taken over when the lease expires. A crash
+between the commit of a batch and its deletion from the queue is the
+only way a row gets written twice.
+
+Authors see their queued comments and posts until they are written
+(pending_comments(), pending_posts()); stats() reports the depth of
+the queue and the delay of the last flushes."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+
+from . import feed_cache, ranking, search, thumbnails, timeline
+from .models import AuthorStats, Comment, Group, Post, User
+
+COMMENT = 'comment'
+POST = 'post'
+# flushes kept for stats()
+FLUSH_HISTORY = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    author_id INTEGER NOT NULL,
+    post_id INTEGER,
+    data TEXT NOT NULL,
+    queued REAL NOT NULL,
+    leased_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS queue_author ON queue (author_id, kind);
+CREATE TABLE IF NOT EXISTS flushes (
+    flushed REAL NOT NULL,
+    items INTEGER NOT NULL,
+    max_lag REAL NOT NULL,
+    duration REAL NOT NULL
+);
+'''
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+_consumer = None
+
+
+class WriteQueue:
+    """The queue file, shared by all worker processes on one machine."""
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after fork."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def append(self, kind: str, author_id: int, post_id, data: dict):
+        with self._write() as db:
+            db.execute('INSERT INTO queue (kind, author_id, post_id, data, '
+                       'queued) VALUES (?, ?, ?, ?, ?)',
+                       (kind, author_id, post_id, json.dumps(data),
+                        time.time()))
+
+    def lease(self, limit: int, seconds: float) -> list:
+        """Takes the oldest rows nobody is writing for the given time."""
+        now = time.time()
+        with self._write() as db:
+            rows = db.execute(
+                'SELECT id, kind, author_id, post_id, data, queued '
+                'FROM queue WHERE leased_until < ? ORDER BY id LIMIT ?',
+                (now, limit)).fetchall()
+            if rows:
+                placeholders = ','.join('?' * len(rows))
+                db.execute(f'UPDATE queue SET leased_until = ? '
+                           f'WHERE id IN ({placeholders})',
+                           [now + seconds, *(row[0] for row in rows)])
+        return rows
+
+    def done(self, rows: list, duration: float) -> None:
+        """Drops written rows and records the flush."""
+        now = time.time()
+        placeholders = ','.join('?' * len(rows))
+        with self._write() as db:
+            db.execute(f'DELETE FROM queue WHERE id IN ({placeholders})',
+                       [row[0] for row in rows])
+            db.execute('INSERT INTO flushes VALUES (?, ?, ?, ?)',
+                       (now, len(rows), now - min(row[5] for row in rows),
+                        duration))
+            db.execute('DELETE FROM flushes WHERE rowid <= '
+                       '(SELECT MAX(rowid) FROM flushes) - ?',
+                       (FLUSH_HISTORY,))
+
+    def by_author(self, author_id: int, kind: str, post_id=None) -> list:
+        sql = ('SELECT data, queued FROM queue '
+               'WHERE author_id = ? AND kind = ?')
+        params = [author_id, kind]
+        if post_id is not None:
+            sql += ' AND post_id = ?'
+            params.append(post_id)
+        return self._db.execute(sql + ' ORDER BY id DESC', params).fetchall()
+
+    def stats(self) -> dict:
+        db = self._db
+        depth, oldest = db.execute(
+            'SELECT COUNT(*), MIN(queued) FROM queue').fetchone()
+        flushes = db.execute(
+            'SELECT items, max_lag, duration FROM flushes '
+            'ORDER BY rowid DESC LIMIT 20').fetchall()
+        stats = {'depth': depth,
+                 'oldest_ms': round((time.time() - oldest) * 1000)
+                 if oldest else 0,
+                 'flushes': len(flushes)}
+        if flushes:
+            items, lags, durations = zip(*flushes)
+            stats.update({
+                'items_per_flush': round(sum(items) / len(items), 1),
+                'lag_ms_max': round(max(lags) * 1000),
+                'flush_ms_avg': round(sum(durations) / len(durations)
+                                      * 1000, 1),
+            })
+        return stats
+
+
+_queues = {}
+
+
+def get_queue() -> WriteQueue:
+    """The queue of settings.WRITE_QUEUE_PATH; starts the consumer
+    of this process on first use."""
+    path = settings.WRITE_QUEUE_PATH
+    with _lock:
+        if path not in _queues:
+            _queues[path] = WriteQueue(path)
+    start_consumer()
+    return _queues[path]
+
+
+def enqueue_comment(author, post, text: str) -> None:
+    get_queue().append(COMMENT, author.pk, post.pk, {'text': text})
+    feed_cache.invalidate(f'queued:{author.pk}')
+
+
+def enqueue_post(author, cleaned_data: dict) -> None:
+    """The image is saved to the storage now, the post later."""
+    image = cleaned_data.get('image')
+    name = ''
+    if image:
+        name = default_storage.save(
+            Post.image.field.generate_filename(None, image.name), image)
+    group = cleaned_data.get('group')
+    get_queue().append(POST, author.pk, None, {
+        'text': cleaned_data['text'],
+        'group_id': group.pk if group else None,
+        'image': name,
+    })
+    feed_cache.invalidate(f'queued:{author.pk}')
+
+
+def _queued_at(queued: float) -> datetime:
+    return datetime.fromtimestamp(queued, timezone.utc)
+
+
+def pending_comments(user, post_id: int) -> list:
+    """Unsaved comments of the user on the post still in the queue,
+    newest first."""
+    if not settings.WRITE_BEHIND or not user.is_authenticated:
+        return []
+    return [Comment(post_id=post_id, author=user, created=_queued_at(queued),
+                    **json.loads(data))
+            for data, queued in get_queue().by_author(user.pk, COMMENT,
+                                                      post_id)]
+
+
+def pending_posts(user) -> list:
+    """Unsaved posts of the user still in the queue, newest first."""
+    if not settings.WRITE_BEHIND or not user.is_authenticated:
+        return []
+    return [Post(author=user, pub_date=_queued_at(queued),
+                 **json.loads(data))
+            for data, queued in get_queue().by_author(user.pk, POST)]
+
+
+def flush(limit: int = None) -> int:
+    """Writes one batch of queued rows into the database,
+    returns the number of rows taken from the queue."""
+    queue = get_queue()
+    rows = queue.lease(limit or settings.WRITE_QUEUE_BATCH,
+                       settings.WRITE_QUEUE_LEASE)
+    if not rows:
+        return 0
+    started = time.perf_counter()
+    write(rows)
+    queue.done(rows, time.perf_counter() - started)
+    return len(rows)
+
+
+def write(rows: list) -> None:
+    """Saves the rows in one transaction. Rows whose author, post or
+    group was deleted while they waited are dropped or fixed up."""
+    authors = set(User.objects.filter(
+        pk__in={row[2] for row in rows}).values_list('pk', flat=True))
+    posts = set(Post.objects.filter(
+        pk__in={row[3] for row in rows if row[1] == COMMENT})
+        .values_list('pk', flat=True))
+    groups = set(Group.objects.filter(
+        pk__in={json.loads(row[4]).get('group_id') for row in rows
+                if row[1] == POST}).values_list('pk', flat=True))
+    comments, new_posts = [], []
+    for _, kind, author_id, post_id, data, _ in rows:
+        data = json.loads(data)
+        if author_id not in authors:
+            continue
+        if kind == COMMENT and post_id in posts:
+            comments.append(Comment(author_id=author_id, post_id=post_id,
+                                    **data))
+        elif kind == POST:
+            if data['group_id'] not in groups:
+                data['group_id'] = None
+            new_posts.append(Post(author_id=author_id, **data))
+    with transaction.atomic():
+        if comments:
+            write_comments(comments)
+        if new_posts:
+            write_posts(new_posts)
+        feed_cache.invalidate(*{f'queued:{row[2]}' for row in rows})
+
+
+def write_comments(comments: list) -> None:
+    """bulk_create skips posts.signals, so their updates are
+    made here for the whole batch."""
+    Comment.objects.bulk_create(comments)
+    AuthorStats.change_many(
+        'comments', Counter(comment.author_id for comment in comments))
+    per_post = Counter(comment.post_id for comment in comments)
+    by_count = defaultdict(list)
+    for post_id, count in per_post.items():
+        by_count[count].append(post_id)
+    for count, post_ids in by_count.items():
+        Post.objects.filter(pk__in=post_ids).update(
+            comment_count=F('comment_count') + count)
+    ranking.record('comment', per_post)
+    feed_cache.invalidate(*(f'post:{post_id}' for post_id in per_post))
+
+
+def write_posts(posts: list) -> None:
+    Post.objects.bulk_create(posts)
+    # SQLite does not return the pks from bulk_create; the batch
+    # is the newest rows, as the transaction holds the write lock
+    created = list(Post.objects.order_by('-pk')
+                   .only('author_id', 'group_id', 'pub_date', 'text',
+                         'image')[:len(posts)])
+    AuthorStats.change_many(
+        'posts', Counter(post.author_id for post in created))
+    timeline.fan_out_many(created)
+    search.index_posts(created)
+    scopes = {'index'}
+    for post in created:
+        scopes.update((f'post:{post.pk}', f'profile:{post.author_id}'))
+        if post.group_id:
+            scopes.add(f'group:{post.group_id}')
+    feed_cache.invalidate(*scopes)
+    for post in created:
+        if post.image:
+            thumbnails.schedule(post.pk)
+
+
+def _consume() -> None:
+    while True:
+        time.sleep(settings.WRITE_QUEUE_INTERVAL)
+        try:
+            while flush():
+                pass
+        except Exception:
+            logger.exception('Write queue flush failed')
+        finally:
+            connections.close_all()
+
+
+def start_consumer() -> None:
+    """Starts the background consumer of this process once, unless
+    WRITE_QUEUE_INTERVAL is 0 and the queue is flushed by the
+    flush_write_queue command (and in tests)."""
+    global _consumer
+    if not settings.WRITE_QUEUE_INTERVAL:
+        return
+    with _lock:
+        if _consumer is None or not _consumer.is_alive():
+            _consumer = threading.Thread(target=_consume, daemon=True,
+                                         name='write-queue')
+            _consumer.start()
+
+
+def stats() -> dict:
+    return get_queue().stats()
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,13 +92,53 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Соединение живёт в процессе между запросами CONN_MAX_AGE секунд,
+# так что прагмы SQLITE_PRAGMAS выполняются не на каждый запрос.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# Прагмы для каждого нового соединения с SQLite (core.db). WAL — чтобы
+# читатели не ждали писателя; synchronous=NORMAL в WAL не теряет данных
+# при падении процесса, только последние транзакции при отключении
+# питания; файл базы отображается в память (mmap_size, байты), кэш
+# страниц — 64 МБ (отрицательный cache_size — в КБ), а занятая база
+# ждёт до busy_timeout мс вместо ошибки «database is locked».
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+# Реплики для чтения (core.routers): пути к файлам через запятую
+# в переменной окружения YATUBE_REPLICAS. Локально это копии db.sqlite3,
+# которые обновляет команда sync_replicas. Страницы из REPLICA_VIEWS
+# читаются с реплик, если посетитель ничего не менял последние
+# REPLICA_STICKY_SECONDS секунд; отрисованные по реплике страницы лежат
+# в кэше не дольше REPLICA_CACHE_TIMEOUT секунд.
+REPLICA_FILES = [path for path in
+                 os.environ.get('YATUBE_REPLICAS', '').split(',') if path]
+DATABASE_REPLICAS = []
+for number, path in enumerate(REPLICA_FILES, 1):
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': path,
+                                     'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+REPLICA_VIEWS = {
+    'posts:index', 'posts:group_list', 'posts:profile', 'posts:post_detail',
+    'posts:follow_index', 'posts:trending', 'posts:trending_groups',
+    'posts:group_trending', 'about:author', 'about:tech',
+}
+REPLICA_STICKY_SECONDS = 10
+REPLICA_CACHE_TIMEOUT = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -150,6 +192,93 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кэш в файле SQLite общий для всех процессов gunicorn на сервере.
+# Для кэша в памяти процесса: 'django.core.cache.backends.locmem.LocMemCache'
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', }}
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        }, }}
+
+# Ленты, которые листаются курсором по (pub_date, id) вместо номеров страниц.
+# Например: ('index', 'group_list', 'profile', 'follow_index')
+KEYSET_PAGINATION_VIEWS = ()
+
+# Лента подписок: сколько последних постов хранится у каждого читателя
+# и начиная с какого числа подписчиков посты автора не рассылаются
+# по лентам, а подмешиваются при чтении.
+TIMELINE_LENGTH = 500
+TIMELINE_FANOUT_LIMIT = 5000
+
+# Сколько живут закэшированные страницы лент. Устаревшие страницы
+# вытесняются сигналами при изменении постов и групп, срок — страховка.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Потоки, в которых готовятся миниатюры картинок постов.
+# Каждый держит в памяти не больше одной раскодированной картинки,
+# то есть до POST_IMAGE_MAX_PIXELS * 4 байт. При 0 миниатюры готовятся
+# сразу после коммита в том же потоке (так в yatube.settings_test).
+THUMBNAIL_WORKERS = 2
+
+# Ограничения на картинки постов. Размер файла и число пикселей
+# проверяются, пока файл ещё загружается (posts.uploads).
+POST_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 25_000_000
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.ImageLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Поиск по постам: 'fts5' — таблица FTS5 в SQLite, 'index' — обратный
+# индекс в файлах SEARCH_INDEX_DIR. None — FTS5, если SQLite его умеет.
+SEARCH_BACKEND = None
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, 'search_index')
+
+# Админка не считает COUNT(*) по таблице без фильтров, если в ней больше
+# строк, чем здесь, а берёт оценку по наибольшему id.
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+# Метрики запросов (core.metrics), работают и без DEBUG. Замеряется доля
+# METRICS_SAMPLE_RATE запросов (0 — выключено): число и время SQL,
+# отрисовка шаблонов, попадания в кэш и общая задержка. Суммы по
+# страницам раз в METRICS_FLUSH_INTERVAL секунд дописываются строкой
+# JSON в METRICS_FILE, текущие видны сотрудникам на /metrics/.
+METRICS_SAMPLE_RATE = 0.1
+METRICS_FLUSH_INTERVAL = 60
+METRICS_FILE = os.path.join(BASE_DIR, 'metrics', 'metrics.jsonl')
+# Отдавать ли замеры в заголовке Server-Timing (видно в DevTools).
+METRICS_SERVER_TIMING = True
+
+# Отложенная запись комментариев и постов (posts.write_queue). Если
+# включена, запрос только дописывает их в очередь WRITE_QUEUE_PATH, а в
+# базу их пачками до WRITE_QUEUE_BATCH штук переносит фоновый поток
+# каждого процесса раз в WRITE_QUEUE_INTERVAL секунд (при 0 — только
+# команда flush_write_queue). Пачку, которую не дописал упавший процесс,
+# другой забирает через WRITE_QUEUE_LEASE секунд.
+WRITE_BEHIND = False
+WRITE_QUEUE_PATH = os.path.join(BASE_DIR, 'write_queue', 'queue.sqlite3')
+WRITE_QUEUE_INTERVAL = 1
+WRITE_QUEUE_BATCH = 500
+WRITE_QUEUE_LEASE = 60
+
+# Популярное (posts.ranking). Каждый комментарий и просмотр добавляет
+# посту и его группе RANKING_WEIGHTS['comment'] или ['view'] очков,
+# которые вдвое теряют вес каждые RANKING_HALF_LIFE секунд. Списки из RANKING_TOP_K лучших постов
+# (всех и каждой группы) и групп пересчитываются не чаще раза в
+# RANKING_REFRESH секунд. После смены весов или периода — команда
+# rebuild_ranking.
+RANKING_HALF_LIFE = 60 * 60 * 24
+RANKING_WEIGHTS = {'comment': 1, 'view': 0.1}
+RANKING_TOP_K = 100
+RANKING_REFRESH = 60
+
+# Просмотры постов (posts.view_counts) копятся в памяти процесса и
+# пишутся в базу одной транзакцией раз в VIEW_COUNT_FLUSH_INTERVAL секунд
+# (при 0 — только view_counts.flush()) или сразу, как только их набралось
+# VIEW_COUNT_MAX_PENDING. При падении процесса теряется не больше этого.
+VIEW_COUNT_FLUSH_INTERVAL = 5
+VIEW_COUNT_MAX_PENDING = 10_000
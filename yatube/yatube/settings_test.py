@@ -0,0 +1,30 @@
+"""Settings for the test suite: the project settings with resources
+a test run must not share with a running instance.
+
+    pytest                 (pytest.ini points here)
+    python manage.py test --settings=yatube.settings_test
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+# Свой файл кэша на каждый запуск тестов: тесты чистят кэш и оставляют
+# в нём записи по pk, которые не должны попасть ни в кэш рабочего
+# сервера, ни в следующий запуск с новой тестовой базой.
+TEST_CACHE_DIR = tempfile.mkdtemp(prefix='yatube-test-cache-')
+atexit.register(shutil.rmtree, TEST_CACHE_DIR, ignore_errors=True)
+CACHES = {'default': {**CACHES['default'],
+                      'LOCATION': os.path.join(TEST_CACHE_DIR,
+                                               'cache.sqlite3')}}
+
+# Без фоновых потоков: миниатюры, очередь записи и счётчики просмотров
+# пишутся сразу или по явному вызову, пока тестовая база и временная
+# MEDIA_ROOT ещё существуют. Замеры метрик тесты включают сами.
+THUMBNAIL_WORKERS = 0
+WRITE_QUEUE_INTERVAL = 0
+VIEW_COUNT_FLUSH_INTERVAL = 0
+METRICS_SAMPLE_RATE = 0